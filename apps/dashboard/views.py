@@ -7,7 +7,7 @@ from django.db import connection
 from django.utils import timezone
 from datetime import datetime
 from integration.models import MisImportedDoctor, MisImportedSpecialization, MisImportedPurpose, MisImportedMan
-from kpi_calc.views import dynamic_plan_fact_view
+from kpi_calc.views import dynamic_plan_fact_view, get_quality_results, get_plan_fact_rows, PLAN_FACT_COLUMNS
 from apps.core.db_utils import get_months_from_db, get_month_name
 
 @login_required
@@ -132,28 +132,15 @@ def doctor_dashboard(request):
         year = datetime.now().year
         month = datetime.now().month
     
-    columns = []
+    columns = PLAN_FACT_COLUMNS
     data = []
+    error_message = None
     
     try:
-        with connection.cursor() as cursor:
-            # Используем процедуру сравнения план-факт с фильтром по врачу
-            query = """
-                SELECT * FROM kpi.get_monthly_plan_fact_comparison(%s, %s, %s, NULL, NULL)
-            """
-            cursor.execute(query, [year, month, man_id])
-            
-            if cursor.description:
-                columns = [col[0] for col in cursor.description]
-                results = cursor.fetchall()
-            
-                for row in results:
-                    row_dict = {}
-                    for i, value in enumerate(row):
-                        col_name = columns[i] if i < len(columns) else f'col_{i}'
-                        row_dict[col_name] = value
-                    data.append(row_dict)
+        # Нарастающий итог план-факт с фильтром по врачу
+        data = get_plan_fact_rows(year, month, man_id)
     except Exception as e:
+        error_message = str(e)
         print(f"Ошибка при получении данных план-факт: {e}")
     
     # Получаем данные для выпадающих списков
@@ -198,6 +185,8 @@ def doctor_dashboard(request):
         'columns': columns,
         'data': data,
         'total': len(data),
+        'error_message': error_message,
+        'quality_results': get_quality_results(year, month, man_id),
         'doctor_id': man_id,
         'doctor_name': doctor_name,
         'is_doctor_dashboard': True,
@@ -277,30 +266,16 @@ def unified_plan_fact(request):
     specid = int(specid_param) if specid_param else None
     plan_vistype = int(plan_vistype_param) if plan_vistype_param else None
     
-    # Вызов хранимой процедуры
-    columns = []
+    # Нарастающий итог план-факт (KpiCumulative)
+    columns = PLAN_FACT_COLUMNS
     data = []
+    error_message = None
     
     try:
-        with connection.cursor() as cursor:
-            query = "SELECT * FROM kpi.get_monthly_plan_fact_comparison(%s, %s, %s, %s, %s)"
-            cursor.execute(query, [year, month, man_id, specid, plan_vistype])
-            
-            if cursor.description:
-                columns = [col[0] for col in cursor.description]
-            
-            results = cursor.fetchall()
-            
-            # Преобразуем в словари
-            for row in results:
-                row_dict = {}
-                for i, value in enumerate(row):
-                    col_name = columns[i] if i < len(columns) else f'col_{i}'
-                    row_dict[col_name] = value
-                data.append(row_dict)
-                
+        data = get_plan_fact_rows(year, month, man_id, specid, plan_vistype)
     except Exception as e:
-        print(f"❌ Ошибка SQL: {e}")
+        error_message = str(e)
+        print(f"❌ Ошибка при получении данных план-факт: {e}")
     
     # ДАННЫЕ ДЛЯ ФИЛЬТРОВ (только нужное)
     doctors_data = []
@@ -347,6 +322,8 @@ def unified_plan_fact(request):
         'columns': columns,
         'data': data,
         'total': len(data),
+        'error_message': error_message,
+        'quality_results': get_quality_results(year, month, man_id, specid),
 
         # Информация о пользователе
         'is_doctor_user': not is_manager,
@@ -1,18 +1,28 @@
 #apps/integration/admin.py
 
-from django.contrib import admin
-from .models import MisImportedVisit, MisImportedSpecialization, MisImportedPurpose, MisImportedDoctor, MisImportedMan
+import calendar
+from datetime import date, datetime
+from django.conf import settings
+from django.contrib import admin, messages
+from django.core.exceptions import PermissionDenied
+from django.db import connections
+from django.shortcuts import redirect
+from django.template.response import TemplateResponse
+from django.urls import path
+from .models import (MisImportedVisit, MisImportedSpecialization, MisImportedPurpose, MisImportedDoctor, MisImportedMan,
+                     ImportState, BackfillPartition, ImportRun, KpiDirtyPair)
 
 @admin.register(MisImportedDoctor)
 class MisImportedDoctorAdmin(admin.ModelAdmin):
-    list_display = ['keyid', 'docnamemis', 'specnamemis', 'depnamemis', 'imported_at']
-    list_filter = ['specnamemis', 'depnamemis', 'imported_at']
+    list_display = ['keyid', 'source_id', 'docnamemis', 'specnamemis', 'depnamemis', 'imported_at']
+    list_filter = ['source_id', 'specnamemis', 'depnamemis', 'imported_at']
     search_fields = ['docnamemis', 'specnamemis', 'depnamemis']
     readonly_fields = ['imported_at']
 
 @admin.register(MisImportedMan)
 class MisImportedManAdmin(admin.ModelAdmin):
-    list_display = ['keyid', 'manidmis', 'text', 'imported_at']
+    list_display = ['keyid', 'source_id', 'manidmis', 'text', 'imported_at']
+    list_filter = ['source_id']
     search_fields = ['text']
     readonly_fields = ['imported_at']
 
@@ -33,10 +43,191 @@ class MisImportedPurposeAdmin(admin.ModelAdmin):
 @admin.register(MisImportedVisit)
 class MisImportedVisitAdmin(admin.ModelAdmin):
     list_display = [
-        'keyid', 'keyidmis', 'num', 'dat', 'doctorname', 'depname', 
+        'keyid', 'source_id', 'keyidmis', 'num', 'dat', 'doctorname', 'depname', 
         'vistype', 'imported_at'
     ]
-    list_filter = ['dat', 'depname', 'vistype', 'imported_at']
+    list_filter = ['source_id', 'dat', 'depname', 'vistype', 'imported_at']
     search_fields = ['num', 'doctorname', 'depname', 'keyidmis']
     readonly_fields = ['imported_at']
-    date_hierarchy = 'dat'
\ No newline at end of file
+    date_hierarchy = 'dat'
+    change_list_template = 'admin/integration/misimportedvisit/change_list.html'
+
+    # Перезагрузка идет внутри запроса - больше дней за раз запускайте командой reconcile_mis_visits
+    RECONCILE_MAX_DAYS = 3
+
+    def has_reimport_permission(self, request):
+        """Перезагрузка дней удаляет и переписывает визиты"""
+        return self.has_change_permission(request) and self.has_delete_permission(request)
+
+    def get_urls(self):
+        urls = [
+            path('reconcile/', self.admin_site.admin_view(self.reconcile_view),
+                 name='integration_misimportedvisit_reconcile'),
+        ]
+        return urls + super().get_urls()
+
+    def reconcile_view(self, request):
+        """Сверка визитов с МИС за месяц и точечная перезагрузка дней"""
+        from .mis_connector import MISConnector, get_mis_sources
+        from .reconciliation import reconciliation_report, reimport_days
+
+        # Сверка - запросы к МИС за целый месяц: только для тех, кому доступны визиты
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+
+        sources = get_mis_sources()
+        source = request.POST.get('source') or request.GET.get('source')
+        if source not in sources:
+            source = sources[0] if sources else 'mis'
+        connector = MISConnector(using=source)
+
+        if request.method == 'POST':
+            if not self.has_reimport_permission(request):
+                raise PermissionDenied
+            back = f"{request.path}?month={request.POST.get('month', '')}&source={source}"
+            try:
+                days = sorted({datetime.strptime(day, '%Y-%m-%d').date() for day in request.POST.getlist('day')})
+            except ValueError:
+                self.message_user(request, "Некорректная дата дня", messages.ERROR)
+                return redirect(back)
+            
+            if len(days) > self.RECONCILE_MAX_DAYS:
+                self.message_user(
+                    request,
+                    f"За один раз можно перезагрузить не больше {self.RECONCILE_MAX_DAYS} дней. "
+                    f"Для большего диапазона: manage.py reconcile_mis_visits --reimport",
+                    messages.ERROR,
+                )
+            elif days:
+                totals = reimport_days(connector, days)
+                self.message_user(
+                    request,
+                    f"Перезагружено дней: {len(days)}. Новых {totals['created']}, "
+                    f"обновлено {totals['updated']}, удалено {totals['deleted']}",
+                    messages.SUCCESS,
+                )
+            return redirect(back)
+
+        try:
+            month = datetime.strptime(request.GET['month'], '%Y-%m').date()
+        except (KeyError, ValueError):
+            month = date.today().replace(day=1)
+        date_to = month.replace(day=calendar.monthrange(month.year, month.month)[1])
+
+        report = None
+        if connector.test_connection():
+            report = reconciliation_report(connector, month, date_to)
+        else:
+            self.message_user(request, "Нет подключения к МИС", messages.ERROR)
+
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': 'Сверка визитов с МИС',
+            'month': month.strftime('%Y-%m'),
+            'sources': sources,
+            'source': source,
+            'report': report,
+            'can_reimport': self.has_reimport_permission(request),
+        }
+        return TemplateResponse(request, 'admin/integration/reconcile.html', context)
+
+@admin.register(ImportState)
+class ImportStateAdmin(admin.ModelAdmin):
+    list_display = ['source', 'last_dat', 'last_keyid', 'updated_at']
+    readonly_fields = ['updated_at']
+
+@admin.register(BackfillPartition)
+class BackfillPartitionAdmin(admin.ModelAdmin):
+    list_display = ['source', 'date_from', 'date_to', 'status', 'attempts',
+                    'rows_extracted', 'rows_created', 'rows_updated', 'finished_at']
+    list_filter = ['source', 'status']
+    readonly_fields = ['finished_at']
+
+@admin.register(KpiDirtyPair)
+class KpiDirtyPairAdmin(admin.ModelAdmin):
+    list_display = ['source_id', 'doctor_id', 'period', 'marked_at']
+    list_filter = ['source_id', 'period']
+
+@admin.register(ImportRun)
+class ImportRunAdmin(admin.ModelAdmin):
+    list_display = ['started_at', 'command', 'source', 'status', 'rows_extracted', 'rows_inserted',
+                    'rows_updated', 'rows_skipped', 'query_seconds', 'transfer_seconds',
+                    'write_seconds', 'total_seconds', 'rows_per_second']
+    list_filter = ['command', 'source', 'status']
+    readonly_fields = [field.name for field in ImportRun._meta.fields]
+    change_list_template = 'admin/integration/importrun/change_list.html'
+
+    # Сколько последних успешных запусков показывать на графике
+    TREND_RUNS = 60
+
+    # Соединения с базой по приложениям и состояниям (idle, active, ...)
+    CONNECTION_STATS_SQL = """
+        SELECT application_name, state, count(*),
+               max(extract(epoch FROM now() - state_change))
+        FROM pg_stat_activity
+        WHERE datname = current_database()
+        GROUP BY 1, 2
+        ORDER BY 1, 2
+    """
+
+    def has_add_permission(self, request):
+        return False
+
+    def get_urls(self):
+        urls = [
+            path('connections/', self.admin_site.admin_view(self.connections_view),
+                 name='integration_importrun_connections'),
+        ]
+        return urls + super().get_urls()
+
+    def connections_view(self, request):
+        """Настройки переиспользования соединений и статистика соединений по каждой БД"""
+        databases = []
+        for alias, database in settings.DATABASES.items():
+            options = database.get('OPTIONS', {})
+            info = {
+                'alias': alias,
+                'conn_max_age': database.get('CONN_MAX_AGE'),
+                'health_checks': database.get('CONN_HEALTH_CHECKS'),
+                'statement_timeout': options.get('options', ''),
+                'pool': options.get('pool'),
+                'pool_stats': None,
+                'activity': [],
+                'error': '',
+            }
+            connection = connections[alias]
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute(self.CONNECTION_STATS_SQL)
+                    info['activity'] = cursor.fetchall()
+                pool = getattr(connection, 'pool', None)
+                if pool is not None:
+                    info['pool_stats'] = sorted(pool.get_stats().items())
+            except Exception as e:
+                info['error'] = str(e)
+            databases.append(info)
+
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': 'Соединения с базами данных',
+            'databases': databases,
+        }
+        return TemplateResponse(request, 'admin/integration/connections.html', context)
+
+    def changelist_view(self, request, extra_context=None):
+        """Добавляет к списку данные графика динамики длительности и скорости импорта"""
+        runs = list(
+            ImportRun.objects.filter(status=ImportRun.STATUS_SUCCESS)
+            .order_by('-started_at')[:self.TREND_RUNS]
+        )[::-1]
+        trend = {
+            'labels': [f"{run.started_at:%d.%m %H:%M} {run.command}" for run in runs],
+            'query_seconds': [round(run.query_seconds, 2) for run in runs],
+            'transfer_seconds': [round(run.transfer_seconds, 2) for run in runs],
+            'write_seconds': [round(run.write_seconds, 2) for run in runs],
+            'rows_per_second': [round(run.rows_per_second, 1) for run in runs],
+        }
+        extra_context = {**(extra_context or {}), 'import_trend': trend}
+        return super().changelist_view(request, extra_context=extra_context)
@@ -0,0 +1,104 @@
+#apps/integration/backfill.py
+
+"""
+Историческая догрузка визитов из МИС по партициям дат.
+Функции выполняются в отдельных процессах, поэтому модели
+импортируются внутри функций - после инициализации Django.
+"""
+
+import os
+import time
+from datetime import datetime, timedelta
+
+PARTITION_DAYS = {
+    'day': 1,
+    'week': 7,
+}
+
+
+def build_partitions(date_from, date_to, partition='day'):
+    """
+    Разбивает диапазон дат [date_from, date_to] на партиции.
+    Возвращает список пар (начало, конец) с концом не включительно.
+    """
+    step = timedelta(days=PARTITION_DAYS[partition])
+    end = date_to + timedelta(days=1)
+
+    partitions = []
+    current = date_from
+    while current < end:
+        partitions.append((current, min(current + step, end)))
+        current += step
+    return partitions
+
+
+def init_worker():
+    """Инициализация процесса-исполнителя: свои соединения с МИС и KPI"""
+    import django
+    from django.apps import apps
+
+    if not apps.ready:
+        # Процесс запущен через spawn (Windows) - Django нужно поднять заново
+        os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'kpi_core.settings')
+        django.setup()
+
+
+def run_partition(partition_id, chunk_size=5000, retries=2, retry_delay=5):
+    """
+    Выгружает и сохраняет одну партицию с повторами при ошибке.
+    Состояние партиции фиксируется в BackfillPartition.
+    Возвращает словарь с итогами партиции.
+    """
+    from django.db import connections
+    from django.utils import timezone
+    from .mis_connector import MISConnector
+    from .models import BackfillPartition
+
+    partition = BackfillPartition.objects.get(pk=partition_id)
+    connector = MISConnector(using=partition.source)
+
+    # В МИС время без часового пояса - границы партиции в локальном времени
+    start = datetime.combine(partition.date_from, datetime.min.time())
+    end = datetime.combine(partition.date_to, datetime.min.time())
+
+    started = time.monotonic()
+    error = ''
+    for attempt in range(1, retries + 2):
+        extracted = created_total = updated_total = 0
+        try:
+            for batch in connector.iter_visits('v.dat >= %s AND v.dat < %s', (start, end), chunk_size):
+                stats = connector.bulk_save_visits_to_db(batch, batch_size=chunk_size)
+                extracted += len(batch)
+                created_total += stats['created']
+                updated_total += stats['updated']
+            error = ''
+            break
+        except Exception as e:
+            error = str(e)
+            print(f"Ошибка партиции {partition.date_from} (попытка {attempt}): {e}")
+            # Сбрасываем соединения, чтобы повтор начался с чистого состояния
+            connections.close_all()
+            if attempt <= retries:
+                time.sleep(retry_delay * attempt)
+        finally:
+            partition.attempts += 1
+
+    partition.status = BackfillPartition.STATUS_FAILED if error else BackfillPartition.STATUS_DONE
+    partition.rows_extracted = extracted
+    partition.rows_created = created_total
+    partition.rows_updated = updated_total
+    partition.error = error
+    partition.finished_at = timezone.now()
+    partition.save()
+
+    return {
+        'source': partition.source,
+        'date_from': partition.date_from,
+        'date_to': partition.date_to,
+        'status': partition.status,
+        'rows': extracted,
+        'created': created_total,
+        'updated': updated_total,
+        'error': error,
+        'seconds': time.monotonic() - started,
+    }
@@ -0,0 +1,219 @@
+#apps/integration/bulk_loader.py
+
+"""
+Пакетная загрузка визитов в solution_med.import_visit.
+Пакет копируется через COPY во временную таблицу и сливается
+в основную одним INSERT ... ON CONFLICT на пакет; строки
+с неизменным хешем содержимого (row_hash) не перезаписываются.
+"""
+
+import csv
+import io
+from datetime import datetime
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils import timezone
+from .dirty_pairs import mark_dirty
+
+# Колонки промежуточной таблицы (источник и поля в порядке VISIT_FIELDS) и их типы
+VISIT_STAGE_COLUMNS = (
+    ('source_id', 'varchar(64)'),
+    ('keyidmis', 'bigint'),
+    ('num', 'bigint'),
+    ('casetypeid', 'integer'),
+    ('dat', 'timestamptz'),
+    ('dat1', 'timestamptz'),
+    ('vistype', 'integer'),
+    ('patientid', 'bigint'),
+    ('rootidmis', 'bigint'),
+    ('doctorid', 'bigint'),
+    ('doctorname', 'varchar(255)'),
+    ('depid', 'bigint'),
+    ('depname', 'varchar(255)'),
+    ('diag_code', 'varchar(12)'),
+    ('diag_text', 'varchar(512)'),
+    ('manid', 'bigint'),
+)
+
+VISIT_STAGE_TABLE = 'tmp_import_visit'
+
+# Ключ визита: ID из МИС уникален только в пределах источника
+VISIT_KEY_COLUMNS = ('source_id', 'keyidmis')
+
+COPY_NULL = '\\N'
+
+# Сколько символов передавать в COPY за одну запись (драйвер psycopg 3)
+COPY_CHUNK_SIZE = 65536
+
+# Хеш содержимого визита: ROW(...)::text различает NULL и пустую строку
+VISIT_HASH_SQL = "md5(ROW({columns})::text)"
+
+# Колонки, входящие в хеш: все, кроме ключа визита (см. также reconciliation)
+VISIT_HASH_COLUMNS = tuple(name for name, _ in VISIT_STAGE_COLUMNS if name not in VISIT_KEY_COLUMNS)
+
+# Тройки (источник, врач, период) визитов, которые изменятся при слиянии:
+# новые значения из пакета и прежние значения измененных строк
+VISIT_AFFECTED_SQL = """
+    SELECT s.source_id, s.doctorid, to_char(s.dat AT TIME ZONE %(tz)s, 'YYYY-MM')
+    FROM {stage} s
+    LEFT JOIN solution_med.import_visit iv
+        ON iv.source_id = s.source_id AND iv.keyidmis = s.keyidmis
+    WHERE iv.row_hash IS DISTINCT FROM s.row_hash
+    UNION
+    SELECT iv.source_id, iv.doctorid, to_char(iv.dat AT TIME ZONE %(tz)s, 'YYYY-MM')
+    FROM {stage} s
+    JOIN solution_med.import_visit iv
+        ON iv.source_id = s.source_id AND iv.keyidmis = s.keyidmis
+    WHERE iv.row_hash IS DISTINCT FROM s.row_hash
+"""
+
+# Перезаписываются только строки с изменившимся хешем;
+# (xmax = 0) истинно только для строк, вставленных этим же оператором
+VISIT_MERGE_SQL = """
+    WITH merged AS (
+        INSERT INTO solution_med.import_visit ({columns}, row_hash, imported_at)
+        SELECT {columns}, row_hash, now() FROM {stage}
+        ON CONFLICT (source_id, keyidmis) DO UPDATE SET {updates}, row_hash = EXCLUDED.row_hash
+        WHERE import_visit.row_hash IS DISTINCT FROM EXCLUDED.row_hash
+        RETURNING (xmax = 0) AS inserted
+    )
+    SELECT
+        count(*) FILTER (WHERE inserted),
+        count(*) FILTER (WHERE NOT inserted)
+    FROM merged
+"""
+
+
+def _copy_value(value, text_column):
+    """Представление значения для COPY в формате CSV"""
+    if value is None:
+        return COPY_NULL
+    if value == '' and not text_column:
+        # Пустая строка в числовой колонке сохраняется как NULL
+        return COPY_NULL
+    if isinstance(value, datetime):
+        # Как и ORM, считаем наивное время из МИС локальным временем проекта
+        if settings.USE_TZ and timezone.is_naive(value):
+            value = timezone.make_aware(value)
+        return value.isoformat()
+    return str(value)
+
+
+def copy_from(cursor, sql, source):
+    """
+    COPY ... FROM STDIN из файлоподобного объекта на обоих драйверах PostgreSQL:
+    psycopg2 - cursor.copy_expert, psycopg 3 (нужен для пула соединений) - cursor.copy
+    Возвращает количество скопированных строк
+    """
+    if hasattr(cursor, 'copy_expert'):
+        cursor.copy_expert(sql, source)
+        return cursor.rowcount
+
+    with cursor.copy(sql) as copy:
+        while True:
+            data = source.read(COPY_CHUNK_SIZE)
+            if not data:
+                break
+            copy.write(data)
+    return cursor.rowcount
+
+
+def copy_rows(cursor, table, columns, rows):
+    """
+    Копирует строки в таблицу через COPY FROM STDIN.
+    columns - последовательность пар (имя колонки, тип)
+    """
+    text_flags = [col_type.startswith(('varchar', 'text')) for _, col_type in columns]
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([
+            _copy_value(value, is_text) for value, is_text in zip(row, text_flags)
+        ])
+    buffer.seek(0)
+
+    column_names = ', '.join(name for name, _ in columns)
+    copy_from(
+        cursor,
+        f"COPY {table} ({column_names}) FROM STDIN WITH (FORMAT csv, NULL '{COPY_NULL}')",
+        buffer,
+    )
+
+
+def empty_upsert_stats():
+    """Пустые итоги слияния визитов"""
+    return {'created': 0, 'updated': 0, 'unchanged': 0, 'affected': set()}
+
+
+def add_upsert_stats(total, stats):
+    """Добавляет итоги пакета к общим итогам"""
+    for key in ('created', 'updated', 'unchanged'):
+        total[key] += stats[key]
+    total['affected'] |= stats['affected']
+    return total
+
+
+def upsert_visits(visit_rows, using='default'):
+    """
+    Сохраняет пакет визитов одним слиянием, перезаписывая только
+    строки, содержимое которых изменилось (сравнение по row_hash).
+    visit_rows - словари полей MisImportedVisit (см. visit_row_to_fields) с source_id
+    Возвращает {'created', 'updated', 'unchanged', 'affected'},
+    где affected - множество затронутых троек (source_id, doctorid, 'YYYY-MM')
+    """
+    # В одном INSERT ... ON CONFLICT строку нельзя обновить дважды,
+    # поэтому повторы ключа схлопываем: побеждает последняя, как при построчной записи
+    unique_rows = {}
+    for fields in visit_rows:
+        unique_rows[(fields['source_id'], fields['keyidmis'])] = fields
+
+    if not unique_rows:
+        return empty_upsert_stats()
+
+    column_names = [name for name, _ in VISIT_STAGE_COLUMNS]
+    columns_sql = ', '.join(column_names)
+    updates_sql = ', '.join(
+        f"{name} = EXCLUDED.{name}" for name in column_names if name not in VISIT_KEY_COLUMNS
+    )
+    hash_sql = VISIT_HASH_SQL.format(columns=', '.join(VISIT_HASH_COLUMNS))
+    columns_ddl = ', '.join(f"{name} {col_type}" for name, col_type in VISIT_STAGE_COLUMNS)
+
+    with transaction.atomic(using=using):
+        with connections[using].cursor() as cursor:
+            # Внутри внешней транзакции таблица может остаться от прошлого пакета
+            cursor.execute(
+                f"CREATE TEMP TABLE IF NOT EXISTS {VISIT_STAGE_TABLE} "
+                f"({columns_ddl}, row_hash char(32)) ON COMMIT DROP"
+            )
+            cursor.execute(f"TRUNCATE {VISIT_STAGE_TABLE}")
+            copy_rows(
+                cursor,
+                VISIT_STAGE_TABLE,
+                VISIT_STAGE_COLUMNS,
+                ([fields[name] for name in column_names] for fields in unique_rows.values()),
+            )
+            cursor.execute(f"UPDATE {VISIT_STAGE_TABLE} SET row_hash = {hash_sql}")
+
+            cursor.execute(
+                VISIT_AFFECTED_SQL.format(stage=VISIT_STAGE_TABLE),
+                {'tz': settings.TIME_ZONE},
+            )
+            affected = set(cursor.fetchall())
+
+            cursor.execute(VISIT_MERGE_SQL.format(
+                columns=columns_sql,
+                stage=VISIT_STAGE_TABLE,
+                updates=updates_sql,
+            ))
+            created, updated = cursor.fetchone()
+
+        # Отметки для инкрементального расчета KPI - в той же транзакции, что и визиты
+        mark_dirty(affected, using=using)
+
+    return {
+        'created': created,
+        'updated': updated,
+        'unchanged': len(unique_rows) - created - updated,
+        'affected': affected,
+    }
@@ -0,0 +1,88 @@
+#apps/integration/dirty_pairs.py
+
+"""
+Учет пар (источник, врач, период), визиты которых изменились при импорте.
+Импорт отмечает пары, инкрементальный расчет KPI пересчитывает только их
+и снимает ровно те отметки, которые прочитал перед расчетом.
+"""
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from .models import KpiDirtyPair
+
+
+def doctors_condition(doctors, doctor_field='doctor_id', source_field='source_id'):
+    """
+    Условие отбора строк указанных врачей: пары (source_id, doctor_id).
+    ID врача уникален только в пределах своей МИС, поэтому пары группируются
+    по источнику: одно условие doctor_field__in на источник.
+    """
+    by_source = {}
+    for source_id, doctor_id in doctors:
+        by_source.setdefault(source_id, set()).add(doctor_id)
+
+    condition = Q(pk__in=[])
+    for source_id, doctor_ids in by_source.items():
+        condition |= Q(**{source_field: source_id, f'{doctor_field}__in': doctor_ids})
+    return condition
+
+
+def mark_dirty(pairs, using='default', batch_size=1000):
+    """
+    Отмечает пары (source_id, doctor_id, 'YYYY-MM') как измененные.
+    Повторная отметка обновляет marked_at, чтобы расчет, уже читающий
+    старую отметку, не снял новую.
+    """
+    now = timezone.now()
+    objects = [
+        KpiDirtyPair(source_id=source_id, doctor_id=doctor_id, period=period, marked_at=now)
+        for source_id, doctor_id, period in pairs
+        if doctor_id is not None and period
+    ]
+    if objects:
+        KpiDirtyPair.objects.using(using).bulk_create(
+            objects,
+            batch_size=batch_size,
+            update_conflicts=True,
+            unique_fields=['source_id', 'doctor_id', 'period'],
+            update_fields=['marked_at'],
+        )
+    return len(objects)
+
+
+def pending_pairs(period=None):
+    """
+    Отмеченные пары по периодам: {'YYYY-MM': {(source_id, doctor_id): (pk, marked_at)}}.
+    (pk, marked_at) - прочитанная отметка, по ней clear_pairs снимает только ее
+    """
+    marks = KpiDirtyPair.objects.all()
+    if period is not None:
+        marks = marks.filter(period=period)
+
+    periods = {}
+    for pk, source_id, doctor_id, period, marked_at in marks.values_list(
+        'pk', 'source_id', 'doctor_id', 'period', 'marked_at'
+    ):
+        periods.setdefault(period, {})[(source_id, doctor_id)] = (pk, marked_at)
+    return periods
+
+
+def clear_pairs(marks):
+    """
+    Снимает отметки, прочитанные pending_pairs перед расчетом:
+    marks - {(source_id, doctor_id): (pk, marked_at)} одного периода.
+    Отметка, которую импорт за это время поставил заново (marked_at изменился),
+    или еще не зафиксированная при чтении, остается до следующего расчета.
+    Сравнение по прочитанным значениям, а не по времени начала расчета:
+    marked_at ставится до фиксации транзакции импорта и может оказаться раньше него.
+    """
+    read = dict(marks.values())
+    if not read:
+        return 0
+
+    with transaction.atomic():
+        # Блокировка строк: импорт не переотметит пару между проверкой и удалением
+        current = KpiDirtyPair.objects.select_for_update().filter(pk__in=list(read))
+        unchanged = [pk for pk, marked_at in current.values_list('pk', 'marked_at') if read[pk] == marked_at]
+        return KpiDirtyPair.objects.filter(pk__in=unchanged).delete()[0]
@@ -0,0 +1,264 @@
+#apps/integration/dump_ingest.py
+
+"""
+Загрузка выгрузок (дампов) таблиц МИС без подключения к МИС.
+Файлы копируются через COPY в промежуточную схему нашей БД,
+после чего визиты и справочники разбираются теми же запросами
+и тем же сопоставлением колонок, что и при выгрузке из МИС.
+
+Поддерживаемые форматы:
+    <таблица>.csv - CSV с заголовком
+    *.sql, *.copy - секция pg_dump: строка "COPY схема.таблица (колонки) FROM stdin;",
+                    данные в текстовом формате COPY и завершающая строка "\\."
+                    (одна секция на файл)
+
+Таблица может быть разбита на несколько файлов: visit_1.csv, visit_2.csv,
+visit.part3.csv - числовой суффикс имени отбрасывается, части с одинаковым
+набором колонок дописываются в одну промежуточную таблицу.
+
+Имена таблиц и колонок подставляются в SQL, поэтому принимаются только
+таблицы из DUMP_COLUMN_TYPES и идентификаторы из латиницы, цифр и '_'.
+"""
+
+import csv
+import re
+from contextlib import contextmanager
+from pathlib import Path
+from django.db import connections
+from .bulk_loader import copy_from
+
+DUMP_SCHEMA = 'mis_dump'
+
+# Типы колонок, которые используют запросы выгрузки; остальные колонки - text
+DUMP_COLUMN_TYPES = {
+    'visit': {
+        'keyid': 'bigint', 'num': 'bigint', 'casetypeid': 'integer',
+        'dat': 'timestamp', 'dat1': 'timestamp', 'vistype': 'integer',
+        'patientid': 'bigint', 'rootid': 'bigint', 'doctorid': 'bigint',
+    },
+    'docdep': {
+        'keyid': 'bigint', 'depid': 'bigint', 'docid': 'bigint',
+        'specid': 'bigint', 'status': 'integer',
+    },
+    'dep': {'keyid': 'bigint'},
+    'doctor': {'keyid': 'bigint', 'man_id': 'bigint'},
+    'man': {'keyid': 'bigint'},
+    'patdiag': {'keyid': 'bigint', 'visitid': 'bigint', 'diagid': 'bigint', 'diagtype': 'integer'},
+    'diagnos': {'keyid': 'bigint'},
+    'lu': {'keyid': 'bigint', 'tag': 'bigint', 'status': 'integer'},
+}
+
+# Какие таблицы нужны для каждой части загрузки
+VISIT_TABLES = {'visit', 'docdep', 'dep', 'doctor', 'man', 'patdiag', 'diagnos'}
+DOCTOR_TABLES = {'docdep', 'lu', 'doctor', 'man', 'dep'}
+
+COPY_HEADER_RE = re.compile(
+    r'^COPY\s+(?:"?[\w]+"?\.)?"?(?P<table>\w+)"?\s*\((?P<columns>[^)]*)\)\s+FROM\s+stdin',
+    re.IGNORECASE,
+)
+
+COPY_END = '\\.'
+
+IDENTIFIER_RE = re.compile(r'[a-z_][a-z0-9_]*')
+
+# Суффикс части разбитой выгрузки: visit_1, visit-02, visit.part3
+PART_SUFFIX_RE = re.compile(r'[._-](?:part)?\d+$')
+
+# Ключ блокировки промежуточной схемы: одновременно идет только одна загрузка дампа
+DUMP_LOCK_SQL = "SELECT pg_try_advisory_lock(hashtext(%s))"
+DUMP_UNLOCK_SQL = "SELECT pg_advisory_unlock(hashtext(%s))"
+
+
+class DumpSchemaBusy(RuntimeError):
+    """Промежуточную схему использует другая загрузка"""
+
+
+class _CopySection:
+    """Файлоподобный объект: данные секции COPY до строки '\\.'"""
+
+    def __init__(self, handle):
+        self.handle = handle
+        self.finished = False
+
+    def read(self, size=-1):
+        chunks = []
+        length = 0
+        while not self.finished and (size < 0 or length < size):
+            line = self.handle.readline()
+            if not line or line.rstrip('\r\n') == COPY_END:
+                self.finished = True
+                break
+            chunks.append(line)
+            length += len(line)
+        return ''.join(chunks)
+
+
+def discover_dump_files(directory):
+    """Файлы выгрузки в каталоге: [(путь, формат)]"""
+    files = []
+    for path in sorted(Path(directory).iterdir()):
+        suffix = path.suffix.lower()
+        if suffix == '.csv':
+            files.append((path, 'csv'))
+        elif suffix in ('.sql', '.copy'):
+            files.append((path, 'text'))
+    return files
+
+
+def dump_table_name(stem):
+    """Таблица МИС по имени файла: visit_1 -> visit"""
+    return PART_SUFFIX_RE.sub('', stem.lower())
+
+
+def _check_header(path, table, columns):
+    """Таблица должна быть известной, колонки - простыми идентификаторами"""
+    if table not in DUMP_COLUMN_TYPES:
+        raise ValueError(f"{path.name}: неизвестная таблица {table!r}, "
+                         f"ожидаются: {', '.join(sorted(DUMP_COLUMN_TYPES))}")
+    invalid = [column for column in columns if not IDENTIFIER_RE.fullmatch(column)]
+    if invalid or not columns:
+        raise ValueError(f"{path.name}: недопустимые имена колонок {invalid}")
+    return table, columns
+
+
+def _read_header(path, fmt):
+    """Имя таблицы и список колонок файла выгрузки"""
+    with open(path, 'r', encoding='utf-8', newline='') as handle:
+        if fmt == 'csv':
+            columns = next(csv.reader(handle), [])
+            return _check_header(path, dump_table_name(path.stem), [column.strip().lower() for column in columns])
+
+        header = None
+        for line in handle:
+            match = COPY_HEADER_RE.match(line.strip())
+            if not match:
+                continue
+            if header is not None:
+                # Загружается только одна секция - остальные молча потерялись бы
+                raise ValueError(f"В файле {path.name} несколько секций COPY - "
+                                 f"разделите выгрузку на файлы по таблицам")
+            columns = [column.strip().strip('"').lower() for column in match.group('columns').split(',')]
+            header = match.group('table').lower(), columns
+
+    if header is None:
+        raise ValueError(f"В файле {path.name} не найдена строка COPY ... FROM stdin")
+    return _check_header(path, *header)
+
+
+def _count_file_rows(path, fmt):
+    """Количество записей данных в файле (для сверки с загруженным)"""
+    with open(path, 'r', encoding='utf-8', newline='') as handle:
+        if fmt == 'csv':
+            # csv.reader корректно учитывает переводы строк внутри кавычек
+            return sum(1 for _ in csv.reader(handle)) - 1
+
+        for line in handle:
+            if COPY_HEADER_RE.match(line.strip()):
+                break
+        count = 0
+        for line in handle:
+            if line.rstrip('\r\n') == COPY_END:
+                break
+            count += 1
+        return count
+
+
+def plan_dump_tables(files):
+    """
+    Группирует файлы выгрузки по таблицам: {таблица: {'columns': [...], 'files': [(путь, формат)]}}.
+    Части одной таблицы должны иметь одинаковый набор колонок (порядок может
+    отличаться - COPY идет по списку колонок файла), иначе ValueError
+    """
+    tables = {}
+    for path, fmt in files:
+        table, columns = _read_header(path, fmt)
+        plan = tables.setdefault(table, {'columns': columns, 'files': []})
+        if set(plan['columns']) != set(columns):
+            first = plan['files'][0][0].name
+            raise ValueError(f"{path.name}: колонки таблицы {table} не совпадают с {first}")
+        plan['files'].append((path, fmt))
+    return tables
+
+
+@contextmanager
+def dump_schema_lock(using='default'):
+    """
+    Блокировка промежуточной схемы на время загрузки (advisory lock сессии):
+    вторая загрузка не удалит схему, в которую пишет первая, а завершится DumpSchemaBusy
+    """
+    with connections[using].cursor() as cursor:
+        cursor.execute(DUMP_LOCK_SQL, [DUMP_SCHEMA])
+        if not cursor.fetchone()[0]:
+            raise DumpSchemaBusy(f"Схема {DUMP_SCHEMA} занята другой загрузкой выгрузки МИС")
+    try:
+        yield
+    finally:
+        with connections[using].cursor() as cursor:
+            cursor.execute(DUMP_UNLOCK_SQL, [DUMP_SCHEMA])
+
+
+def prepare_schema(tables, using='default'):
+    """
+    Пересоздает промежуточную схему и пустые таблицы дампа (см. plan_dump_tables).
+    Вызывается под dump_schema_lock
+    """
+    with connections[using].cursor() as cursor:
+        cursor.execute(f"DROP SCHEMA IF EXISTS {DUMP_SCHEMA} CASCADE")
+        cursor.execute(f"CREATE SCHEMA {DUMP_SCHEMA}")
+        for table, plan in tables.items():
+            types = DUMP_COLUMN_TYPES.get(table, {})
+            columns_ddl = ', '.join(f'"{column}" {types.get(column, "text")}' for column in plan['columns'])
+            cursor.execute(f"CREATE UNLOGGED TABLE {DUMP_SCHEMA}.{table} ({columns_ddl})")
+
+
+def analyze_tables(tables, using='default'):
+    """Статистика промежуточных таблиц после загрузки всех частей"""
+    with connections[using].cursor() as cursor:
+        for table in tables:
+            cursor.execute(f"ANALYZE {DUMP_SCHEMA}.{table}")
+
+
+def drop_schema(using='default'):
+    """Удаляет промежуточную схему дампа"""
+    with connections[using].cursor() as cursor:
+        cursor.execute(f"DROP SCHEMA IF EXISTS {DUMP_SCHEMA} CASCADE")
+
+
+def load_dump_file(path, fmt, using='default'):
+    """
+    Дописывает один файл выгрузки в промежуточную таблицу (созданную prepare_schema)
+    через COPY и сверяет количество строк файла со скопированными.
+    Возвращает {'table', 'file_rows', 'loaded_rows'}
+    """
+    table, columns = _read_header(path, fmt)
+    columns_sql = ', '.join(f'"{column}"' for column in columns)
+    target = f"{DUMP_SCHEMA}.{table}"
+
+    file_rows = _count_file_rows(path, fmt)
+
+    try:
+        with connections[using].cursor() as cursor:
+            with open(path, 'r', encoding='utf-8', newline='') as handle:
+                if fmt == 'csv':
+                    loaded_rows = copy_from(
+                        cursor,
+                        f"COPY {target} ({columns_sql}) FROM STDIN WITH (FORMAT csv, HEADER true)",
+                        handle,
+                    )
+                else:
+                    # Пропускаем все до строки COPY и отдаем только данные секции
+                    for line in handle:
+                        if COPY_HEADER_RE.match(line.strip()):
+                            break
+                    loaded_rows = copy_from(
+                        cursor, f"COPY {target} ({columns_sql}) FROM STDIN", _CopySection(handle)
+                    )
+    finally:
+        # Файлы грузятся в отдельных потоках - соединение потока больше не нужно
+        connections[using].close()
+
+    return {
+        'table': table,
+        'file_rows': file_rows,
+        'loaded_rows': loaded_rows,
+    }
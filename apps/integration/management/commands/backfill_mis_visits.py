@@ -0,0 +1,141 @@
+#apps\integration\management\commands\backfill_mis_visits.py
+
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from integration.backfill import build_partitions, init_worker, run_partition, PARTITION_DAYS
+from integration.mis_connector import get_mis_sources
+from integration.models import BackfillPartition
+
+class Command(BaseCommand):
+    help = 'Историческая догрузка визитов из МИС по партициям дат в несколько процессов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--from',
+            dest='date_from',
+            required=True,
+            help='Начало диапазона в формате YYYY-MM-DD',
+        )
+        parser.add_argument(
+            '--to',
+            dest='date_to',
+            required=True,
+            help='Конец диапазона (включительно) в формате YYYY-MM-DD',
+        )
+        parser.add_argument(
+            '--partition',
+            choices=sorted(PARTITION_DAYS),
+            default='day',
+            help='Размер партиции: day или week (по умолчанию day)',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=4,
+            help='Количество параллельных процессов (по умолчанию 4)',
+        )
+        parser.add_argument(
+            '--retries',
+            type=int,
+            default=2,
+            help='Количество повторов партиции при ошибке (по умолчанию 2)',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=5000,
+            help='Размер пакета выгрузки и записи (по умолчанию 5000)',
+        )
+        parser.add_argument(
+            '--restart',
+            action='store_true',
+            help='Загрузить заново и уже завершенные партиции',
+        )
+        parser.add_argument(
+            '--source',
+            action='append',
+            help='Алиас БД МИС (можно указать несколько раз); по умолчанию - все источники',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            date_from = datetime.strptime(options['date_from'], '%Y-%m-%d').date()
+            date_to = datetime.strptime(options['date_to'], '%Y-%m-%d').date()
+        except ValueError:
+            raise CommandError('Даты должны быть в формате YYYY-MM-DD')
+
+        if date_from > date_to:
+            raise CommandError('Начало диапазона позже конца')
+
+        sources = options['source'] or get_mis_sources()
+        unknown = set(sources) - set(get_mis_sources())
+        if unknown:
+            raise CommandError(f"Неизвестные источники МИС: {', '.join(sorted(unknown))}")
+
+        # Регистрируем партиции всех источников в одну очередь,
+        # чтобы процессы загружали источники одновременно;
+        # завершенные при прошлом запуске пропускаем
+        pending_ids = []
+        partitions = build_partitions(date_from, date_to, options['partition'])
+        for start, end in partitions:
+            for source in sources:
+                partition, created = BackfillPartition.objects.get_or_create(
+                    source=source,
+                    date_from=start,
+                    date_to=end,
+                )
+                if partition.status == BackfillPartition.STATUS_DONE and not options['restart']:
+                    continue
+                if not created:
+                    partition.status = BackfillPartition.STATUS_PENDING
+                    partition.attempts = 0
+                    partition.error = ''
+                    partition.save()
+                pending_ids.append(partition.pk)
+
+        total = len(pending_ids)
+        if not total:
+            self.stdout.write(self.style.SUCCESS('✅ Все партиции диапазона уже загружены'))
+            return
+
+        self.stdout.write(
+            f"Догрузка {date_from} - {date_to}: {total} партиций, процессов: {options['workers']}"
+        )
+
+        # Дочерние процессы не должны унаследовать открытые соединения
+        connections.close_all()
+
+        started = time.monotonic()
+        done = failed = rows_total = 0
+        with ProcessPoolExecutor(max_workers=options['workers'], initializer=init_worker) as executor:
+            futures = [
+                executor.submit(run_partition, partition_id, options['chunk_size'], options['retries'])
+                for partition_id in pending_ids
+            ]
+
+            for future in as_completed(futures):
+                result = future.result()
+                done += 1
+                rows_total += result['rows']
+                elapsed = time.monotonic() - started
+                progress = f"[{done}/{total}] {result['source']} {result['date_from']} - {result['date_to']}"
+
+                if result['error']:
+                    failed += 1
+                    self.stdout.write(self.style.ERROR(f"{progress}: ❌ {result['error']}"))
+                else:
+                    self.stdout.write(
+                        f"{progress}: {result['rows']} визитов (новых {result['created']}, "
+                        f"обновлено {result['updated']}) за {result['seconds']:.1f}с, "
+                        f"всего {rows_total} за {elapsed:.0f}с"
+                    )
+
+        if failed:
+            self.stdout.write(self.style.WARNING(
+                f"⚠️ Не загружено партиций: {failed}. Повторный запуск продолжит с них"
+            ))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"✅ Догрузка завершена: {rows_total} визитов"))
@@ -1,7 +1,16 @@
 #apps\integration\management\commands\calculate_kpi.py
 
-from django.core.management.base import BaseCommand
-from kpi_calc.calculators import run_kpi_calculation
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from integration.backfill import init_worker
+from kpi_calc.calculators import (run_kpi_calculation, run_incremental_calculation, verify_period,
+                                  build_periods, calculate_period)
+from kpi_calc.cumulative import update_cumulative
+
+PERIOD_RE = re.compile(r'^\d{4}-(0[1-9]|1[0-2])$')
 
 class Command(BaseCommand):
     help = 'Запуск расчета KPI показателей за указанный период'
@@ -12,14 +21,60 @@ class Command(BaseCommand):
             type=str,
             help='Период в формате YYYY-MM (например, 2025-04)',
         )
+        parser.add_argument(
+            '--from',
+            dest='period_from',
+            help='Первый период диапазона в формате YYYY-MM',
+        )
+        parser.add_argument(
+            '--to',
+            dest='period_to',
+            help='Последний период диапазона (включительно) в формате YYYY-MM',
+        )
+        parser.add_argument(
+            '--year',
+            type=int,
+            help='Пересчитать все месяцы года',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=4,
+            help='Сколько периодов считать одновременно (по умолчанию 4)',
+        )
+        parser.add_argument(
+            '--incremental',
+            action='store_true',
+            help='Пересчитать только пары врач/период, измененные импортом',
+        )
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help='После расчета сверить записанные результаты с полным расчетом в памяти',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Сколько результатов записывать одним запросом (по умолчанию 1000)',
+        )
     
     def handle(self, *args, **options):
+        if options['incremental']:
+            self._calculate_incremental(options['batch_size'], options['verify'])
+            return
+        
+        periods = self._periods(options)
+        if periods:
+            self._calculate_periods(periods, options['workers'], options['batch_size'])
+            return
+        
         period = options.get('period')
         
         self.stdout.write(f"Запуск расчета KPI за период: {period or 'предыдущий месяц'}...")
         
         try:
-            results = run_kpi_calculation(period)
+            results = run_kpi_calculation(period, batch_size=options['batch_size'])
             
             if results:
                 self.stdout.write(
@@ -31,4 +86,87 @@ class Command(BaseCommand):
         except Exception as e:
             self.stdout.write(
                 self.style.ERROR(f'❌ Ошибка при расчете KPI: {e}')
-            )
\ No newline at end of file
+            )
+    
+    def _periods(self, options):
+        """Периоды из --year или --from/--to; None - расчет одного периода"""
+        if options['year']:
+            return build_periods(f"{options['year']}-01", f"{options['year']}-12")
+        
+        if not (options['period_from'] or options['period_to']):
+            return None
+        
+        period_from, period_to = options['period_from'], options['period_to']
+        if not (period_from and period_to and PERIOD_RE.match(period_from) and PERIOD_RE.match(period_to)):
+            raise CommandError('Укажите --from YYYY-MM и --to YYYY-MM')
+        if period_from > period_to:
+            raise CommandError('Начало диапазона позже конца')
+        return build_periods(period_from, period_to)
+    
+    def _calculate_periods(self, periods, workers, batch_size):
+        """Параллельный расчет периодов в пуле процессов"""
+        self.stdout.write(
+            f"Расчет KPI за {periods[0]} - {periods[-1]}: {len(periods)} периодов, процессов: {workers}"
+        )
+        
+        # Дочерние процессы не должны унаследовать открытые соединения
+        connections.close_all()
+        
+        started = time.monotonic()
+        failed = []
+        results_total = 0
+        with ProcessPoolExecutor(max_workers=max(1, workers), initializer=init_worker) as executor:
+            futures = [executor.submit(calculate_period, period, batch_size) for period in periods]
+            
+            for future in as_completed(futures):
+                result = future.result()
+                if result['error']:
+                    failed.append(result['period'])
+                    self.stdout.write(self.style.ERROR(f"❌ {result['period']}: {result['error']}"))
+                else:
+                    results_total += result['results']
+                    self.stdout.write(
+                        f"✅ {result['period']}: {result['results']} показателей за {result['seconds']:.1f}с"
+                    )
+        
+        # Нарастающий итог - после всех периодов, с первого пересчитанного месяца каждого года
+        first_months = {}
+        for period in periods:
+            year, month = map(int, period.split('-'))
+            first_months[year] = min(first_months.get(year, month), month)
+        for year, month in sorted(first_months.items()):
+            update_cumulative(year, month, batch_size=batch_size)
+        
+        self.stdout.write(
+            f"\nПериодов: {len(periods)}, успешно: {len(periods) - len(failed)}, "
+            f"показателей: {results_total}, время: {time.monotonic() - started:.1f}с"
+        )
+        if failed:
+            self.stdout.write(self.style.WARNING(f"⚠️ Не рассчитаны: {', '.join(sorted(failed))}"))
+        else:
+            self.stdout.write(self.style.SUCCESS('✅ Все периоды рассчитаны'))
+    
+    def _calculate_incremental(self, batch_size, verify):
+        """Пересчет измененных пар врач/период и, по запросу, сверка с полным расчетом"""
+        self.stdout.write("Инкрементальный расчет KPI по измененным парам врач/период...")
+        summary = run_incremental_calculation(batch_size=batch_size)
+        
+        for period, count in sorted(summary.items()):
+            self.stdout.write(f"✅ {period}: пересчитано {count} показателей")
+        
+        if not verify:
+            return
+        
+        failed = False
+        for period in sorted(summary):
+            mismatches = verify_period(period)
+            if mismatches:
+                failed = True
+                self.stdout.write(self.style.ERROR(f"❌ {period}: расхождений с полным расчетом {len(mismatches)}"))
+                for line in mismatches[:20]:
+                    self.stdout.write(f"   {line}")
+            else:
+                self.stdout.write(self.style.SUCCESS(f"✅ {period}: совпадает с полным расчетом"))
+        
+        if failed:
+            raise CommandError('Инкрементальный расчет расходится с полным')
@@ -0,0 +1,36 @@
+#apps\integration\management\commands\compare_plan_fact.py
+
+from django.core.management.base import BaseCommand, CommandError
+from kpi_calc.views import compare_plan_fact
+
+class Command(BaseCommand):
+    help = 'Сверка план-факт из KpiCumulative с процедурой kpi.get_monthly_plan_fact_comparison'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--year', type=int, required=True, help='Год')
+        parser.add_argument('--month', type=int, required=True, help='Месяц (1-12)')
+        parser.add_argument('--man-id', type=int, help='ID пользователя врача в МИС')
+        parser.add_argument('--specid', type=int, help='ID специальности в МИС')
+        parser.add_argument('--plan-vistype', type=int, help='Код цели визита')
+
+    def handle(self, *args, **options):
+        year, month = options['year'], options['month']
+        if not 1 <= month <= 12:
+            raise CommandError('Месяц должен быть от 1 до 12')
+
+        self.stdout.write(f"Сверка план-факт за {month:02d}.{year} с процедурой БД...")
+        try:
+            mismatches = compare_plan_fact(
+                year, month, options['man_id'], options['specid'], options['plan_vistype']
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        if not mismatches:
+            self.stdout.write(self.style.SUCCESS('✅ Планы, факты и проценты совпадают с процедурой'))
+            return
+
+        self.stdout.write(self.style.ERROR(f"❌ Расхождений: {len(mismatches)}"))
+        for line in mismatches[:50]:
+            self.stdout.write(f"   {line}")
+        raise CommandError('Данные KpiCumulative расходятся с процедурой')
@@ -1,51 +1,165 @@
 #apps\integration\management\commands\import_mis_all_data.py
 
-from django.core.management.base import BaseCommand
-from integration.mis_connector import MISConnector
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from integration.mis_connector import MISConnector, get_mis_sources
+from integration.models import ImportRun
+
+# Справочники: (название, метод выгрузки, метод сохранения)
+REFERENCE_PIPELINES = [
+    ('пользователей', 'extract_man_users', 'save_man_to_db'),
+    ('врачей', 'extract_doctors', 'save_doctors_to_db'),
+    ('специальностей', 'extract_specializations', 'save_specializations_to_db'),
+    ('целей визитов', 'extract_purposes', 'save_purposes_to_db'),
+]
+
+# Общие для всех источников справочники: берутся только из первого источника
+SHARED_PIPELINES = {'extract_specializations', 'extract_purposes'}
 
 class Command(BaseCommand):
     help = 'Полный импорт всех данных из МИС'
-    
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--jobs',
+            type=int,
+            default=1,
+            help='Сколько справочников одного источника выгружать одновременно (по умолчанию 1 - по очереди)',
+        )
+        parser.add_argument(
+            '--source',
+            action='append',
+            help='Алиас БД МИС (можно указать несколько раз); по умолчанию - все источники',
+        )
+
     def handle(self, *args, **options):
-        connector = MISConnector()
-        
+        jobs = max(1, options['jobs'])
+        sources = options['source'] or get_mis_sources()
+        unknown = set(sources) - set(get_mis_sources())
+        if unknown:
+            raise CommandError(f"Неизвестные источники МИС: {', '.join(sorted(unknown))}")
+
         self.stdout.write("=== ПОЛНЫЙ ИМПОРТ ДАННЫХ ИЗ МИС ===")
-        
+
         # Проверка подключения
-        if not connector.test_connection():
-            self.stdout.write("❌ Нет подключения к МИС")
+        runs = {}
+        for source in sources:
+            run = ImportRun.objects.create(command='import_mis_all_data', source=source)
+            if MISConnector(using=source).test_connection():
+                self.stdout.write(f"✅ Подключение к {source} успешно")
+                runs[source] = run
+            else:
+                self.stdout.write(f"❌ Нет подключения к {source}")
+                run.finish(error='Нет подключения к МИС')
+
+        if not runs:
             return
-        
-        self.stdout.write("✅ Подключение к МИС успешно")
-        
-        # 1. Импорт пользователей
-        self.stdout.write("\n1. Импорт пользователей...")
-        man_data = connector.extract_man_users()
-        if man_data:
-            saved_count = connector.save_man_to_db(man_data)
-            self.stdout.write(f"✅ Импортировано пользователей: {saved_count}")
-        
-        # 2. Импорт врачей
-        self.stdout.write("\n2. Импорт врачей...")
-        doctors_data = connector.extract_doctors()
-        if doctors_data:
-            saved_count = connector.save_doctors_to_db(doctors_data)
-            self.stdout.write(f"✅ Импортировано врачей: {saved_count}")
-        
-        # 3. Импорт специальностей
-        self.stdout.write("\n3. Импорт специальностей...")
-        specializations_data = connector.extract_specializations()
-        if specializations_data:
-            saved_count = connector.save_specializations_to_db(specializations_data)
-            self.stdout.write(f"✅ Импортировано специальностей: {saved_count}")
-        
-        # 4. Импорт целей визитов
-        self.stdout.write("\n4. Импорт целей визитов...")
-        purposes_data = connector.extract_purposes()
-        if purposes_data:
-            saved_count = connector.save_purposes_to_db(purposes_data)
-            self.stdout.write(f"✅ Импортировано целей визитов: {saved_count}")
-        
+
+        # Первый доступный источник отдает и общие справочники
+        tasks = [
+            (source, pipeline)
+            for number, source in enumerate(runs)
+            for pipeline in REFERENCE_PIPELINES
+            if number == 0 or pipeline[1] not in SHARED_PIPELINES
+        ]
+
+        started = time.monotonic()
+        results = []
+
+        if jobs == 1 and len(runs) == 1:
+            connector = MISConnector(using=tasks[0][0])
+            for number, (source, pipeline) in enumerate(tasks, start=1):
+                self.stdout.write(f"\n{number}. Импорт {pipeline[0]}...")
+                results.append(self._run_pipeline(connector, pipeline))
+                self._write_result(results[-1])
+        else:
+            workers = jobs * len(runs)
+            self.stdout.write(f"\nИмпорт справочников из {len(runs)} источников в {workers} потоков...")
+            # Каждый поток работает на своих соединениях с МИС и KPI
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = [
+                    executor.submit(self._run_pipeline_in_thread, source, pipeline)
+                    for source, pipeline in tasks
+                ]
+                for future in as_completed(futures):
+                    results.append(future.result())
+                    self._write_result(results[-1])
+
+        for source, run in runs.items():
+            self._record_run(run, [result for result in results if result['source'] == source])
+        for source in list(runs)[1:]:
+            self._check_specializations(source)
+        self.stdout.write(f"\nОбщее время: {time.monotonic() - started:.1f}с")
         self.stdout.write(
             self.style.SUCCESS("\n=== ИМПОРТ ЗАВЕРШЕН ===")
-        )
\ No newline at end of file
+        )
+
+    def _run_pipeline(self, connector, pipeline):
+        """Выгрузка и сохранение одного справочника с замером времени"""
+        title, extract_method, save_method = pipeline
+
+        started = time.monotonic()
+        query_before, transfer_before = connector.query_seconds, connector.transfer_seconds
+        data = getattr(connector, extract_method)()
+        extract_seconds = time.monotonic() - started
+
+        stats = None
+        if data:
+            stats = getattr(connector, save_method)(data)
+
+        return {
+            'source': connector.source_id,
+            'title': title,
+            'stats': stats,
+            'rows': len(data),
+            'query_seconds': connector.query_seconds - query_before,
+            'transfer_seconds': connector.transfer_seconds - transfer_before,
+            'extract_seconds': extract_seconds,
+            'save_seconds': time.monotonic() - started - extract_seconds,
+        }
+
+    def _run_pipeline_in_thread(self, source, pipeline):
+        try:
+            return self._run_pipeline(MISConnector(using=source), pipeline)
+        finally:
+            # Соединения потока не переиспользуются - закрываем их
+            connections.close_all()
+
+    def _check_specializations(self, source):
+        """Специальности берутся из первого источника - остальные только сверяются с ними"""
+        connector = MISConnector(using=source)
+        mismatches = connector.specialization_mismatches(connector.extract_specializations())
+        if mismatches:
+            self.stdout.write(self.style.WARNING(
+                f"⚠️ [{source}] Специальности расходятся с общим справочником: {len(mismatches)} "
+                f"(врачи этих специальностей могут получить чужой план)"
+            ))
+        else:
+            self.stdout.write(f"✅ [{source}] Специальности совпадают с общим справочником")
+
+    def _record_run(self, run, results):
+        """Сохраняет итоги справочников источника в журнал импорта"""
+        failed = [result['title'] for result in results if not result['stats']]
+        for result in results:
+            stats = result['stats'] or {'inserted': 0, 'updated': 0, 'unchanged': 0}
+            run.rows_extracted += result['rows']
+            run.rows_inserted += stats['inserted']
+            run.rows_updated += stats['updated']
+            run.rows_skipped += stats['unchanged']
+            run.query_seconds += result['query_seconds']
+            run.transfer_seconds += result['transfer_seconds']
+            run.write_seconds += result['save_seconds']
+        run.finish(error=f"Не удалось импортировать: {', '.join(failed)}" if failed else '')
+
+    def _write_result(self, result):
+        timing = f"(выгрузка {result['extract_seconds']:.1f}с, запись {result['save_seconds']:.1f}с)"
+        stats = result['stats']
+        if stats:
+            self.stdout.write(
+                f"✅ [{result['source']}] Импортировано {result['title']}: добавлено {stats['inserted']}, "
+                f"изменено {stats['updated']}, без изменений {stats['unchanged']} {timing}"
+            )
+        else:
+            self.stdout.write(f"❌ [{result['source']}] Не удалось импортировать {result['title']} {timing}")
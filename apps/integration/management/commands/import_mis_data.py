@@ -1,7 +1,9 @@
 #apps\integration\management\commands\import_mis_data.py
 
-from django.core.management.base import BaseCommand
-from integration.mis_connector import import_mis_data
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from integration.mis_connector import import_mis_data, get_mis_sources
 
 class Command(BaseCommand):
     help = 'Импорт данных из МИС за последние N дней'
@@ -13,13 +15,109 @@ class Command(BaseCommand):
             default=1,
             help='За сколько дней выгружать данные (по умолчанию 1)',
         )
+        parser.add_argument(
+            '--row-by-row',
+            action='store_true',
+            help='Построчное сохранение вместо пакетного (для поиска проблемной строки)',
+        )
+        parser.add_argument(
+            '--stream',
+            action='store_true',
+            help='Потоковая выгрузка серверным курсором с сохранением по пакетам',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=5000,
+            help='Размер пакета выгрузки и записи (по умолчанию 5000)',
+        )
+        parser.add_argument(
+            '--incremental',
+            action='store_true',
+            help='Выгружать только визиты после отметки прошлого импорта',
+        )
+        parser.add_argument(
+            '--overlap-hours',
+            type=int,
+            default=24,
+            help='Перекрытие с отметкой для поздних правок, часов (по умолчанию 24)',
+        )
+        parser.add_argument(
+            '--pipeline',
+            action='store_true',
+            help='Читать из МИС в отдельном потоке одновременно с записью в БД KPI',
+        )
+        parser.add_argument(
+            '--queue-size',
+            type=int,
+            default=4,
+            help='Сколько прочитанных пакетов может ждать записи (по умолчанию 4)',
+        )
+        parser.add_argument(
+            '--keyset',
+            action='store_true',
+            help='Щадящая выгрузка короткими запросами по keyid с паузами под нагрузку МИС',
+        )
+        parser.add_argument(
+            '--target-latency',
+            type=float,
+            default=0.5,
+            help='Целевое время ответа МИС на пакет в режиме --keyset, секунд (по умолчанию 0.5)',
+        )
+        parser.add_argument(
+            '--source',
+            action='append',
+            help='Алиас БД МИС (можно указать несколько раз); по умолчанию - все источники',
+        )
     
     def handle(self, *args, **options):
         days = options['days']
+        bulk = not options['row_by_row']
+        
+        if options['incremental']:
+            self.stdout.write("Запуск инкрементального импорта данных из МИС...")
+        else:
+            self.stdout.write(f"Запуск импорта данных из МИС за {days} дней...")
+        
+        sources = options['source'] or get_mis_sources()
+        unknown = set(sources) - set(get_mis_sources())
+        if unknown:
+            raise CommandError(f"Неизвестные источники МИС: {', '.join(sorted(unknown))}")
+        if not sources:
+            raise CommandError('В настройках нет ни одной БД МИС')
+        
+        import_options = dict(
+            days_back=days,
+            bulk=bulk,
+            stream=options['stream'],
+            chunk_size=options['chunk_size'],
+            incremental=options['incremental'],
+            overlap_hours=options['overlap_hours'],
+            pipeline=options['pipeline'],
+            queue_size=options['queue_size'],
+            keyset=options['keyset'],
+            target_latency=options['target_latency'],
+        )
         
-        self.stdout.write(f"Запуск импорта данных из МИС за {days} дней...")
+        if len(sources) == 1:
+            results = {sources[0]: import_mis_data(source=sources[0], **import_options)}
+        else:
+            self.stdout.write(f"Источники МИС ({len(sources)}): {', '.join(sources)}")
+            # Источники выгружаются одновременно, каждый в своем потоке и на своих соединениях
+            with ThreadPoolExecutor(max_workers=len(sources)) as executor:
+                futures = {
+                    source: executor.submit(self._import_source, source, import_options)
+                    for source in sources
+                }
+                results = {source: future.result() for source, future in futures.items()}
+        
+        failed = [source for source, result in results.items() if result is None]
+        for source in failed:
+            self.stdout.write(self.style.ERROR(f'❌ Импорт из {source} не удался'))
         
-        result = import_mis_data(days_back=days)
+        result = None
+        if len(failed) < len(results):
+            result = sum(result for result in results.values() if result is not None)
         
         if result is not None:
             self.stdout.write(
@@ -28,4 +126,11 @@ class Command(BaseCommand):
         else:
             self.stdout.write(
                 self.style.ERROR('❌ Импорт не удался')
-            )
\ No newline at end of file
+            )
+    
+    def _import_source(self, source, import_options):
+        try:
+            return import_mis_data(source=source, **import_options)
+        finally:
+            # Соединения потока не переиспользуются - закрываем их
+            connections.close_all()
@@ -1,13 +1,49 @@
 #apps\integration\management\commands\import_mis_references.py
 
-from django.core.management.base import BaseCommand
-from integration.mis_connector import MISConnector
+from django.core.management.base import BaseCommand, CommandError
+from integration.mis_connector import MISConnector, get_mis_sources
 
 class Command(BaseCommand):
     help = 'Импорт справочников (специальностей и целей) из МИС'
     
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--source',
+            action='append',
+            help='Алиас БД МИС (можно указать несколько раз); по умолчанию - все источники',
+        )
+    
     def handle(self, *args, **options):
-        connector = MISConnector()
+        sources = options['source'] or get_mis_sources()
+        unknown = set(sources) - set(get_mis_sources())
+        if unknown:
+            raise CommandError(f"Неизвестные источники МИС: {', '.join(sorted(unknown))}")
+        if not sources:
+            raise CommandError('В настройках нет ни одной БД МИС')
+        
+        # Справочники общие: загружаются из первого источника, остальные с ним сверяются
+        self._import_references(sources[0])
+        for source in sources[1:]:
+            self._check_specializations(source)
+    
+    def _check_specializations(self, source):
+        """Сверка специальностей источника с общим справочником"""
+        connector = MISConnector(using=source)
+        if not connector.test_connection():
+            self.stdout.write(f"❌ [{source}] Нет подключения к МИС")
+            return
+        
+        mismatches = connector.specialization_mismatches(connector.extract_specializations())
+        if mismatches:
+            self.stdout.write(self.style.WARNING(
+                f"⚠️ [{source}] Специальности расходятся с общим справочником: {len(mismatches)}"
+            ))
+        else:
+            self.stdout.write(f"✅ [{source}] Специальности совпадают с общим справочником")
+    
+    def _import_references(self, source):
+        """Импорт специальностей и целей визитов из одного источника"""
+        connector = MISConnector(using=source)
         
         self.stdout.write("Проверка подключения к МИС...")
         if not connector.test_connection():
@@ -22,8 +58,14 @@ class Command(BaseCommand):
         
         if specializations_data:
             self.stdout.write(f"Сохранение {len(specializations_data)} специальностей...")
-            saved_count = connector.save_specializations_to_db(specializations_data)
-            self.stdout.write(f"✅ Успешно импортировано {saved_count} специальностей")
+            stats = connector.save_specializations_to_db(specializations_data)
+            if stats:
+                self.stdout.write(
+                    f"✅ Специальности: добавлено {stats['inserted']}, изменено {stats['updated']}, "
+                    f"без изменений {stats['unchanged']}"
+                )
+            else:
+                self.stdout.write("❌ Не удалось сохранить специальности")
         else:
             self.stdout.write("❌ Не удалось выгрузить специальности")
         
@@ -33,7 +75,13 @@ class Command(BaseCommand):
         
         if purposes_data:
             self.stdout.write(f"Сохранение {len(purposes_data)} целей визитов...")
-            saved_count = connector.save_purposes_to_db(purposes_data)
-            self.stdout.write(f"✅ Успешно импортировано {saved_count} целей визитов")
+            stats = connector.save_purposes_to_db(purposes_data)
+            if stats:
+                self.stdout.write(
+                    f"✅ Цели визитов: добавлено {stats['inserted']}, изменено {stats['updated']}, "
+                    f"без изменений {stats['unchanged']}"
+                )
+            else:
+                self.stdout.write("❌ Не удалось сохранить цели визитов")
         else:
             self.stdout.write("❌ Не удалось выгрузить цели визитов")
\ No newline at end of file
@@ -0,0 +1,133 @@
+#apps\integration\management\commands\ingest_mis_dump.py
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from django.core.management.base import BaseCommand, CommandError
+from integration.dump_ingest import (DUMP_SCHEMA, VISIT_TABLES, DOCTOR_TABLES, DumpSchemaBusy,
+                                     discover_dump_files, plan_dump_tables, dump_schema_lock,
+                                     prepare_schema, drop_schema, analyze_tables, load_dump_file)
+from integration.bulk_loader import empty_upsert_stats, add_upsert_stats
+from integration.mis_connector import MISConnector
+from integration.pipeline import run_pipeline
+
+class Command(BaseCommand):
+    help = 'Загрузка выгрузок таблиц МИС (CSV / COPY) без подключения к МИС'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'directory',
+            help='Каталог с файлами выгрузки: visit.csv, docdep.csv, ... или секции COPY (*.sql, *.copy); '
+                 'таблицу можно разбить на части visit_1.csv, visit_2.csv, ...',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=4,
+            help='Сколько файлов загружать одновременно (по умолчанию 4)',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=5000,
+            help='Размер пакета записи визитов (по умолчанию 5000)',
+        )
+        parser.add_argument(
+            '--keep-staging',
+            action='store_true',
+            help=f'Не удалять промежуточную схему {DUMP_SCHEMA} после загрузки',
+        )
+        parser.add_argument(
+            '--source',
+            default='mis',
+            help='Источник, которым помечаются загруженные строки (по умолчанию mis)',
+        )
+
+    def handle(self, *args, **options):
+        files = discover_dump_files(options['directory'])
+        if not files:
+            raise CommandError('В каталоге нет файлов выгрузки (*.csv, *.sql, *.copy)')
+
+        try:
+            tables = plan_dump_tables(files)
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(f"=== ЗАГРУЗКА ВЫГРУЗКИ МИС: {len(files)} файлов, {len(tables)} таблиц ===")
+        try:
+            with dump_schema_lock():
+                prepare_schema(tables)
+                try:
+                    self._load_files(files, options['workers'])
+                    analyze_tables(tables)
+                    self._ingest(set(tables), options['chunk_size'], options['source'])
+                finally:
+                    if not options['keep_staging']:
+                        drop_schema()
+        except DumpSchemaBusy as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(self.style.SUCCESS("\n=== ЗАГРУЗКА ЗАВЕРШЕНА ==="))
+
+    def _load_files(self, files, workers):
+        """Параллельная загрузка файлов в промежуточную схему со сверкой строк"""
+        mismatches = []
+
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            futures = {
+                executor.submit(load_dump_file, path, fmt): path
+                for path, fmt in files
+            }
+            for future in as_completed(futures):
+                path = futures[future]
+                result = future.result()
+
+                line = (f"{path.name} -> {DUMP_SCHEMA}.{result['table']}: "
+                        f"в файле {result['file_rows']}, загружено {result['loaded_rows']}")
+                if result['file_rows'] == result['loaded_rows']:
+                    self.stdout.write(f"✅ {line}")
+                else:
+                    self.stdout.write(self.style.ERROR(f"❌ {line}"))
+                    mismatches.append(path.name)
+
+        if mismatches:
+            raise CommandError(f"Количество строк не совпало: {', '.join(mismatches)}")
+
+    def _ingest(self, tables, chunk_size, source_id):
+        """Разбор промежуточных таблиц в import_visit и справочники"""
+        # Те же запросы, что и для МИС, но по промежуточной схеме нашей БД
+        connector = MISConnector(using='default', schema=DUMP_SCHEMA, source_id=source_id)
+
+        if 'man' in tables:
+            self.stdout.write("\nПользователи...")
+            connector.save_man_to_db(connector.extract_man_users())
+
+        if DOCTOR_TABLES <= tables:
+            self.stdout.write("\nВрачи...")
+            connector.save_doctors_to_db(connector.extract_doctors())
+
+        if 'lu' in tables:
+            self.stdout.write("\nСпециальности и цели визитов...")
+            connector.save_specializations_to_db(connector.extract_specializations())
+            connector.save_purposes_to_db(connector.extract_purposes())
+
+        missing = VISIT_TABLES - tables
+        if missing:
+            self.stdout.write(self.style.WARNING(
+                f"\n⚠️ Визиты не загружены, нет таблиц: {', '.join(sorted(missing))}"
+            ))
+            return
+
+        self.stdout.write("\nВизиты...")
+        totals = empty_upsert_stats()
+
+        def save_batch(batch):
+            add_upsert_stats(totals, connector.bulk_save_visits_to_db(batch, batch_size=chunk_size))
+
+        # Чтение серверным курсором и запись идут на разных соединениях
+        run_pipeline(
+            lambda: connector.iter_visits('true', (), chunk_size=chunk_size),
+            save_batch,
+        )
+        self.stdout.write(
+            f"✅ Визиты: новых {totals['created']}, обновлено {totals['updated']}, "
+            f"без изменений {totals['unchanged']}"
+        )
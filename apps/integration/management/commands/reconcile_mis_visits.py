@@ -0,0 +1,101 @@
+#apps\integration\management\commands\reconcile_mis_visits.py
+
+import calendar
+from datetime import date, datetime
+from django.core.management.base import BaseCommand, CommandError
+from integration.mis_connector import MISConnector, get_mis_sources
+from integration.reconciliation import reconciliation_report, reimport_days
+
+class Command(BaseCommand):
+    help = 'Сверка визитов с МИС по дням и врачам (количество и контрольные суммы)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--month',
+            help='Месяц сверки в формате YYYY-MM (по умолчанию текущий)',
+        )
+        parser.add_argument(
+            '--from',
+            dest='date_from',
+            help='Начало диапазона в формате YYYY-MM-DD (вместо --month)',
+        )
+        parser.add_argument(
+            '--to',
+            dest='date_to',
+            help='Конец диапазона (включительно) в формате YYYY-MM-DD',
+        )
+        parser.add_argument(
+            '--reimport',
+            action='store_true',
+            help='Перезагрузить из МИС дни с расхождениями',
+        )
+        parser.add_argument(
+            '--source',
+            action='append',
+            help='Алиас БД МИС (можно указать несколько раз); по умолчанию - все источники',
+        )
+
+    def handle(self, *args, **options):
+        date_from, date_to = self._parse_range(options)
+
+        sources = options['source'] or get_mis_sources()
+        unknown = set(sources) - set(get_mis_sources())
+        if unknown:
+            raise CommandError(f"Неизвестные источники МИС: {', '.join(sorted(unknown))}")
+        if not sources:
+            raise CommandError('В настройках нет ни одной БД МИС')
+
+        for source in sources:
+            self._reconcile_source(source, date_from, date_to, options['reimport'])
+
+    def _reconcile_source(self, source, date_from, date_to, reimport):
+        """Сверка и, по запросу, перезагрузка дней одного источника"""
+        connector = MISConnector(using=source)
+        if not connector.test_connection():
+            self.stdout.write(f"❌ [{source}] Нет подключения к МИС")
+            return
+
+        self.stdout.write(f"[{source}] Сверка визитов с МИС за {date_from} - {date_to}...")
+        report = reconciliation_report(connector, date_from, date_to)
+        self.stdout.write(f"Визитов в МИС: {report['mis_total']}, у нас: {report['local_total']}")
+
+        if not report['days']:
+            self.stdout.write(self.style.SUCCESS("✅ Расхождений нет"))
+            return
+
+        for day in report['days']:
+            self.stdout.write(self.style.WARNING(
+                f"\n{day['day']}: в МИС {day['mis_count']}, у нас {day['local_count']}"
+            ))
+            for row in day['doctors']:
+                changed = ', изменено содержимое визитов' if row['changed'] else ''
+                self.stdout.write(
+                    f"   врач {row['doctorid']}: в МИС {row['mis_count']}, у нас {row['local_count']}{changed}"
+                )
+
+        if reimport:
+            self.stdout.write(f"\nПерезагрузка дней с расхождениями: {len(report['days'])}...")
+            totals = reimport_days(connector, [day['day'] for day in report['days']])
+            self.stdout.write(self.style.SUCCESS(
+                f"✅ Новых {totals['created']}, обновлено {totals['updated']}, удалено {totals['deleted']}"
+            ))
+        else:
+            self.stdout.write(f"\nДней с расхождениями: {len(report['days'])} "
+                              f"(перезагрузить: --reimport)")
+
+    def _parse_range(self, options):
+        """Диапазон дат сверки из --month или --from/--to"""
+        try:
+            if options['date_from'] or options['date_to']:
+                date_from = datetime.strptime(options['date_from'], '%Y-%m-%d').date()
+                date_to = (datetime.strptime(options['date_to'], '%Y-%m-%d').date()
+                           if options['date_to'] else date.today())
+                return date_from, date_to
+
+            month = (datetime.strptime(options['month'], '%Y-%m').date()
+                     if options['month'] else date.today().replace(day=1))
+        except (TypeError, ValueError):
+            raise CommandError('Укажите --month YYYY-MM или --from YYYY-MM-DD [--to YYYY-MM-DD]')
+
+        last_day = calendar.monthrange(month.year, month.month)[1]
+        return month, month.replace(day=last_day)
@@ -0,0 +1,88 @@
+#apps\integration\management\commands\sync_mis_deletions.py
+
+from datetime import date, datetime, timedelta
+from django.core.management.base import BaseCommand, CommandError
+from integration.mis_connector import MISConnector, get_mis_sources
+from integration.reconciliation import reconcile_deletions
+
+class Command(BaseCommand):
+    help = 'Удаление визитов, удаленных или отмененных в МИС (сверка по дням)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=30,
+            help='Сколько последних дней сверять (по умолчанию 30)',
+        )
+        parser.add_argument(
+            '--from',
+            dest='date_from',
+            help='Начало диапазона в формате YYYY-MM-DD (вместо --days)',
+        )
+        parser.add_argument(
+            '--to',
+            dest='date_to',
+            help='Конец диапазона (включительно) в формате YYYY-MM-DD',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Только показать расхождения, ничего не удалять',
+        )
+        parser.add_argument(
+            '--source',
+            action='append',
+            help='Алиас БД МИС (можно указать несколько раз); по умолчанию - все источники',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            date_to = (datetime.strptime(options['date_to'], '%Y-%m-%d').date()
+                       if options['date_to'] else date.today())
+            date_from = (datetime.strptime(options['date_from'], '%Y-%m-%d').date()
+                         if options['date_from'] else date_to - timedelta(days=options['days'] - 1))
+        except ValueError:
+            raise CommandError('Даты должны быть в формате YYYY-MM-DD')
+
+        sources = options['source'] or get_mis_sources()
+        unknown = set(sources) - set(get_mis_sources())
+        if unknown:
+            raise CommandError(f"Неизвестные источники МИС: {', '.join(sorted(unknown))}")
+        if not sources:
+            raise CommandError('В настройках нет ни одной БД МИС')
+
+        for source in sources:
+            self._sync_source(source, date_from, date_to, options['dry_run'])
+
+    def _sync_source(self, source, date_from, date_to, dry_run):
+        """Сверка удалений одного источника"""
+        connector = MISConnector(using=source)
+        if not connector.test_connection():
+            self.stdout.write(f"❌ [{source}] Нет подключения к МИС")
+            return
+
+        self.stdout.write(f"[{source}] Сверка визитов с МИС за {date_from} - {date_to}...")
+        result = reconcile_deletions(connector, date_from, date_to, dry_run=dry_run)
+
+        self.stdout.write(
+            f"Проверено дней: {result['days_checked']}, с расхождениями: {len(result['days_mismatched'])}"
+        )
+        if result['moved']:
+            self.stdout.write(
+                f"Визитов с измененной датой (есть в МИС, не удаляются): {result['moved']}"
+                + ("" if dry_run else " - перезагружены")
+            )
+        if result['missing_locally']:
+            self.stdout.write(self.style.WARNING(
+                f"⚠️ Визитов МИС, отсутствующих у нас: {result['missing_locally']} "
+                f"(загрузите эти дни через import_mis_data или backfill_mis_visits)"
+            ))
+
+        if dry_run:
+            self.stdout.write(f"Будет удалено визитов: {result['deleted']}")
+        else:
+            self.stdout.write(self.style.SUCCESS(
+                f"✅ Удалено визитов: {result['deleted']}, "
+                f"затронуто пар врач/период: {len(result['affected'])}"
+            ))
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('integration', '0005_importstate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BackfillPartition',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(max_length=64)),
+                ('date_from', models.DateField()),
+                ('date_to', models.DateField()),
+                ('status', models.CharField(choices=[('pending', 'Ожидает'), ('done', 'Загружена'), ('failed', 'Ошибка')], default='pending', max_length=16)),
+                ('attempts', models.IntegerField(default=0)),
+                ('rows_extracted', models.IntegerField(default=0)),
+                ('rows_created', models.IntegerField(default=0)),
+                ('rows_updated', models.IntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'Партиция догрузки',
+                'verbose_name_plural': 'Партиции догрузки',
+                'unique_together': {('source', 'date_from', 'date_to')},
+            },
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Таблица import_visit не управляется Django - колонку добавляем вручную
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('integration', '0006_backfillpartition'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql='ALTER TABLE solution_med.import_visit ADD COLUMN IF NOT EXISTS row_hash char(32)',
+            reverse_sql='ALTER TABLE solution_med.import_visit DROP COLUMN IF EXISTS row_hash',
+        ),
+    ]
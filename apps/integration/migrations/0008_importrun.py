@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('integration', '0007_import_visit_row_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('command', models.CharField(max_length=64)),
+                ('source', models.CharField(default='mis', max_length=64)),
+                ('status', models.CharField(choices=[('running', 'Выполняется'), ('success', 'Успешно'), ('failed', 'Ошибка')], default='running', max_length=16)),
+                ('started_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('window_start', models.DateTimeField(blank=True, null=True)),
+                ('window_end', models.DateTimeField(blank=True, null=True)),
+                ('rows_extracted', models.IntegerField(default=0)),
+                ('rows_inserted', models.IntegerField(default=0)),
+                ('rows_updated', models.IntegerField(default=0)),
+                ('rows_skipped', models.IntegerField(default=0)),
+                ('query_seconds', models.FloatField(default=0)),
+                ('transfer_seconds', models.FloatField(default=0)),
+                ('write_seconds', models.FloatField(default=0)),
+                ('total_seconds', models.FloatField(default=0)),
+                ('rows_per_second', models.FloatField(default=0)),
+                ('error', models.TextField(blank=True)),
+            ],
+            options={
+                'verbose_name': 'Запуск импорта',
+                'verbose_name_plural': 'Журнал импорта',
+                'ordering': ['-started_at'],
+            },
+        ),
+    ]
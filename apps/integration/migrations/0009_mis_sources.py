@@ -0,0 +1,72 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:26
+
+from django.db import migrations, models
+
+# Таблицы import_* не управляются Django: колонку источника и уникальность
+# (source_id, ID из МИС) вместо уникальности по одному ID добавляем вручную
+SOURCE_TABLES = [
+    ('import_visit', 'keyidmis'),
+    ('import_doctor', 'keyiddocdep'),
+    ('import_man', 'manidmis'),
+]
+
+DROP_SINGLE_KEY_SQL = """
+DO $$
+DECLARE
+    constraint_name text;
+BEGIN
+    -- Уникальное ограничение только по ID из МИС (имя зависит от того, как создавалась таблица)
+    FOR constraint_name IN
+        SELECT c.conname
+        FROM pg_constraint c
+        JOIN pg_attribute a ON a.attrelid = c.conrelid AND a.attnum = ANY(c.conkey)
+        WHERE c.conrelid = 'solution_med.{table}'::regclass
+            AND c.contype = 'u'
+            AND array_length(c.conkey, 1) = 1
+            AND a.attname = '{key}'
+    LOOP
+        EXECUTE format('ALTER TABLE solution_med.{table} DROP CONSTRAINT %I', constraint_name);
+    END LOOP;
+END $$;
+"""
+
+
+def source_operations():
+    operations = []
+    for table, key in SOURCE_TABLES:
+        operations.append(migrations.RunSQL(
+            sql=[
+                f"ALTER TABLE solution_med.{table} ADD COLUMN IF NOT EXISTS source_id varchar(64) NOT NULL DEFAULT 'mis'",
+                DROP_SINGLE_KEY_SQL.format(table=table, key=key),
+                f"CREATE UNIQUE INDEX IF NOT EXISTS {table}_source_key_uniq ON solution_med.{table} (source_id, {key})",
+            ],
+            reverse_sql=[
+                f"DROP INDEX IF EXISTS solution_med.{table}_source_key_uniq",
+                f"ALTER TABLE solution_med.{table} ADD CONSTRAINT {table}_{key}_key UNIQUE ({key})",
+                f"ALTER TABLE solution_med.{table} DROP COLUMN IF EXISTS source_id",
+            ],
+        ))
+    return operations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('integration', '0008_importrun'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='visitaggregate',
+            unique_together=set(),
+        ),
+        migrations.AddField(
+            model_name='visitaggregate',
+            name='source_id',
+            field=models.CharField(default='mis', max_length=64),
+        ),
+        migrations.AlterUniqueTogether(
+            name='visitaggregate',
+            unique_together={('source_id', 'doctor_id', 'period')},
+        ),
+    ] + source_operations()
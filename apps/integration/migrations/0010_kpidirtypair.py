@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:31
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('integration', '0009_mis_sources'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='KpiDirtyPair',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source_id', models.CharField(default='mis', max_length=64)),
+                ('doctor_id', models.BigIntegerField()),
+                ('period', models.CharField(max_length=7)),
+                ('marked_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name': 'Измененная пара врач/период',
+                'verbose_name_plural': 'Измененные пары врач/период',
+                'unique_together': {('source_id', 'doctor_id', 'period')},
+            },
+        ),
+    ]
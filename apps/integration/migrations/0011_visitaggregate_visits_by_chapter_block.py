@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('integration', '0010_kpidirtypair'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='visitaggregate',
+            name='visits_by_chapter',
+            field=models.JSONField(default=dict),
+        ),
+        migrations.AddField(
+            model_name='visitaggregate',
+            name='visits_by_block',
+            field=models.JSONField(default=dict),
+        ),
+    ]
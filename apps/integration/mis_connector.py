@@ -2,29 +2,54 @@
 
 import psycopg2
 import os
+import time
 from psycopg2 import sql
 from datetime import datetime, timedelta
 from django.conf import settings
-from django.db import connections
+from django.db import connections, transaction
+from django.utils import timezone
 from .models import (MisImportedVisit, VisitAggregate
                      , MisImportedSpecialization, MisImportedPurpose
-                     ,MisImportedDoctor, MisImportedMan)
+                     ,MisImportedDoctor, MisImportedMan, ImportState, ImportRun)
+from .bulk_loader import upsert_visits, empty_upsert_stats, add_upsert_stats
+from .dirty_pairs import mark_dirty
+from .reference_sync import ReferenceSync
+from .pipeline import run_pipeline
+from .throttle import AdaptiveThrottle
 
-class MISConnector:
-    """Класс для подключения и выгрузки данных из МИС"""    
-    
-    def extract_recent_visits(self, days_back=1):
-        """
-        Выгрузка визитов из МИС за последние N дней
-        Возвращает список визитов
-        """
-        try:
-            # Рассчитываем дату начала выгрузки
-            start_date = datetime.now() - timedelta(days=days_back)
+# Поля MisImportedVisit в порядке колонок запроса визитов
+VISIT_FIELDS = (
+    'keyidmis', 'num', 'casetypeid', 'dat', 'dat1', 'vistype', 'patientid',
+    'rootidmis', 'doctorid', 'doctorname', 'depid', 'depname',
+    'diag_code', 'diag_text', 'manid',
+)
 
-            # SQL запрос для выгрузки данных из МИС
-            query = """
-            SELECT 
+def visit_row_to_fields(visit):
+    """Преобразует строку выгрузки визитов из МИС в словарь полей MisImportedVisit"""
+    # Распаковываем данные согласно порядку в SELECT (служебные колонки в конце не нужны)
+    (keyid, num, casetypeid, dat, dat1, vistype, patientid,
+     rootid, doctorid, doctorname, depid, depname, diag_code, diag_text, manid) = visit[:len(VISIT_FIELDS)]
+
+    return {
+        'keyidmis': keyid, # используем keyid из МИС как keyidmis
+        'num': num or '',
+        'casetypeid': casetypeid,
+        'dat': dat,
+        'dat1': dat1,
+        'vistype': vistype,
+        'patientid': patientid,
+        'rootidmis': rootid,
+        'doctorid': doctorid,
+        'doctorname': doctorname or '',
+        'depid': depid,
+        'depname': depname or '',
+        'diag_code' : diag_code,
+        'diag_text' : diag_text,
+        'manid': manid,
+    }
+
+# Колонки запроса визитов (порядок соответствует VISIT_FIELDS)
+VISIT_COLUMNS_SQL = """
                 v.keyid,           -- keyidmis
                 v.num,             -- num
                 v.casetypeid,
@@ -37,82 +62,283 @@ class MISConnector:
                 m.text as doctorname, -- ФИО врача
                 d.depid,           -- depid
                 dep.text as depname,  -- название отделения
-                diag.code as diag_code, --код диагноза
-                diag.text as diag_text,  --текст диагноза
-                m.keyid as manid   -- manid
-            FROM solution_med.visit v
-            JOIN solution_med.docdep d ON v.doctorid = d.keyid
-            JOIN solution_med.dep dep ON d.depid = dep.keyid  
-            JOIN solution_med.doctor doc ON d.docid = doc.keyid
-            JOIN solution_med.man m ON doc.man_id = m.keyid
-            join solution_med.patdiag p on p.visitid = v.keyid
-            join solution_med.diagnos diag on diag.keyid = p.diagid
-            WHERE v.vistype BETWEEN 1 and 99
+                dg.code as diag_code, --код диагноза
+                dg.text as diag_text,  --текст диагноза
+                m.keyid as manid,  -- manid
+                dg.diag_rows       -- сколько основных диагнозов у визита
+"""
+
+# Визиты, которые выгружаются из МИС (алиас таблицы visit - v)
+VISIT_FILTER_SQL = """v.vistype BETWEEN 1 and 99
                 AND v.casetypeid = 3746
-                and p.diagtype = 1
-                and v.dat is not null
-                AND v.dat >= %s
-            ORDER BY v.dat DESC
+                and v.dat is not null"""
+
+def count_diagnosis_duplicates(visits_data):
+    """
+    Сколько строк-дублей дала бы прямая связка с patdiag:
+    визит с N основными диагнозами раньше приходил N раз
+    """
+    return sum(visit[len(VISIT_FIELDS)] - 1 for visit in visits_data)
+
+class MISConnector:
+    """Класс для подключения и выгрузки данных из МИС"""    
+    
+    def __init__(self, using='mis', schema='solution_med', source_id=None):
+        """
+        :param using: алиас БД, из которой выгружаются данные
+        :param schema: схема с таблицами МИС (visit, docdep, lu, ...)
+        :param source_id: источник, которым помечаются загруженные строки
+                          (по умолчанию - алиас БД МИС)
+        """
+        self.using = using
+        self.schema = schema
+        self.source_id = source_id or using
+        # Сколько дублей визитов по диагнозам отсечено на стороне МИС
+        self.duplicates_eliminated = 0
+        # Время выполнения запросов в МИС и передачи строк, секунд (для журнала импорта)
+        self.query_seconds = 0.0
+        self.transfer_seconds = 0.0
+        # Сколько визитов не удалось сохранить построчно (save_visits_to_db)
+        self.failed_rows = 0
+    
+    def build_visits_query(self, conditions='v.dat >= %s', order_by='v.dat DESC',
+                           columns=None, group_by=None):
+        """
+        SQL запрос выгрузки визитов из МИС.
+        conditions - дополнительное условие отбора (с параметрами %s)
+        columns - выражения SELECT вместо полного набора колонок визита
+                  (для агрегатов по тем же визитам, что попадают в выгрузку)
+        """
+        tail = ''
+        if group_by:
+            tail += f"GROUP BY {group_by}\n"
+        if order_by:
+            tail += f"ORDER BY {order_by}"
+        
+        return f"""
+            SELECT {columns or VISIT_COLUMNS_SQL}
+            FROM {self.schema}.visit v
+            JOIN {self.schema}.docdep d ON v.doctorid = d.keyid
+            JOIN {self.schema}.dep dep ON d.depid = dep.keyid  
+            JOIN {self.schema}.doctor doc ON d.docid = doc.keyid
+            JOIN {self.schema}.man m ON doc.man_id = m.keyid
+            -- Один основной диагноз на визит (первый по patdiag.keyid),
+            -- чтобы визит с несколькими диагнозами не приходил несколько раз
+            JOIN LATERAL (
+                SELECT
+                    diag.code,
+                    diag.text,
+                    count(*) OVER () as diag_rows
+                FROM {self.schema}.patdiag p
+                JOIN {self.schema}.diagnos diag on diag.keyid = p.diagid
+                WHERE p.visitid = v.keyid
+                    and p.diagtype = 1
+                ORDER BY p.keyid
+                LIMIT 1
+            ) dg ON true
+            WHERE {VISIT_FILTER_SQL}
+                AND {conditions}
+            {tail}
+            """
+    
+    def first_visit_keyid(self, conditions, params):
+        """
+        Минимальный v.keyid визитов окна - начало выгрузки по keyid.
+        Запрос только к visit (без справочников и диагнозов): в окне по v.dat
+        это один проход по индексу дат, а не по индексу keyid с начала истории.
+        Возвращает None, если визитов в окне нет
+        """
+        query = f"""
+            SELECT min(v.keyid)
+            FROM {self.schema}.visit v
+            WHERE {VISIT_FILTER_SQL}
+                AND {conditions}
             """
+        with connections[self.using].cursor() as cursor:
+            return self._timed_fetchall(cursor, query, params)[0][0]
+    
+    def extract_recent_visits(self, days_back=1):
+        """
+        Выгрузка визитов из МИС за последние N дней
+        Возвращает список визитов
+        """
+        # Рассчитываем дату начала выгрузки
+        start_date = datetime.now() - timedelta(days=days_back)
+        return self.extract_visits('v.dat >= %s', (start_date,))
+    
+    def extract_visits(self, conditions, params):
+        """
+        Выгрузка визитов из МИС по произвольному условию
+        Возвращает список визитов; ошибка запроса пробрасывается вызывающему,
+        чтобы сбой МИС не выглядел как пустая выгрузка
+        """
+        try:
+            # SQL запрос для выгрузки данных из МИС
+            query = self.build_visits_query(conditions)
             
             # Используем соединение из Django к БД МИС
-            with connections['mis'].cursor() as cursor:
-                cursor.execute(query, (start_date,))
-                visits_data = cursor.fetchall()
+            with connections[self.using].cursor() as cursor:
+                visits_data = self._timed_fetchall(cursor, query, params)
             
+            self.duplicates_eliminated += count_diagnosis_duplicates(visits_data)
             print(f"Выгружено {len(visits_data)} визитов из МИС")
             return visits_data
             
         except Exception as e:
             print(f"Ошибка при выгрузке из МИС: {e}")
-            return []
+            raise
+    
+    def iter_recent_visits(self, days_back=1, chunk_size=5000):
+        """
+        Потоковая выгрузка визитов из МИС за последние N дней.
+        Использует именованный (серверный) курсор и отдает пакеты
+        по chunk_size строк, не накапливая всю выборку в памяти.
+        """
+        start_date = datetime.now() - timedelta(days=days_back)
+        yield from self.iter_visits('v.dat >= %s', (start_date,), chunk_size)
+    
+    def iter_visits(self, conditions, params, chunk_size=5000):
+        """Потоковая выгрузка визитов из МИС по произвольному условию"""
+        yield from self._iter_visits_query(self.build_visits_query(conditions), params, chunk_size)
+    
+    def iter_visits_keyset(self, conditions, params, throttle=None):
+        """
+        Выгрузка визитов короткими запросами по возрастанию v.keyid.
+        Каждый пакет - отдельный запрос с LIMIT, поэтому МИС не держит
+        долгий снимок данных; темп задает AdaptiveThrottle по задержке ответа.
+        Курсор начинается с минимального keyid окна (first_visit_keyid).
+        """
+        throttle = throttle or AdaptiveThrottle()
+        query = self.build_visits_query(f'({conditions}) AND v.keyid >= %s', order_by='v.keyid') + ' LIMIT %s'
+        
+        next_keyid = self.first_visit_keyid(conditions, params)
+        if next_keyid is None:
+            print("Визитов для выгрузки в МИС нет")
+            return
+        
+        total = 0
+        batches = 0
+        while True:
+            batch_size = throttle.batch_size
+            started = time.monotonic()
+            with connections[self.using].cursor() as cursor:
+                rows = self._timed_fetchall(cursor, query, tuple(params) + (next_keyid, batch_size))
+            throttle.observe(time.monotonic() - started)
+            
+            if not rows:
+                break
+            
+            total += len(rows)
+            batches += 1
+            self.duplicates_eliminated += count_diagnosis_duplicates(rows)
+            yield rows
+            
+            if len(rows) < batch_size:
+                break
+            next_keyid = rows[-1][0] + 1
+            throttle.wait()
+        
+        print(f"Выгружено {total} визитов из МИС за {batches} запросов, "
+              f"паузы для разгрузки МИС: {throttle.total_pause:.1f}с")
+    
+    def _iter_visits_query(self, query, params, chunk_size):
+        """Выполняет запрос визитов серверным курсором и отдает пакеты строк"""
+        mis_connection = connections[self.using]
+        mis_connection.ensure_connection()
+        
+        total = 0
+        # Серверный курсор без WITH HOLD живет только внутри транзакции
+        with transaction.atomic(using=self.using):
+            with mis_connection.connection.cursor(name='mis_visits_stream') as cursor:
+                cursor.itersize = chunk_size
+                cursor.execute(query, params)
+                first = True
+                while True:
+                    started = time.monotonic()
+                    rows = cursor.fetchmany(chunk_size)
+                    # Серверный курсор выполняет запрос при первой выборке
+                    if first:
+                        self.query_seconds += time.monotonic() - started
+                        first = False
+                    else:
+                        self.transfer_seconds += time.monotonic() - started
+                    if not rows:
+                        break
+                    total += len(rows)
+                    self.duplicates_eliminated += count_diagnosis_duplicates(rows)
+                    yield rows
+        
+        print(f"Выгружено {total} визитов из МИС (потоково)")
+    
+    def _timed_fetchall(self, cursor, query, params=()):
+        """execute + fetchall с учетом времени запроса и передачи строк"""
+        started = time.monotonic()
+        cursor.execute(query, params)
+        executed = time.monotonic()
+        rows = cursor.fetchall()
+        self.query_seconds += executed - started
+        self.transfer_seconds += time.monotonic() - executed
+        return rows
     
     def save_visits_to_db(self, visits_data):
         """
-        Сохраняет выгруженные данные в нашу БД
+        Сохраняет выгруженные данные в нашу БД построчно.
+        Медленно, но ошибка указывает на конкретный визит -
+        используется для диагностики проблемной строки.
+        Несохраненные строки считаются в failed_rows.
         """
         saved_count = 0
+        affected = set()
         
         for visit in visits_data:
+            keyid = visit[0]
             try:
-                # Распаковываем данные согласно порядку в SELECT
-                (keyid, num, casetypeid, dat, dat1, vistype, patientid,
-                 rootid, doctorid, doctorname, depid, depname, diag_code, diag_text, manid) = visit
+                defaults = visit_row_to_fields(visit)
+                keyid = defaults.pop('keyidmis')
+                # Хеш пересчитает следующая пакетная загрузка
+                defaults['row_hash'] = None
                 
                 # Создаем или обновляем запись
                 obj, created = MisImportedVisit.objects.update_or_create(
-                    keyidmis=keyid, # используем keyid из МИС как keyidmis
-                    defaults={
-                        'num': num or '',
-                        'casetypeid': casetypeid,
-                        'dat': dat,
-                        'dat1': dat1,
-                        'vistype': vistype,
-                        'patientid': patientid,
-                        'rootidmis': rootid,
-                        'doctorid': doctorid,
-                        'doctorname': doctorname or '',
-                        'depid': depid,
-                        'depname': depname or '',
-                        'diag_code' : diag_code,
-                        'diag_text' : diag_text,
-                        'manid': manid,
-                    }
+                    source_id=self.source_id,
+                    keyidmis=keyid,
+                    defaults=defaults
                 )
                 
                 if created:
                     saved_count += 1
+                # Период считаем по локальному времени визита, как и пакетная загрузка
+                affected.add((self.source_id, defaults['doctorid'], defaults['dat'].strftime('%Y-%m')))
                     
             except Exception as e:
                 print(f"Ошибка при сохранении визита {keyid}: {e}")
+                self.failed_rows += 1
                 continue
         
+        mark_dirty(affected)
         return saved_count
     
+    def bulk_save_visits_to_db(self, visits_data, batch_size=5000):
+        """
+        Сохраняет визиты пакетами: COPY во временную таблицу
+        и один INSERT ... ON CONFLICT (source_id, keyidmis) на пакет.
+        Неизменившиеся визиты (по row_hash) не перезаписываются.
+        Возвращает {'created', 'updated', 'unchanged', 'affected'}
+        """
+        totals = empty_upsert_stats()
+        
+        for start in range(0, len(visits_data), batch_size):
+            batch = visits_data[start:start + batch_size]
+            add_upsert_stats(totals, upsert_visits(
+                [{'source_id': self.source_id, **visit_row_to_fields(visit)} for visit in batch]
+            ))
+        
+        return totals
+    
     def test_connection(self):
         """Проверка подключения к БД МИС"""
         try:
-            with connections['mis'].cursor() as cursor:
+            with connections[self.using].cursor() as cursor:
                 cursor.execute("SELECT 1")
             return True
         except Exception as e:
@@ -122,21 +348,20 @@ class MISConnector:
     def extract_specializations(self):
         """Выгрузка справочника специальностей из МИС (tag = 9)"""
         try:
-            query = """
+            query = f"""
                 SELECT 
                     l.keyid,
                     l.tag,
                     l.code,
                     l.text
-                FROM solution_med.lu l
+                FROM {self.schema}.lu l
                 WHERE l.tag = 9  -- специальности врачей
                     AND l.status = 1
                 ORDER BY l.code
             """
             
-            with connections['mis'].cursor() as cursor:
-                cursor.execute(query)
-                specializations_data = cursor.fetchall()
+            with connections[self.using].cursor() as cursor:
+                specializations_data = self._timed_fetchall(cursor, query)
             
             print(f"Выгружено {len(specializations_data)} специальностей из МИС")
             return specializations_data
@@ -148,21 +373,20 @@ class MISConnector:
     def extract_purposes(self):
         """Выгрузка справочника целей визитов из МИС (tag = 20)"""
         try:
-            query = """
+            query = f"""
                 SELECT 
                     l.keyid,
                     l.tag,
                     l.code,
                     l.text
-                FROM solution_med.lu l
+                FROM {self.schema}.lu l
                 WHERE l.tag = 20  -- цели визитов
                     AND l.status = 1
                 ORDER BY l.code
             """
             
-            with connections['mis'].cursor() as cursor:
-                cursor.execute(query)
-                purposes_data = cursor.fetchall()
+            with connections[self.using].cursor() as cursor:
+                purposes_data = self._timed_fetchall(cursor, query)
             
             print(f"Выгружено {len(purposes_data)} целей визитов из МИС")
             return purposes_data
@@ -171,56 +395,67 @@ class MISConnector:
             print(f"Ошибка при выгрузке целей визитов: {e}")
             return []
         
+    def _sync_reference(self, sync, rows, title):
+        """Синхронизирует справочник и печатает итог; при ошибке возвращает None"""
+        try:
+            stats = sync.sync(rows)
+        except Exception as e:
+            print(f"Ошибка при сохранении справочника '{title}': {e}")
+            return None
+        
+        print(f"{title}: добавлено {stats['inserted']}, изменено {stats['updated']}, "
+              f"без изменений {stats['unchanged']}")
+        return stats
+    
     def save_specializations_to_db(self, specializations_data):
-        """Сохраняет специальности в нашу БД"""
-        saved_count = 0
-        for spec in specializations_data:
-            try:
-                keyidmis, tag, code, text = spec
-                
-                obj, created = MisImportedSpecialization.objects.update_or_create(
-                    keyidmis=keyidmis,
-                    defaults={
-                        'tag': tag,
-                        'code': code,
-                        'text': text or '',
-                    }
-                )
-                if created:
-                    saved_count += 1
-            except Exception as e:
-                print(f"Ошибка при сохранении специальности {keyidmis}: {e}")
-                continue
+        """
+        Сохраняет специальности в нашу БД (только новые и измененные)
+        Возвращает {'inserted', 'updated', 'unchanged'}
+        """
+        rows = [
+            {'keyidmis': keyidmis, 'tag': tag, 'code': code, 'text': text or ''}
+            for keyidmis, tag, code, text in specializations_data
+        ]
+        sync = ReferenceSync(MisImportedSpecialization, 'keyidmis', ['tag', 'code', 'text'])
+        return self._sync_reference(sync, rows, 'Специальности')
+    
+    def specialization_mismatches(self, specializations_data):
+        """
+        Сверяет специальности источника с общим справочником (он грузится из первого источника).
+        ID специальности (lu.keyid) - суррогатный ключ своей МИС, а врачи сопоставляются
+        со справочником по specidmis: расхождение ID дает врачу чужую специальность и план.
+        Возвращает список расхождений
+        """
+        stored = {spec.keyidmis: spec for spec in MisImportedSpecialization.objects.all()}
+        mismatches = []
+        for keyidmis, tag, code, text in specializations_data:
+            spec = stored.get(keyidmis)
+            if spec is None:
+                mismatches.append(f"ID {keyidmis} ({code} {text}): нет в общем справочнике")
+            elif (spec.code, spec.text) != (code, text or ''):
+                mismatches.append(f"ID {keyidmis}: в {self.source_id} - {code} {text}, "
+                                  f"в справочнике - {spec.code} {spec.text}")
         
-        return saved_count
+        for mismatch in mismatches[:20]:
+            print(f"  ⚠️ [{self.source_id}] {mismatch}")
+        return mismatches
     
     def save_purposes_to_db(self, purposes_data):
-        """Сохраняет цели визитов в нашу БД"""
-        saved_count = 0
-        for purpose in purposes_data:
-            try:
-                keyidmis, tag, code, text = purpose
-                
-                obj, created = MisImportedPurpose.objects.update_or_create(
-                    keyidmis=keyidmis,
-                    defaults={
-                        'tag': tag,
-                        'code': code,
-                        'text': text or '',
-                    }
-                )
-                if created:
-                    saved_count += 1
-            except Exception as e:
-                print(f"Ошибка при сохранении цели {keyidmis}: {e}")
-                continue
-        
-        return saved_count
+        """
+        Сохраняет цели визитов в нашу БД (только новые и измененные)
+        Возвращает {'inserted', 'updated', 'unchanged'}
+        """
+        rows = [
+            {'keyidmis': keyidmis, 'tag': tag, 'code': code, 'text': text or ''}
+            for keyidmis, tag, code, text in purposes_data
+        ]
+        sync = ReferenceSync(MisImportedPurpose, 'keyidmis', ['tag', 'code', 'text'])
+        return self._sync_reference(sync, rows, 'Цели визитов')
     
     def extract_doctors(self):
         """Выгрузка врачей из МИС"""
         try:
-            query = """
+            query = f"""
                 SELECT 
                     d.keyid as keyiddocdep,
                     d.specid as specidmis,
@@ -229,17 +464,16 @@ class MISConnector:
                     d.depid as depidmis,
                     dep.text as depnamemis,
                     m.keyid as manidmis
-                FROM solution_med.docdep d
-                JOIN solution_med.lu s ON d.specid = s.keyid
-                JOIN solution_med.doctor doc ON d.docid = doc.keyid
-                JOIN solution_med.man m ON doc.man_id = m.keyid
-                JOIN solution_med.dep dep ON d.depid = dep.keyid
+                FROM {self.schema}.docdep d
+                JOIN {self.schema}.lu s ON d.specid = s.keyid
+                JOIN {self.schema}.doctor doc ON d.docid = doc.keyid
+                JOIN {self.schema}.man m ON doc.man_id = m.keyid
+                JOIN {self.schema}.dep dep ON d.depid = dep.keyid
                 WHERE d.status = 1
             """
             
-            with connections['mis'].cursor() as cursor:
-                cursor.execute(query)
-                doctors_data = cursor.fetchall()
+            with connections[self.using].cursor() as cursor:
+                doctors_data = self._timed_fetchall(cursor, query)
             
             print(f"Выгружено {len(doctors_data)} врачей из МИС")
             return doctors_data
@@ -251,17 +485,16 @@ class MISConnector:
     def extract_man_users(self):
         """Выгрузка пользователей из МИС"""
         try:
-            query = """
+            query = f"""
                 SELECT 
                     m.keyid as manidmis,
                     m.text
-                FROM solution_med.man m
+                FROM {self.schema}.man m
                 WHERE m.text IS NOT NULL
             """
         
-            with connections['mis'].cursor() as cursor:
-                cursor.execute(query)
-                man_data = cursor.fetchall()
+            with connections[self.using].cursor() as cursor:
+                man_data = self._timed_fetchall(cursor, query)
             
             print(f"Выгружено {len(man_data)} пользователей из МИС")
             return man_data
@@ -271,77 +504,242 @@ class MISConnector:
             return []  
 
     def save_doctors_to_db(self, doctors_data):
-        """Сохраняет врачей в нашу БД"""
-        saved_count = 0
-        for doctor in doctors_data:
-            try:
-                (keyiddocdep, specidmis, specnamemis, docnamemis, 
-                depidmis, depnamemis, manidmis) = doctor
-                
-                obj, created = MisImportedDoctor.objects.update_or_create(
-                    keyiddocdep=keyiddocdep,
-                    defaults={
-                        'specidmis': specidmis,
-                        'specnamemis': specnamemis or '',
-                        'docnamemis': docnamemis or '',
-                        'depidmis': depidmis,
-                        'depnamemis': depnamemis or '',
-                        'manidmis': manidmis,
-                    }
-                )
-                if created:
-                    saved_count += 1
-            except Exception as e:
-                print(f"Ошибка при сохранении врача {keyiddocdep}: {e}")
-                continue
-        
-        return saved_count
+        """
+        Сохраняет врачей в нашу БД (только новые и измененные)
+        Возвращает {'inserted', 'updated', 'unchanged'}
+        """
+        rows = [
+            {
+                'keyiddocdep': keyiddocdep,
+                'specidmis': specidmis,
+                'specnamemis': specnamemis or '',
+                'docnamemis': docnamemis or '',
+                'depidmis': depidmis,
+                'depnamemis': depnamemis or '',
+                'manidmis': manidmis,
+            }
+            for (keyiddocdep, specidmis, specnamemis, docnamemis,
+                 depidmis, depnamemis, manidmis) in doctors_data
+        ]
+        sync = ReferenceSync(
+            MisImportedDoctor, 'keyiddocdep',
+            ['specidmis', 'specnamemis', 'docnamemis', 'depidmis', 'depnamemis', 'manidmis'],
+            scope={'source_id': self.source_id},
+        )
+        return self._sync_reference(sync, rows, 'Врачи')
     
     def save_man_to_db(self, man_data):
-        """Сохраняет пользователей в нашу БД"""
-        saved_count = 0
-        for man in man_data:
-            try:
-                manidmis, text = man
-                
-                obj, created = MisImportedMan.objects.update_or_create(
-                    manidmis=manidmis,
-                    defaults={
-                        'text': text or '',
-                    }
-                )
-                if created:
-                    saved_count += 1
-            except Exception as e:
-                print(f"Ошибка при сохранении пользователя {manidmis}: {e}")
-                continue
-        
-        return saved_count
+        """
+        Сохраняет пользователей в нашу БД (только новые и измененные)
+        Возвращает {'inserted', 'updated', 'unchanged'}
+        """
+        rows = [
+            {'manidmis': manidmis, 'text': text or ''}
+            for manidmis, text in man_data
+        ]
+        sync = ReferenceSync(MisImportedMan, 'manidmis', ['text'], batch_size=5000,
+                             scope={'source_id': self.source_id})
+        return self._sync_reference(sync, rows, 'Пользователи')
+
+def get_mis_sources():
+    """Алиасы БД МИС из настроек: 'mis' и mis_<id> для МИС клиник"""
+    return [alias for alias in settings.DATABASES if alias == 'mis' or alias.startswith('mis_')]
+
+def get_incremental_window(source='mis', overlap_hours=24):
+    """
+    Условие отбора визитов для инкрементального импорта по отметке источника.
+    Возвращает (conditions, params) или None, если отметки еще нет.
+    """
+    state = ImportState.objects.filter(source=source).first()
+    if state is None or state.last_dat is None:
+        return None
+    
+    # В МИС время хранится без часового пояса - сравниваем с локальным временем
+    last_dat = timezone.make_naive(state.last_dat) if timezone.is_aware(state.last_dat) else state.last_dat
+    
+    if overlap_hours:
+        # Перекрытие подхватывает визиты, отредактированные задним числом
+        return 'v.dat >= %s', (last_dat - timedelta(hours=overlap_hours),)
+    
+    return '(v.dat, v.keyid) > (%s, %s)', (last_dat, state.last_keyid or 0)
+
+def visits_high_water_mark(visits_data, current=None):
+    """Максимальная пара (dat, keyid) среди выгруженных визитов"""
+    mark = current
+    for visit in visits_data:
+        # Порядок колонок: keyid - первая, dat - четвертая
+        candidate = (visit[3], visit[0])
+        if mark is None or candidate > mark:
+            mark = candidate
+    return mark
+
+def save_high_water_mark(mark, source='mis'):
+    """Сохраняет отметку импорта, если она продвинулась вперед"""
+    if mark is None:
+        return
+    
+    last_dat, last_keyid = mark
+    if settings.USE_TZ and timezone.is_naive(last_dat):
+        last_dat = timezone.make_aware(last_dat)
+    
+    state, created = ImportState.objects.get_or_create(source=source)
+    if state.last_dat is None or (last_dat, last_keyid) > (state.last_dat, state.last_keyid or 0):
+        state.last_dat = last_dat
+        state.last_keyid = last_keyid
+        state.save()
+        print(f"Отметка импорта {source}: {last_dat} / {last_keyid}")
+
+def record_import_run(run, connector, stats, extracted, write_seconds):
+    """Переносит счетчики и замеры этапов импорта в запись журнала (без сохранения)"""
+    run.rows_extracted = extracted
+    run.rows_inserted = stats['created']
+    run.rows_updated = stats['updated']
+    run.rows_skipped = stats['unchanged']
+    run.query_seconds = connector.query_seconds
+    run.transfer_seconds = connector.transfer_seconds
+    run.write_seconds = write_seconds
 
 # Функция для ручного запуска
-def import_mis_data(days_back=1):
+def import_mis_data(days_back=1, bulk=True, stream=False, chunk_size=5000,
+                    incremental=False, overlap_hours=24, pipeline=False, queue_size=4,
+                    keyset=False, target_latency=0.5, source='mis'):
     """
     Основная функция для импорта данных из МИС
     days_back - за сколько дней выгружать данные
+    bulk - пакетная запись через COPY; False - построчная (для диагностики)
+    stream - выгружать серверным курсором пакетами по chunk_size строк,
+             сохраняя каждый пакет сразу после получения
+    incremental - выгружать только визиты после отметки прошлого импорта
+                  (с перекрытием overlap_hours); без отметки - за days_back дней
+    pipeline - потоковое чтение из МИС в отдельном потоке одновременно с записью;
+               queue_size - сколько пакетов может ждать записи
+    keyset - щадящая выгрузка короткими запросами по v.keyid с паузами,
+             удерживающими время ответа МИС около target_latency секунд
+    source - алиас БД МИС (см. get_mis_sources)
     """
-    connector = MISConnector()
+    run = ImportRun.objects.create(command='import_mis_data', source=source)
+    try:
+        return _run_import(run, days_back, bulk, stream, chunk_size, incremental, overlap_hours,
+                           pipeline, queue_size, keyset, target_latency, source)
+    except Exception as e:
+        # Запуск не должен остаться в журнале в статусе "выполняется"
+        print(f"❌ [{source}] Ошибка импорта: {e}")
+        run.finish(error=str(e))
+        raise
+
+def _run_import(run, days_back, bulk, stream, chunk_size, incremental, overlap_hours,
+                pipeline, queue_size, keyset, target_latency, source):
+    """Импорт визитов источника; итог записывается в журнал run (см. import_mis_data)"""
+    connector = MISConnector(using=source)
     
-    print("Проверка подключения к МИС...")
+    print(f"[{source}] Проверка подключения к МИС...")
     if not connector.test_connection():
-        print("❌ Нет подключения к МИС")
+        print(f"❌ [{source}] Нет подключения к МИС")
+        run.finish(error='Нет подключения к МИС')
         return
     
     print("✅ Подключение к МИС успешно")
     
-    print(f"Выгрузка данных за последние {days_back} дней...")
-    visits_data = connector.extract_recent_visits(days_back=days_back)
+    window = get_incremental_window(source, overlap_hours=overlap_hours) if incremental else None
+    if window is None:
+        if incremental:
+            print("Отметка импорта не найдена, выполняется первичная выгрузка")
+        print(f"Выгрузка данных за последние {days_back} дней...")
+        start_date = datetime.now() - timedelta(days=days_back)
+        window = ('v.dat >= %s', (start_date,))
+    else:
+        print(f"Инкрементальная выгрузка: {window[0]} {window[1]}")
+    
+    conditions, params = window
+    window_start = params[0]
+    run.window_start = timezone.make_aware(window_start) if settings.USE_TZ else window_start
+    run.window_end = run.started_at
+    
+    def produce():
+        if keyset:
+            throttle = AdaptiveThrottle(target_latency=target_latency, batch_size=chunk_size)
+            return connector.iter_visits_keyset(conditions, params, throttle=throttle)
+        return connector.iter_visits(conditions, params, chunk_size=chunk_size)
+    
+    if pipeline:
+        batches = None
+    elif stream or keyset:
+        batches = produce()
+    else:
+        try:
+            visits_data = connector.extract_visits(conditions, params)
+        except Exception as e:
+            print("❌ Не удалось выгрузить данные из МИС")
+            record_import_run(run, connector, empty_upsert_stats(), 0, 0.0)
+            run.finish(error=f'Не удалось выгрузить данные из МИС: {e}')
+            return
+        
+        if not visits_data:
+            # Запрос выполнен без ошибок - визитов в окне действительно нет
+            record_import_run(run, connector, empty_upsert_stats(), 0, 0.0)
+            print("✅ Новых визитов нет" if incremental else "✅ Визитов за период нет")
+            run.finish()
+            return 0
+        
+        print(f"Сохранение {len(visits_data)} визитов в нашу БД...")
+        batches = [visits_data]
+    
+    totals = empty_upsert_stats()
+    totals['mark'] = None
+    totals['extracted'] = 0
+    totals['write_seconds'] = 0.0
     
-    if not visits_data:
-        print("❌ Не удалось выгрузить данные из МИС")
+    def save_batch(batch):
+        started = time.monotonic()
+        if bulk:
+            add_upsert_stats(totals, connector.bulk_save_visits_to_db(batch, batch_size=chunk_size))
+        else:
+            totals['created'] += connector.save_visits_to_db(batch)
+        totals['write_seconds'] += time.monotonic() - started
+        totals['extracted'] += len(batch)
+        totals['mark'] = visits_high_water_mark(batch, totals['mark'])
+    
+    try:
+        if pipeline:
+            # Чтение идет в своем потоке на отдельном соединении с МИС
+            run_pipeline(
+                produce,
+                save_batch,
+                queue_size=queue_size,
+            )
+        else:
+            for batch in batches:
+                save_batch(batch)
+    except Exception as e:
+        print(f"❌ Ошибка импорта: {e}")
+        if bulk:
+            print("Для поиска проблемной строки запустите импорт в построчном режиме")
+        record_import_run(run, connector, totals, totals['extracted'], totals['write_seconds'])
+        run.finish(error=str(e))
         return
     
-    print(f"Сохранение {len(visits_data)} визитов в нашу БД...")
-    saved_count = connector.save_visits_to_db(visits_data)
+    saved_count = totals['created']
+    if connector.duplicates_eliminated:
+        print(f"Отсечено дублей визитов по диагнозам: {connector.duplicates_eliminated}")
+    if bulk:
+        print(f"Новых записей: {saved_count}, обновлено: {totals['updated']}, "
+              f"без изменений: {totals['unchanged']}")
+        print(f"Затронуто пар врач/период: {len(totals['affected'])}")
+        for source_id, doctor_id, period in sorted(totals['affected'])[:20]:
+            print(f"  {source_id}: врач {doctor_id}, период {period}")
+    
+    record_import_run(run, connector, totals, totals['extracted'], totals['write_seconds'])
+    if connector.failed_rows:
+        # Отметку не двигаем: несохраненные визиты выгрузятся повторно при следующем импорте
+        print(f"❌ Не сохранено визитов: {connector.failed_rows}, отметка импорта не изменена")
+        run.finish(error=f'Не сохранено визитов: {connector.failed_rows}')
+        return saved_count
+    
+    # Отметка двигается только после успешного сохранения всех пакетов
+    save_high_water_mark(totals['mark'], source)
+    run.finish()
+    print(f"Время: запросы МИС {run.query_seconds:.1f}с, передача {run.transfer_seconds:.1f}с, "
+          f"запись {run.write_seconds:.1f}с, {run.rows_per_second:.0f} строк/с")
     
     print(f"✅ Успешно импортировано {saved_count} записей")
     return saved_count
\ No newline at end of file
@@ -1,10 +1,12 @@
 #apps/integration/models.py
 
 from django.db import models
+from django.utils import timezone
 
 class MisImportedVisit(models.Model):
     keyid = models.BigAutoField(primary_key=True)     # наш авто-инкремент
-    keyidmis = models.BigIntegerField(unique=True)    # уникальный ID из МИС
+    source_id = models.CharField(max_length=64, default='mis')  # Источник (алиас БД МИС)
+    keyidmis = models.BigIntegerField()    # ID из МИС (уникален в пределах источника)
     num = models.BigIntegerField()
     casetypeid = models.IntegerField(null=True, blank=True)
     dat = models.DateTimeField()
@@ -20,17 +22,20 @@ class MisImportedVisit(models.Model):
     diag_code = models.CharField(max_length=12)
     diag_text = models.CharField(max_length=512)
     manid = models.BigIntegerField()
+    row_hash = models.CharField(max_length=32, null=True, blank=True)  # md5 содержимого визита
     
     class Meta:
         managed = False  # Django не будет управлять этой таблицей
         db_table = 'solution_med\".\"import_visit'  # Указываем схему и таблицу
         app_label = 'integration'
+        unique_together = ['source_id', 'keyidmis']
 
     def __str__(self):
         return f"{self.doctorname} - {self.dat}"
     
 class VisitAggregate(models.Model):
     """Агрегированные данные по визитам для быстрого расчета KPI."""
+    source_id = models.CharField(max_length=64, default='mis')  # Источник (алиас БД МИС)
     doctor_id = models.BigIntegerField()  # ID врача из МИС
     doctor_name = models.CharField(max_length=255)
     specialization = models.ForeignKey(
@@ -43,6 +48,8 @@ class VisitAggregate(models.Model):
     
     total_visits = models.IntegerField(default=0)
     visits_by_purpose = models.JSONField(default=dict)  # {'vistype_code': count}
+    visits_by_chapter = models.JSONField(default=dict)  # {'класс МКБ-10': count}
+    visits_by_block = models.JSONField(default=dict)  # {'блок МКБ-10': count}; доли - Icd10Index.shares
     validated_docs_count = models.IntegerField(default=0)
     total_docs_count = models.IntegerField(default=0)
     visits_with_z_diagnosis = models.IntegerField(default=0)
@@ -50,12 +57,118 @@ class VisitAggregate(models.Model):
     calculated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
-        unique_together = ['doctor_id', 'period']
+        unique_together = ['source_id', 'doctor_id', 'period']
         verbose_name = 'Агрегированные визиты'
         verbose_name_plural = 'Агрегированные визиты'
 
     def __str__(self):
         return f"{self.doctor_name} - {self.period}"
+
+class ImportState(models.Model):
+    """Отметка (high-water mark) последнего импорта визитов по источнику."""
+    source = models.CharField(max_length=64, unique=True)  # Алиас БД МИС
+    last_dat = models.DateTimeField(null=True, blank=True)  # Максимальная v.dat
+    last_keyid = models.BigIntegerField(null=True, blank=True)  # keyid визита с этой датой
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Состояние импорта'
+        verbose_name_plural = 'Состояния импорта'
+
+    def __str__(self):
+        return f"{self.source}: {self.last_dat} / {self.last_keyid}"
+
+class BackfillPartition(models.Model):
+    """Партиция исторической догрузки визитов (для продолжения после сбоя)."""
+    STATUS_PENDING = 'pending'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Ожидает'),
+        (STATUS_DONE, 'Загружена'),
+        (STATUS_FAILED, 'Ошибка'),
+    ]
+
+    source = models.CharField(max_length=64)  # Алиас БД МИС
+    date_from = models.DateField()  # Начало партиции (включительно)
+    date_to = models.DateField()  # Конец партиции (не включительно)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.IntegerField(default=0)
+    rows_extracted = models.IntegerField(default=0)
+    rows_created = models.IntegerField(default=0)
+    rows_updated = models.IntegerField(default=0)
+    error = models.TextField(blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        unique_together = ['source', 'date_from', 'date_to']
+        verbose_name = 'Партиция догрузки'
+        verbose_name_plural = 'Партиции догрузки'
+
+    def __str__(self):
+        return f"{self.source}: {self.date_from} - {self.date_to} ({self.status})"
+
+class KpiDirtyPair(models.Model):
+    """Пара врач/период, визиты которой изменились после последнего расчета KPI."""
+    source_id = models.CharField(max_length=64, default='mis')  # Источник (алиас БД МИС)
+    doctor_id = models.BigIntegerField()  # ID врача из МИС (doctorid визита)
+    period = models.CharField(max_length=7)  # Формат 'YYYY-MM'
+    marked_at = models.DateTimeField(default=timezone.now)  # Когда пара изменилась последний раз
+
+    class Meta:
+        unique_together = ['source_id', 'doctor_id', 'period']
+        verbose_name = 'Измененная пара врач/период'
+        verbose_name_plural = 'Измененные пары врач/период'
+
+    def __str__(self):
+        return f"{self.source_id}: {self.doctor_id} - {self.period}"
+
+class ImportRun(models.Model):
+    """Журнал запусков импорта из МИС с замерами по этапам."""
+    STATUS_RUNNING = 'running'
+    STATUS_SUCCESS = 'success'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_RUNNING, 'Выполняется'),
+        (STATUS_SUCCESS, 'Успешно'),
+        (STATUS_FAILED, 'Ошибка'),
+    ]
+
+    command = models.CharField(max_length=64)  # import_mis_data, import_mis_all_data
+    source = models.CharField(max_length=64, default='mis')  # Алиас БД МИС
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_RUNNING)
+    started_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    window_start = models.DateTimeField(null=True, blank=True)  # Начало окна выгрузки
+    window_end = models.DateTimeField(null=True, blank=True)  # Конец окна (время запуска)
+    rows_extracted = models.IntegerField(default=0)
+    rows_inserted = models.IntegerField(default=0)
+    rows_updated = models.IntegerField(default=0)
+    rows_skipped = models.IntegerField(default=0)  # Без изменений
+    query_seconds = models.FloatField(default=0)  # Выполнение запросов в МИС
+    transfer_seconds = models.FloatField(default=0)  # Передача строк из МИС
+    write_seconds = models.FloatField(default=0)  # Запись в БД KPI
+    total_seconds = models.FloatField(default=0)
+    rows_per_second = models.FloatField(default=0)  # rows_extracted / total_seconds
+    error = models.TextField(blank=True)
+
+    class Meta:
+        ordering = ['-started_at']
+        verbose_name = 'Запуск импорта'
+        verbose_name_plural = 'Журнал импорта'
+
+    def __str__(self):
+        return f"{self.command} {self.started_at:%Y-%m-%d %H:%M} ({self.status})"
+
+    def finish(self, error=''):
+        """Фиксирует итог запуска и пропускную способность"""
+        self.finished_at = timezone.now()
+        self.total_seconds = (self.finished_at - self.started_at).total_seconds()
+        if self.total_seconds > 0:
+            self.rows_per_second = self.rows_extracted / self.total_seconds
+        self.error = error
+        self.status = self.STATUS_FAILED if error else self.STATUS_SUCCESS
+        self.save()
     
 class MisImportedSpecialization(models.Model):
     keyid = models.BigAutoField(primary_key=True)
@@ -89,7 +202,8 @@ class MisImportedPurpose(models.Model):
     
 class MisImportedDoctor(models.Model):
     keyid = models.BigAutoField(primary_key=True)
-    keyiddocdep = models.BigIntegerField(unique=True)  # ID из docdep
+    source_id = models.CharField(max_length=64, default='mis')  # Источник (алиас БД МИС)
+    keyiddocdep = models.BigIntegerField()  # ID из docdep (уникален в пределах источника)
     specidmis = models.BigIntegerField()  # ID специальности из МИС
     specnamemis = models.CharField(max_length=1000)  # Название специальности
     docnamemis = models.CharField(max_length=1000)  # ФИО врача
@@ -101,19 +215,22 @@ class MisImportedDoctor(models.Model):
     class Meta:
         managed = False
         db_table = 'solution_med"."import_doctor'
+        unique_together = ['source_id', 'keyiddocdep']
 
     def __str__(self):
         return self.docnamemis
 
 class MisImportedMan(models.Model):
     keyid = models.BigAutoField(primary_key=True)
-    manidmis = models.BigIntegerField(unique=True)  # ID пользователя из МИС
+    source_id = models.CharField(max_length=64, default='mis')  # Источник (алиас БД МИС)
+    manidmis = models.BigIntegerField()  # ID пользователя из МИС (уникален в пределах источника)
     text = models.CharField(max_length=256)  # ФИО пользователя
     imported_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         managed = False
         db_table = 'solution_med"."import_man'
+        unique_together = ['source_id', 'manidmis']
 
     def __str__(self):
         return self.text
\ No newline at end of file
@@ -0,0 +1,68 @@
+#apps/integration/pipeline.py
+
+"""
+Конвейер импорта: один поток читает пакеты из МИС в ограниченную очередь,
+вызывающий поток параллельно пишет их в БД KPI.
+Заполненная очередь останавливает чтение, поэтому память не растет.
+"""
+
+import queue
+import threading
+from django.db import connections
+
+_DONE = object()
+
+
+class _ProducerError:
+    """Ошибка потока чтения, передаваемая через очередь"""
+
+    def __init__(self, error):
+        self.error = error
+
+
+def run_pipeline(produce, consume, queue_size=4):
+    """
+    Запускает конвейер чтение -> запись.
+    produce - функция без аргументов, возвращающая итератор пакетов
+              (выполняется в отдельном потоке на своих соединениях)
+    consume - функция записи одного пакета (выполняется в текущем потоке)
+    queue_size - сколько прочитанных пакетов может ждать записи
+    """
+    batches = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+
+    def put(item):
+        # Ожидание с таймаутом, чтобы поток чтения заметил остановку конвейера
+        while not stop.is_set():
+            try:
+                batches.put(item, timeout=1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def producer():
+        try:
+            for batch in produce():
+                if not put(batch):
+                    break
+        except Exception as e:
+            put(_ProducerError(e))
+        finally:
+            put(_DONE)
+            connections.close_all()
+
+    thread = threading.Thread(target=producer, name='mis-import-producer', daemon=True)
+    thread.start()
+
+    try:
+        while True:
+            item = batches.get()
+            if item is _DONE:
+                break
+            if isinstance(item, _ProducerError):
+                raise item.error
+            consume(item)
+    finally:
+        stop.set()
+        thread.join()
@@ -0,0 +1,346 @@
+#apps/integration/reconciliation.py
+
+"""
+Сверка импортированных визитов с МИС.
+По каждому дню сравниваются количество визитов и контрольная сумма
+их содержимого в МИС и в solution_med.import_visit; ID визитов выгружаются
+только за несовпавшие дни, и удаляются только исчезнувшие из МИС визиты.
+Визит, которого нет в МИС за день, перед удалением ищется в МИС по ID:
+если дату визита исправили на другой день, он перезагружается, а не удаляется.
+
+Контрольная сумма - md5 по визитам группы, упорядоченным по ID, от строк
+"ID:хеш", где хеш считается так же, как row_hash при загрузке
+(bulk_loader.VISIT_HASH_SQL по VISIT_HASH_COLUMNS): в МИС - по выражениям
+MIS_HASH_EXPRESSIONS, приводящим значения к тому виду, в каком они лежат у нас.
+
+День визита - календарная дата по местному времени проекта (TIME_ZONE)
+с обеих сторон: наивное время МИС считается местным (как и при загрузке),
+и день берется одним выражением VISIT_DAY_SQL от момента времени визита.
+"""
+
+from datetime import datetime, timedelta
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils import timezone
+from .bulk_loader import empty_upsert_stats, add_upsert_stats, VISIT_HASH_COLUMNS, VISIT_HASH_SQL
+from .dirty_pairs import mark_dirty
+
+# День визита по моменту времени (timestamptz) в местном времени проекта
+VISIT_DAY_SQL = "({dat} AT TIME ZONE %(tz)s)::date"
+
+# Контрольная сумма содержимого визитов группы
+CONTENT_CHECKSUM_SQL = "md5(string_agg({key}::text || ':' || {row_hash}, ',' ORDER BY {key}))"
+
+# Значения МИС в том виде, в каком их сохраняет загрузка (visit_row_to_fields,
+# типы bulk_loader.VISIT_STAGE_COLUMNS); порядок - VISIT_HASH_COLUMNS
+MIS_HASH_EXPRESSIONS = {
+    'num': 'NULLIF(v.num, 0)::bigint',  # num or '' -> NULL
+    'casetypeid': 'v.casetypeid::integer',
+    'dat': 'v.dat AT TIME ZONE %(tz)s',  # наивное время МИС - местное время проекта
+    'dat1': 'v.dat1 AT TIME ZONE %(tz)s',
+    'vistype': 'v.vistype::integer',
+    'patientid': 'v.patientid::bigint',
+    'rootidmis': 'v.rootid::bigint',
+    'doctorid': 'v.doctorid::bigint',
+    'doctorname': "coalesce(m.text, '')::varchar",
+    'depid': 'd.depid::bigint',
+    'depname': "coalesce(dep.text, '')::varchar",
+    'diag_code': 'dg.code::varchar',
+    'diag_text': 'dg.text::varchar',
+    'manid': 'm.keyid::bigint',
+}
+
+MIS_DAY_SQL = VISIT_DAY_SQL.format(dat='(v.dat AT TIME ZONE %(tz)s)')
+MIS_CHECKSUM_SQL = CONTENT_CHECKSUM_SQL.format(
+    key='v.keyid',
+    row_hash=VISIT_HASH_SQL.format(columns=', '.join(MIS_HASH_EXPRESSIONS[name] for name in VISIT_HASH_COLUMNS)),
+)
+
+# Границы по v.dat - наивное время МИС
+MIS_RANGE_CONDITIONS = 'v.dat >= %(start)s AND v.dat < %(end)s'
+
+LOCAL_DAY_SQL = VISIT_DAY_SQL.format(dat='dat')
+LOCAL_CHECKSUM_SQL = CONTENT_CHECKSUM_SQL.format(
+    key='keyidmis',
+    row_hash=VISIT_HASH_SQL.format(columns=', '.join(VISIT_HASH_COLUMNS)),
+)
+
+LOCAL_DAY_CHECKSUMS_SQL = f"""
+    SELECT {LOCAL_DAY_SQL}, count(*), {LOCAL_CHECKSUM_SQL}
+    FROM solution_med.import_visit
+    WHERE source_id = %(source_id)s AND dat >= %(start)s AND dat < %(end)s
+    GROUP BY 1
+"""
+
+LOCAL_DOCTOR_DAY_CHECKSUMS_SQL = f"""
+    SELECT {LOCAL_DAY_SQL}, doctorid, count(*), {LOCAL_CHECKSUM_SQL}
+    FROM solution_med.import_visit
+    WHERE source_id = %(source_id)s AND dat >= %(start)s AND dat < %(end)s
+    GROUP BY 1, 2
+"""
+
+LOCAL_DAY_KEYIDS_SQL = """
+    SELECT keyidmis
+    FROM solution_med.import_visit
+    WHERE source_id = %(source_id)s AND dat >= %(start)s AND dat < %(end)s
+"""
+
+DELETE_VISITS_SQL = """
+    DELETE FROM solution_med.import_visit
+    WHERE source_id = %(source_id)s AND keyidmis = ANY(%(keyids)s)
+    RETURNING source_id, doctorid, to_char(dat AT TIME ZONE %(tz)s, 'YYYY-MM')
+"""
+
+# Сколько ID визитов проверять в МИС одним запросом
+KEYID_CHUNK_SIZE = 10000
+
+
+def _day_bounds(date_from, date_to):
+    """
+    Границы диапазона дней [date_from, date_to] по местному времени проекта:
+    наивные для МИС (время без пояса) и с поясом для нашей БД
+    """
+    start = datetime.combine(date_from, datetime.min.time())
+    end = datetime.combine(date_to + timedelta(days=1), datetime.min.time())
+    if settings.USE_TZ:
+        return (start, end), (timezone.make_aware(start), timezone.make_aware(end))
+    return (start, end), (start, end)
+
+
+def mis_day_checksums(connector, date_from, date_to):
+    """{день: (количество, контрольная сумма)} по визитам МИС, попадающим в выгрузку"""
+    (start, end), _ = _day_bounds(date_from, date_to)
+    query = connector.build_visits_query(
+        MIS_RANGE_CONDITIONS,
+        order_by=None,
+        columns=f'{MIS_DAY_SQL}, count(*), {MIS_CHECKSUM_SQL}',
+        group_by='1',
+    )
+    with connections[connector.using].cursor() as cursor:
+        cursor.execute(query, {'tz': settings.TIME_ZONE, 'start': start, 'end': end})
+        return {day: (count, checksum) for day, count, checksum in cursor.fetchall()}
+
+
+def local_day_checksums(source_id, date_from, date_to, using='default'):
+    """{день: (количество, контрольная сумма)} по визитам источника в import_visit"""
+    _, (start, end) = _day_bounds(date_from, date_to)
+    with connections[using].cursor() as cursor:
+        cursor.execute(LOCAL_DAY_CHECKSUMS_SQL, {
+            'tz': settings.TIME_ZONE, 'source_id': source_id, 'start': start, 'end': end,
+        })
+        return {day: (count, checksum) for day, count, checksum in cursor.fetchall()}
+
+
+def mis_doctor_day_checksums(connector, date_from, date_to):
+    """{(день, doctorid): (количество, контрольная сумма)} по визитам МИС - один агрегирующий запрос"""
+    (start, end), _ = _day_bounds(date_from, date_to)
+    query = connector.build_visits_query(
+        MIS_RANGE_CONDITIONS,
+        order_by=None,
+        columns=f'{MIS_DAY_SQL}, v.doctorid, count(*), {MIS_CHECKSUM_SQL}',
+        group_by='1, 2',
+    )
+    with connections[connector.using].cursor() as cursor:
+        cursor.execute(query, {'tz': settings.TIME_ZONE, 'start': start, 'end': end})
+        return {(day, doctorid): (count, checksum) for day, doctorid, count, checksum in cursor.fetchall()}
+
+
+def local_doctor_day_checksums(source_id, date_from, date_to, using='default'):
+    """{(день, doctorid): (количество, контрольная сумма)} по import_visit - один агрегирующий запрос"""
+    _, (start, end) = _day_bounds(date_from, date_to)
+    with connections[using].cursor() as cursor:
+        cursor.execute(LOCAL_DOCTOR_DAY_CHECKSUMS_SQL, {
+            'tz': settings.TIME_ZONE, 'source_id': source_id, 'start': start, 'end': end,
+        })
+        return {(day, doctorid): (count, checksum) for day, doctorid, count, checksum in cursor.fetchall()}
+
+
+def diff_doctor_day_checksums(mis_checksums, local_checksums):
+    """
+    Расхождения по врачам внутри дней.
+    Возвращает список {'day', 'doctorid', 'mis_count', 'local_count', 'changed'},
+    упорядоченный по дню и врачу; changed - количество совпало, а содержимое нет
+    """
+    diff = []
+    for key in sorted(set(mis_checksums) | set(local_checksums), key=lambda k: (k[0], k[1] or 0)):
+        mis_count, mis_checksum = mis_checksums.get(key, (0, None))
+        local_count, local_checksum = local_checksums.get(key, (0, None))
+        if (mis_count, mis_checksum) != (local_count, local_checksum):
+            diff.append({
+                'day': key[0],
+                'doctorid': key[1],
+                'mis_count': mis_count,
+                'local_count': local_count,
+                'changed': mis_count == local_count,
+            })
+    return diff
+
+
+def reconciliation_report(connector, date_from, date_to):
+    """
+    Отчет сверки за диапазон: по одному агрегирующему запросу к МИС и к нашей БД.
+    Возвращает {'date_from', 'date_to', 'days': [{'day', 'mis_count', 'local_count', 'doctors': [...]}],
+    'mis_total', 'local_total'} - в 'days' только дни с расхождениями
+    """
+    mis_checksums = mis_doctor_day_checksums(connector, date_from, date_to)
+    local_checksums = local_doctor_day_checksums(connector.source_id, date_from, date_to)
+
+    days = {}
+    for row in diff_doctor_day_checksums(mis_checksums, local_checksums):
+        day = days.setdefault(row['day'], {'day': row['day'], 'mis_count': 0, 'local_count': 0, 'doctors': []})
+        day['doctors'].append(row)
+
+    # Итоги дня считаем по всем врачам, а не только по расходящимся
+    for (day, _), (count, _) in mis_checksums.items():
+        if day in days:
+            days[day]['mis_count'] += count
+    for (day, _), (count, _) in local_checksums.items():
+        if day in days:
+            days[day]['local_count'] += count
+
+    return {
+        'date_from': date_from,
+        'date_to': date_to,
+        'days': [days[day] for day in sorted(days)],
+        'mis_total': sum(count for count, _ in mis_checksums.values()),
+        'local_total': sum(count for count, _ in local_checksums.values()),
+    }
+
+
+def reimport_days(connector, days, chunk_size=5000):
+    """
+    Точечная перезагрузка дней: визиты дня выгружаются заново,
+    а исчезнувшие из МИС - удаляются.
+    Возвращает итоги upsert с добавленным 'deleted'
+    """
+    totals = empty_upsert_stats()
+    totals['deleted'] = 0
+    for day in sorted(days):
+        (start, end), _ = _day_bounds(day, day)
+        for batch in connector.iter_visits('v.dat >= %s AND v.dat < %s', (start, end), chunk_size):
+            add_upsert_stats(totals, connector.bulk_save_visits_to_db(batch, batch_size=chunk_size))
+
+        candidates = local_day_keyids(connector.source_id, day) - mis_day_keyids(connector, day)
+        vanished, moved = split_vanished(connector, candidates)
+        add_upsert_stats(totals, refresh_visits(connector, moved, chunk_size))
+        totals['affected'] |= delete_vanished_visits(connector.source_id, vanished)
+        totals['deleted'] += len(vanished)
+        print(f"{day}: перезагружен, удалено визитов {len(vanished)}, перенесено на другой день {len(moved)}")
+    return totals
+
+
+def mismatched_days(mis_checksums, local_checksums):
+    """Дни, в которых количество или контрольная сумма содержимого не совпадают"""
+    days = set(mis_checksums) | set(local_checksums)
+    return sorted(day for day in days if mis_checksums.get(day) != local_checksums.get(day))
+
+
+def mis_day_keyids(connector, day):
+    """ID визитов МИС за день"""
+    (start, end), _ = _day_bounds(day, day)
+    query = connector.build_visits_query(
+        MIS_RANGE_CONDITIONS,
+        order_by=None,
+        columns='v.keyid',
+    )
+    with connections[connector.using].cursor() as cursor:
+        cursor.execute(query, {'start': start, 'end': end})
+        return {row[0] for row in cursor.fetchall()}
+
+
+def mis_existing_keyids(connector, keyids):
+    """Какие из ID визитов есть в МИС (в выгрузке) независимо от даты"""
+    keyids = sorted(keyids)
+    query = connector.build_visits_query('v.keyid = ANY(%s)', order_by=None, columns='v.keyid')
+    existing = set()
+    with connections[connector.using].cursor() as cursor:
+        for start in range(0, len(keyids), KEYID_CHUNK_SIZE):
+            cursor.execute(query, (keyids[start:start + KEYID_CHUNK_SIZE],))
+            existing.update(row[0] for row in cursor.fetchall())
+    return existing
+
+
+def split_vanished(connector, candidates):
+    """
+    Делит визиты, которых нет в МИС за день, на удаленные из МИС
+    и перенесенные на другой день. Возвращает (vanished, moved)
+    """
+    if not candidates:
+        return set(), set()
+    moved = mis_existing_keyids(connector, candidates)
+    return set(candidates) - moved, moved
+
+
+def refresh_visits(connector, keyids, chunk_size=5000):
+    """Перезагружает визиты из МИС по ID (например, после смены даты)"""
+    totals = empty_upsert_stats()
+    keyids = sorted(keyids)
+    for start in range(0, len(keyids), KEYID_CHUNK_SIZE):
+        chunk = keyids[start:start + KEYID_CHUNK_SIZE]
+        for batch in connector.iter_visits('v.keyid = ANY(%s)', (chunk,), chunk_size):
+            add_upsert_stats(totals, connector.bulk_save_visits_to_db(batch, batch_size=chunk_size))
+    return totals
+
+
+def local_day_keyids(source_id, day, using='default'):
+    """ID визитов МИС источника за день в import_visit"""
+    _, (start, end) = _day_bounds(day, day)
+    with connections[using].cursor() as cursor:
+        cursor.execute(LOCAL_DAY_KEYIDS_SQL, {'source_id': source_id, 'start': start, 'end': end})
+        return {row[0] for row in cursor.fetchall()}
+
+
+def delete_vanished_visits(source_id, keyids, using='default'):
+    """
+    Удаляет визиты источника, которых больше нет в МИС.
+    Возвращает множество затронутых троек (source_id, doctorid, 'YYYY-MM')
+    """
+    if not keyids:
+        return set()
+    with transaction.atomic(using=using):
+        with connections[using].cursor() as cursor:
+            cursor.execute(DELETE_VISITS_SQL, {
+                'source_id': source_id, 'keyids': list(keyids), 'tz': settings.TIME_ZONE,
+            })
+            affected = set(cursor.fetchall())
+        mark_dirty(affected, using=using)
+    return affected
+
+
+def reconcile_deletions(connector, date_from, date_to, dry_run=False):
+    """
+    Сверка удалений за диапазон дней.
+    Возвращает итоги: проверено дней, несовпавших дней, удалено визитов,
+    визитов МИС, отсутствующих у нас, и затронутые пары (врач, период).
+    """
+    mis_checksums = mis_day_checksums(connector, date_from, date_to)
+    local_checksums = local_day_checksums(connector.source_id, date_from, date_to)
+    days = mismatched_days(mis_checksums, local_checksums)
+
+    result = {
+        'days_checked': (date_to - date_from).days + 1,
+        'days_mismatched': days,
+        'deleted': 0,
+        'missing_locally': 0,
+        'moved': 0,
+        'affected': set(),
+    }
+
+    for day in days:
+        mis_keyids = mis_day_keyids(connector, day)
+        local_keyids = local_day_keyids(connector.source_id, day)
+        vanished, moved = split_vanished(connector, local_keyids - mis_keyids)
+        missing = mis_keyids - local_keyids
+
+        print(f"{day}: в МИС {len(mis_keyids)}, у нас {len(local_keyids)}, "
+              f"удалено в МИС {len(vanished)}, перенесено на другой день {len(moved)}, "
+              f"не загружено {len(missing)}")
+
+        result['missing_locally'] += len(missing)
+        if not dry_run:
+            result['affected'] |= refresh_visits(connector, moved)['affected']
+            result['affected'] |= delete_vanished_visits(connector.source_id, vanished)
+        result['deleted'] += len(vanished)
+        result['moved'] += len(moved)
+
+    return result
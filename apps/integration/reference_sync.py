@@ -0,0 +1,93 @@
+#apps/integration/reference_sync.py
+
+"""
+Синхронизация справочников МИС с локальными таблицами по изменениям.
+Текущая таблица загружается в словарь по ID из МИС, строки выгрузки
+сравниваются с ним по хешу содержимого, и записываются только
+реальные вставки и изменения через bulk_create / bulk_update.
+"""
+
+import hashlib
+
+
+class ReferenceSync:
+    """Синхронизация одного справочника"""
+
+    def __init__(self, model, key_field, fields, batch_size=1000, scope=None):
+        """
+        :param model: модель локального справочника
+        :param key_field: поле с ID из МИС (уникальное в пределах scope)
+        :param fields: синхронизируемые поля
+        :param scope: постоянные значения полей, ограничивающие синхронизируемую
+                      часть таблицы, например {'source_id': 'mis_clinic1'}
+        """
+        self.model = model
+        self.key_field = key_field
+        self.fields = list(fields)
+        self.batch_size = batch_size
+        self.scope = scope or {}
+
+    def _normalize(self, field_name, value):
+        """Приводит значение к типу поля, чтобы '12' из МИС совпало с 12 в БД"""
+        if value is None:
+            return None
+        return self.model._meta.get_field(field_name).to_python(value)
+
+    def row_hash(self, values):
+        """Хеш содержимого строки (значения в порядке self.fields)"""
+        parts = []
+        for field_name, value in zip(self.fields, values):
+            value = self._normalize(field_name, value)
+            parts.append('\x00' if value is None else str(value))
+        return hashlib.md5('\x1f'.join(parts).encode('utf-8')).hexdigest()
+
+    def load_current(self):
+        """Текущее содержимое таблицы: {ID из МИС: (pk, хеш)}"""
+        current = {}
+        rows = self.model.objects.filter(**self.scope).values_list('pk', self.key_field, *self.fields).iterator(
+            chunk_size=self.batch_size
+        )
+        for pk, key, *values in rows:
+            current[key] = (pk, self.row_hash(values))
+        return current
+
+    def sync(self, rows):
+        """
+        Применяет выгрузку к таблице.
+        rows - словари {key_field: ..., <поле>: ...}
+        Возвращает {'inserted': N, 'updated': N, 'unchanged': N}
+        """
+        # Повторы ID в выгрузке схлопываем: побеждает последняя строка
+        incoming = {}
+        for row in rows:
+            incoming[self._normalize(self.key_field, row[self.key_field])] = row
+
+        current = self.load_current()
+
+        to_create = []
+        to_update = []
+        unchanged = 0
+        for key, row in incoming.items():
+            values = {name: row[name] for name in self.fields}
+            existing = current.get(key)
+
+            if existing is None:
+                to_create.append(self.model(**self.scope, **{self.key_field: key}, **values))
+                continue
+
+            pk, current_hash = existing
+            if self.row_hash([values[name] for name in self.fields]) == current_hash:
+                unchanged += 1
+            else:
+                to_update.append(self.model(pk=pk, **values))
+
+        if to_create:
+            self.model.objects.bulk_create(to_create, batch_size=self.batch_size)
+        if to_update:
+            self.model.objects.bulk_update(to_update, self.fields, batch_size=self.batch_size)
+
+        return {
+            'inserted': len(to_create),
+            'updated': len(to_update),
+            'unchanged': unchanged,
+        }
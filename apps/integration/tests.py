@@ -0,0 +1,574 @@
+#apps\integration\tests.py
+
+"""
+Проверки импорта из МИС на тестовой БД PostgreSQL.
+Таблицы МИС (visit, docdep, man, ...) создаются в схеме solution_med
+тестовой БД, и MISConnector читает их через алиас default -
+отдельная БД МИС для тестов не нужна.
+"""
+
+import tempfile
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+from django.db import connection, connections
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .backfill import build_partitions, run_partition
+from .dump_ingest import (DUMP_LOCK_SQL, DUMP_SCHEMA, DUMP_UNLOCK_SQL, DumpSchemaBusy, discover_dump_files,
+                          drop_schema, dump_schema_lock, load_dump_file, plan_dump_tables, prepare_schema)
+from .mis_connector import MISConnector, get_incremental_window, import_mis_data
+from .models import (BackfillPartition, ImportRun, ImportState, KpiDirtyPair, MisImportedDoctor,
+                     MisImportedSpecialization, MisImportedVisit)
+from .reconciliation import (local_day_checksums, mis_day_checksums, reconcile_deletions,
+                             reconciliation_report, reimport_days)
+from .reference_sync import ReferenceSync
+from .throttle import AdaptiveThrottle
+
+# Минимальная схема МИС: только колонки, которые читают запросы выгрузки
+MIS_TABLES_SQL = """
+    CREATE TABLE solution_med.lu (keyid bigint PRIMARY KEY, tag int, code int, text varchar(255), status int);
+    CREATE TABLE solution_med.dep (keyid bigint PRIMARY KEY, text varchar(256));
+    CREATE TABLE solution_med.man (keyid bigint PRIMARY KEY, text varchar(256));
+    CREATE TABLE solution_med.doctor (keyid bigint PRIMARY KEY, man_id bigint);
+    CREATE TABLE solution_med.docdep (
+        keyid bigint PRIMARY KEY, docid bigint, depid bigint, specid bigint, status int
+    );
+    CREATE TABLE solution_med.visit (
+        keyid bigint PRIMARY KEY, num bigint, casetypeid int, dat timestamp, dat1 timestamp,
+        vistype int, patientid bigint, rootid bigint, doctorid bigint
+    );
+    CREATE TABLE solution_med.diagnos (keyid bigint PRIMARY KEY, code varchar(12), text varchar(512));
+    CREATE TABLE solution_med.patdiag (keyid bigserial PRIMARY KEY, visitid bigint, diagid bigint, diagtype int);
+"""
+
+# Тип случая, который выгружает build_visits_query
+CASE_TYPE = 3746
+
+
+class MisTestCase(TestCase):
+    """
+    Тест с таблицами МИС в тестовой БД.
+    Справочники: специальность 9001, отделение 1, врачи (docdep) 101 и 102
+    с пользователями (man) 11 и 12, диагнозы J45 и Z00.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        with connection.cursor() as cursor:
+            cursor.execute(MIS_TABLES_SQL)
+            cursor.execute("INSERT INTO solution_med.lu VALUES (9001, 9, 27, 'Терапевт', 1)")
+            cursor.execute("INSERT INTO solution_med.dep VALUES (1, 'Терапия')")
+            cursor.execute("INSERT INTO solution_med.man VALUES (11, 'Иванов И.И.'), (12, 'Петров П.П.')")
+            cursor.execute("INSERT INTO solution_med.doctor VALUES (21, 11), (22, 12)")
+            cursor.execute("INSERT INTO solution_med.docdep VALUES (101, 21, 1, 9001, 1), (102, 22, 1, 9001, 1)")
+            cursor.execute("INSERT INTO solution_med.diagnos VALUES (1, 'J45', 'Астма'), (2, 'Z00', 'Осмотр')")
+
+    def setUp(self):
+        self.connector = MISConnector(using='default', source_id='mis')
+
+    def add_visit(self, keyid, dat, doctorid=101, vistype=1, diagid=1, num=None):
+        """Визит МИС с одним основным диагнозом"""
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO solution_med.visit VALUES (%s, %s, %s, %s, NULL, %s, 500, NULL, %s)",
+                [keyid, num or keyid, CASE_TYPE, dat, vistype, doctorid],
+            )
+            cursor.execute(
+                "INSERT INTO solution_med.patdiag (visitid, diagid, diagtype) VALUES (%s, %s, 1)",
+                [keyid, diagid],
+            )
+
+    def update_visit(self, keyid, **values):
+        """Правка визита в МИС задним числом"""
+        assignments = ', '.join(f'{name} = %s' for name in values)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"UPDATE solution_med.visit SET {assignments} WHERE keyid = %s",
+                [*values.values(), keyid],
+            )
+
+    def extract(self, since=datetime(2000, 1, 1)):
+        """Все визиты МИС начиная с since"""
+        return self.connector.extract_visits('v.dat >= %s', (since,))
+
+
+class BulkUpsertTests(MisTestCase):
+    """Пакетное слияние визитов: счетчики по xmax и затронутые пары врач/период"""
+
+    def test_insert_then_unchanged(self):
+        self.add_visit(1, datetime(2025, 1, 10, 9))
+        self.add_visit(2, datetime(2025, 1, 11, 9), doctorid=102)
+
+        stats = self.connector.bulk_save_visits_to_db(self.extract())
+        self.assertEqual((stats['created'], stats['updated'], stats['unchanged']), (2, 0, 0))
+        self.assertEqual(stats['affected'], {('mis', 101, '2025-01'), ('mis', 102, '2025-01')})
+        self.assertEqual(MisImportedVisit.objects.filter(source_id='mis').count(), 2)
+
+        # Повторная выгрузка без изменений ничего не перезаписывает и не отмечает
+        KpiDirtyPair.objects.all().delete()
+        stats = self.connector.bulk_save_visits_to_db(self.extract())
+        self.assertEqual((stats['created'], stats['updated'], stats['unchanged']), (0, 0, 2))
+        self.assertEqual(stats['affected'], set())
+        self.assertFalse(KpiDirtyPair.objects.exists())
+
+    def test_update_marks_old_and_new_pairs(self):
+        self.add_visit(1, datetime(2025, 1, 31, 20))
+        self.connector.bulk_save_visits_to_db(self.extract())
+
+        # Визит перенесен к другому врачу и в другой месяц
+        self.update_visit(1, doctorid=102, dat=datetime(2025, 2, 1, 10))
+        stats = self.connector.bulk_save_visits_to_db(self.extract())
+
+        self.assertEqual((stats['created'], stats['updated'], stats['unchanged']), (0, 1, 0))
+        self.assertEqual(stats['affected'], {('mis', 101, '2025-01'), ('mis', 102, '2025-02')})
+        visit = MisImportedVisit.objects.get(source_id='mis', keyidmis=1)
+        self.assertEqual(visit.doctorid, 102)
+        self.assertEqual(
+            set(KpiDirtyPair.objects.values_list('source_id', 'doctor_id', 'period')),
+            {('mis', 101, '2025-01'), ('mis', 102, '2025-02')},
+        )
+
+    def test_period_in_local_time(self):
+        # 01.02 01:00 по Москве - это 31.01 в UTC, но месяц считается по местному времени
+        self.add_visit(1, datetime(2025, 2, 1, 1))
+        stats = self.connector.bulk_save_visits_to_db(self.extract())
+        self.assertEqual(stats['affected'], {('mis', 101, '2025-02')})
+
+    def test_duplicate_keys_in_batch(self):
+        self.add_visit(1, datetime(2025, 1, 10, 9))
+        rows = self.extract()
+        stats = self.connector.bulk_save_visits_to_db(rows + rows, batch_size=10)
+        self.assertEqual((stats['created'], stats['updated'], stats['unchanged']), (1, 0, 0))
+
+
+class StreamingExtractTests(MisTestCase):
+    """Потоковая выгрузка серверным курсором"""
+
+    def test_batches_match_full_extract(self):
+        for keyid in range(1, 6):
+            self.add_visit(keyid, datetime(2025, 1, keyid, 9))
+
+        batches = list(self.connector.iter_visits('v.dat >= %s', (datetime(2000, 1, 1),), chunk_size=2))
+
+        self.assertEqual([len(batch) for batch in batches], [2, 2, 1])
+        self.assertEqual(
+            sorted(row for batch in batches for row in batch),
+            sorted(self.extract()),
+        )
+
+    def test_one_row_per_visit_with_several_diagnoses(self):
+        self.add_visit(1, datetime(2025, 1, 10, 9))
+        with connection.cursor() as cursor:
+            cursor.execute("INSERT INTO solution_med.patdiag (visitid, diagid, diagtype) VALUES (1, 2, 1)")
+
+        rows = [row for batch in self.connector.iter_visits('v.keyid = %s', (1,)) for row in batch]
+
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0][12], 'J45')  # первый основной диагноз по patdiag.keyid
+        self.assertEqual(self.connector.duplicates_eliminated, 1)
+
+
+class WatermarkImportTests(MisTestCase):
+    """
+    Инкрементальный импорт по отметке (dat, keyid).
+    Источник - алиас default, поэтому строки и отметка помечаются 'default'
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.now = datetime.now().replace(microsecond=0)
+        self.add_visit(1, self.now - timedelta(hours=5))
+        self.add_visit(2, self.now - timedelta(hours=3))
+
+    def import_visits(self, **options):
+        return import_mis_data(days_back=1, incremental=True, source='default', **options)
+
+    def test_first_run_sets_mark(self):
+        self.assertIsNone(get_incremental_window('default'))
+
+        self.assertEqual(self.import_visits(), 2)
+
+        state = ImportState.objects.get(source='default')
+        self.assertEqual(timezone.make_naive(state.last_dat), self.now - timedelta(hours=3))
+        self.assertEqual(state.last_keyid, 2)
+        self.assertEqual(ImportRun.objects.get().status, ImportRun.STATUS_SUCCESS)
+
+    def test_overlap_picks_up_late_edits(self):
+        self.import_visits()
+        # Новый визит после отметки и правка старого визита внутри перекрытия
+        self.add_visit(3, self.now - timedelta(hours=1))
+        self.update_visit(1, vistype=2)
+
+        self.assertEqual(self.import_visits(overlap_hours=24), 1)
+
+        run = ImportRun.objects.first()
+        self.assertEqual((run.rows_inserted, run.rows_updated, run.rows_skipped), (1, 1, 1))
+        self.assertEqual(MisImportedVisit.objects.get(source_id='default', keyidmis=1).vistype, 2)
+        self.assertEqual(ImportState.objects.get(source='default').last_keyid, 3)
+
+    def test_without_overlap_only_after_mark(self):
+        self.import_visits()
+        # Визит с той же датой, что и отметка, но большим keyid - после отметки
+        self.add_visit(3, self.now - timedelta(hours=3))
+        self.update_visit(1, vistype=2)
+
+        conditions, params = get_incremental_window('default', overlap_hours=0)
+        self.assertEqual(
+            [row[0] for row in self.connector.extract_visits(conditions, params)], [3]
+        )
+
+        self.import_visits(overlap_hours=0)
+        self.assertEqual(MisImportedVisit.objects.get(source_id='default', keyidmis=1).vistype, 1)
+        self.assertEqual(ImportState.objects.get(source='default').last_keyid, 3)
+
+    def test_empty_window_keeps_mark(self):
+        self.import_visits()
+        state = ImportState.objects.get(source='default')
+
+        self.assertEqual(self.import_visits(overlap_hours=0), 0)
+
+        self.assertEqual(ImportState.objects.get(source='default').last_dat, state.last_dat)
+        self.assertEqual(ImportRun.objects.first().rows_extracted, 0)
+
+
+class BackfillPartitionTests(MisTestCase):
+    """Историческая догрузка: партиции покрывают диапазон без пропусков и повторов"""
+
+    def test_partitions_cover_range(self):
+        self.assertEqual(
+            build_partitions(date(2025, 1, 1), date(2025, 1, 10), 'week'),
+            [(date(2025, 1, 1), date(2025, 1, 8)), (date(2025, 1, 8), date(2025, 1, 11))],
+        )
+        self.assertEqual(len(build_partitions(date(2025, 1, 1), date(2025, 1, 31))), 31)
+
+    def test_partition_bounds(self):
+        # Начало партиции включительно, конец - нет
+        self.add_visit(1, datetime(2025, 1, 1, 0, 0))
+        self.add_visit(2, datetime(2025, 1, 1, 23, 59))
+        self.add_visit(3, datetime(2025, 1, 2, 0, 0))
+        self.add_visit(4, datetime(2024, 12, 31, 23, 59))
+
+        partitions = [
+            BackfillPartition.objects.create(source='default', date_from=start, date_to=end)
+            for start, end in build_partitions(date(2025, 1, 1), date(2025, 1, 2))
+        ]
+        results = [run_partition(partition.pk, chunk_size=1) for partition in partitions]
+
+        self.assertEqual([result['rows'] for result in results], [2, 1])
+        self.assertEqual([result['created'] for result in results], [2, 1])
+        self.assertEqual(
+            sorted(MisImportedVisit.objects.filter(source_id='default').values_list('keyidmis', flat=True)),
+            [1, 2, 3],
+        )
+        for partition in BackfillPartition.objects.all():
+            self.assertEqual((partition.status, partition.attempts), (BackfillPartition.STATUS_DONE, 1))
+
+    def test_rerun_is_idempotent(self):
+        self.add_visit(1, datetime(2025, 1, 1, 10))
+        partition = BackfillPartition.objects.create(
+            source='default', date_from=date(2025, 1, 1), date_to=date(2025, 1, 2)
+        )
+
+        run_partition(partition.pk)
+        result = run_partition(partition.pk)
+
+        self.assertEqual((result['rows'], result['created'], result['updated']), (1, 0, 0))
+        self.assertEqual(MisImportedVisit.objects.filter(source_id='default').count(), 1)
+
+
+class ReferenceSyncTests(MisTestCase):
+    """Синхронизация справочников: пишутся только новые и измененные строки"""
+
+    def test_specializations(self):
+        stats = self.connector.save_specializations_to_db(self.connector.extract_specializations())
+        self.assertEqual(stats, {'inserted': 1, 'updated': 0, 'unchanged': 0})
+
+        with connection.cursor() as cursor:
+            cursor.execute("INSERT INTO solution_med.lu VALUES (9002, 9, 76, 'Хирург', 1)")
+            cursor.execute("UPDATE solution_med.lu SET text = 'Терапевт участковый' WHERE keyid = 9001")
+        stats = self.connector.save_specializations_to_db(self.connector.extract_specializations())
+
+        self.assertEqual(stats, {'inserted': 1, 'updated': 1, 'unchanged': 0})
+        self.assertEqual(
+            dict(MisImportedSpecialization.objects.values_list('keyidmis', 'text')),
+            {9001: 'Терапевт участковый', 9002: 'Хирург'},
+        )
+
+    def test_types_normalized_before_compare(self):
+        sync = ReferenceSync(MisImportedSpecialization, 'keyidmis', ['tag', 'code', 'text'])
+        sync.sync([{'keyidmis': 9001, 'tag': 9, 'code': 27, 'text': 'Терапевт'}])
+
+        # Те же значения строками - не изменение
+        stats = sync.sync([{'keyidmis': '9001', 'tag': '9', 'code': '27', 'text': 'Терапевт'}])
+        self.assertEqual(stats, {'inserted': 0, 'updated': 0, 'unchanged': 1})
+
+    def test_doctors_scoped_by_source(self):
+        doctors = self.connector.extract_doctors()
+        other = MISConnector(using='default', source_id='mis_clinic1')
+        other.save_doctors_to_db(doctors)
+
+        stats = self.connector.save_doctors_to_db(doctors)
+        self.assertEqual(stats, {'inserted': 2, 'updated': 0, 'unchanged': 0})
+
+        # Изменение у одного источника не трогает строки с теми же ID другого
+        with connection.cursor() as cursor:
+            cursor.execute("UPDATE solution_med.man SET text = 'Иванов И.П.' WHERE keyid = 11")
+        stats = self.connector.save_doctors_to_db(self.connector.extract_doctors())
+
+        self.assertEqual(stats, {'inserted': 0, 'updated': 1, 'unchanged': 1})
+        self.assertEqual(
+            dict(MisImportedDoctor.objects.filter(keyiddocdep=101).values_list('source_id', 'docnamemis')),
+            {'mis': 'Иванов И.П.', 'mis_clinic1': 'Иванов И.И.'},
+        )
+
+
+class KeysetExtractTests(MisTestCase):
+    """Щадящая выгрузка короткими запросами по v.keyid"""
+
+    def setUp(self):
+        super().setUp()
+        # Старые визиты с малыми keyid вне окна и визиты окна
+        for keyid in (1, 2, 3):
+            self.add_visit(keyid, datetime(2024, 1, keyid, 9))
+        for keyid in range(1000, 1005):
+            self.add_visit(keyid, datetime(2025, 1, 10, 9))
+        # Пакеты по 2 строки без пауз
+        self.throttle = AdaptiveThrottle(target_latency=60, batch_size=2, min_batch_size=2, max_batch_size=2)
+
+    def test_cursor_starts_at_window(self):
+        window = ('v.dat >= %s', (datetime(2025, 1, 1),))
+        self.assertEqual(self.connector.first_visit_keyid(*window), 1000)
+
+        with CaptureQueriesContext(connection) as queries:
+            batches = list(self.connector.iter_visits_keyset(*window, throttle=self.throttle))
+
+        self.assertEqual([[row[0] for row in batch] for batch in batches], [[1000, 1001], [1002, 1003], [1004]])
+        # Начало окна и по запросу на пакет
+        self.assertEqual(len(queries), 4)
+
+    def test_empty_window(self):
+        with CaptureQueriesContext(connection) as queries:
+            batches = list(self.connector.iter_visits_keyset(
+                'v.dat >= %s', (datetime(2026, 1, 1),), throttle=self.throttle
+            ))
+
+        self.assertEqual(batches, [])
+        self.assertEqual(len(queries), 1)
+
+
+class RowHashTests(MisTestCase):
+    """Хеш содержимого визита: перезаписываются только измененные визиты"""
+
+    def stored_hash(self, keyid):
+        return MisImportedVisit.objects.get(source_id='mis', keyidmis=keyid).row_hash
+
+    def test_late_edit_of_joined_columns(self):
+        self.add_visit(1, datetime(2025, 1, 10, 9))
+        self.add_visit(2, datetime(2025, 1, 10, 10))
+        self.connector.bulk_save_visits_to_db(self.extract())
+        first_hash = self.stored_hash(1)
+        self.assertEqual(len(first_hash), 32)
+
+        # Диагноз визита 1 исправлен задним числом - сам visit не менялся
+        with connection.cursor() as cursor:
+            cursor.execute("UPDATE solution_med.patdiag SET diagid = 2 WHERE visitid = 1")
+        stats = self.connector.bulk_save_visits_to_db(self.extract())
+
+        self.assertEqual((stats['created'], stats['updated'], stats['unchanged']), (0, 1, 1))
+        self.assertEqual(MisImportedVisit.objects.get(source_id='mis', keyidmis=1).diag_code, 'Z00')
+        self.assertNotEqual(self.stored_hash(1), first_hash)
+
+    def test_row_saved_without_hash_is_rewritten(self):
+        self.add_visit(1, datetime(2025, 1, 10, 9))
+        self.connector.save_visits_to_db(self.extract())
+        self.assertIsNone(self.stored_hash(1))
+
+        # Построчная запись не считает хеш - следующая пакетная загрузка его проставит
+        stats = self.connector.bulk_save_visits_to_db(self.extract())
+        self.assertEqual((stats['updated'], stats['unchanged']), (1, 0))
+        self.assertIsNotNone(self.stored_hash(1))
+
+
+class DeletionSyncTests(MisTestCase):
+    """Удаленные в МИС визиты удаляются, перенесенные на другой день - перезагружаются"""
+
+    def setUp(self):
+        super().setUp()
+        self.add_visit(1, datetime(2025, 1, 10, 9))
+        self.add_visit(2, datetime(2025, 1, 10, 10))
+        self.add_visit(3, datetime(2025, 1, 10, 11), doctorid=102)
+        self.connector.bulk_save_visits_to_db(self.extract())
+        KpiDirtyPair.objects.all().delete()
+
+        # Визит 1 удален в МИС, визит 3 перенесен на февраль
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM solution_med.visit WHERE keyid = 1")
+        self.update_visit(3, dat=datetime(2025, 2, 3, 11))
+
+    def local_visits(self):
+        return dict(MisImportedVisit.objects.filter(source_id='mis').values_list('keyidmis', 'dat__month'))
+
+    def test_deleted_and_moved(self):
+        result = reconcile_deletions(self.connector, date(2025, 1, 1), date(2025, 1, 31))
+
+        self.assertEqual(result['days_mismatched'], [date(2025, 1, 10)])
+        self.assertEqual((result['deleted'], result['moved'], result['missing_locally']), (1, 1, 0))
+        self.assertEqual(self.local_visits(), {2: 1, 3: 2})
+        self.assertEqual(
+            result['affected'],
+            {('mis', 101, '2025-01'), ('mis', 102, '2025-01'), ('mis', 102, '2025-02')},
+        )
+        self.assertEqual(
+            set(KpiDirtyPair.objects.values_list('source_id', 'doctor_id', 'period')), result['affected']
+        )
+
+    def test_dry_run(self):
+        result = reconcile_deletions(self.connector, date(2025, 1, 1), date(2025, 1, 31), dry_run=True)
+
+        self.assertEqual((result['deleted'], result['moved']), (1, 1))
+        self.assertEqual(self.local_visits(), {1: 1, 2: 1, 3: 1})
+        self.assertFalse(KpiDirtyPair.objects.exists())
+
+    def test_reimport_day(self):
+        totals = reimport_days(self.connector, [date(2025, 1, 10)])
+
+        self.assertEqual((totals['deleted'], totals['updated']), (1, 1))
+        self.assertEqual(self.local_visits(), {2: 1, 3: 2})
+
+
+class ReconciliationTests(MisTestCase):
+    """Сверка с МИС по дням и врачам: количество и контрольная сумма содержимого"""
+
+    def setUp(self):
+        super().setUp()
+        self.add_visit(1, datetime(2025, 1, 10, 9), num=0)
+        self.add_visit(2, datetime(2025, 1, 10, 23, 59, 59, 500000), doctorid=102)
+        self.add_visit(3, datetime(2025, 1, 11, 0, 0))
+        self.update_visit(3, dat1=datetime(2025, 1, 11, 0, 30))
+        self.connector.bulk_save_visits_to_db(self.extract())
+        self.day = date(2025, 1, 10)
+
+    def report(self):
+        return reconciliation_report(self.connector, date(2025, 1, 1), date(2025, 1, 31))
+
+    def test_loaded_visits_match(self):
+        # Контрольная сумма МИС воспроизводит хеш загруженных строк
+        report = self.report()
+        self.assertEqual((report['mis_total'], report['local_total']), (3, 3))
+        self.assertEqual(report['days'], [])
+
+    def test_same_day_on_both_sides(self):
+        mis = mis_day_checksums(self.connector, date(2025, 1, 10), date(2025, 1, 11))
+        local = local_day_checksums('mis', date(2025, 1, 10), date(2025, 1, 11))
+        self.assertEqual({day: count for day, (count, _) in mis.items()}, {self.day: 2, date(2025, 1, 11): 1})
+        self.assertEqual(mis, local)
+
+    def test_edited_content_with_same_count(self):
+        self.update_visit(2, vistype=2)
+
+        report = self.report()
+
+        self.assertEqual([day['day'] for day in report['days']], [self.day])
+        self.assertEqual(
+            report['days'][0]['doctors'],
+            [{'day': self.day, 'doctorid': 102, 'mis_count': 1, 'local_count': 1, 'changed': True}],
+        )
+
+    def test_missing_visit(self):
+        self.add_visit(4, datetime(2025, 1, 10, 12))
+
+        day = self.report()['days'][0]
+
+        self.assertEqual((day['day'], day['mis_count'], day['local_count']), (self.day, 3, 2))
+        self.assertEqual(
+            [(row['doctorid'], row['changed']) for row in day['doctors']], [(101, False)]
+        )
+
+
+class ReconcileAdminTests(TestCase):
+    """Страница сверки запускает запросы к МИС только для тех, кому доступны визиты"""
+
+    def setUp(self):
+        from users.models import Role, User
+        admin_role = Role.objects.create(text='Администратор')
+        self.staff = User.objects.create_user('staff', 'x', role=admin_role)
+        self.superuser = User.objects.create_superuser('root', 'x')
+        self.url = reverse('admin:integration_misimportedvisit_reconcile')
+
+    def test_staff_without_view_permission(self):
+        self.client.force_login(self.staff)
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+    def test_superuser(self):
+        self.client.force_login(self.superuser)
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+
+
+class DumpIngestTests(TransactionTestCase):
+    """
+    Загрузка выгрузки МИС, разбитой на файлы.
+    TransactionTestCase: load_dump_file закрывает соединение после COPY
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.addCleanup(drop_schema)
+
+    def write(self, name, text):
+        Path(self.directory.name, name).write_text(text, encoding='utf-8')
+
+    def test_split_files_append_into_one_table(self):
+        self.write('visit_1.csv', 'keyid,dat,doctorid\n1,2025-01-10 09:00,101\n2,2025-01-10 10:00,101\n')
+        self.write('visit_2.csv', 'doctorid,keyid,dat\n102,3,2025-01-11 09:00\n')
+        self.write('man.sql', 'COPY solution_med.man (keyid, text) FROM stdin;\n11\tИванов\n\\.\n')
+
+        files = discover_dump_files(self.directory.name)
+        tables = plan_dump_tables(files)
+        self.assertEqual({table: len(plan['files']) for table, plan in tables.items()}, {'visit': 2, 'man': 1})
+
+        with dump_schema_lock():
+            prepare_schema(tables)
+            results = [load_dump_file(path, fmt) for path, fmt in files]
+
+        self.assertEqual(
+            sorted((result['table'], result['file_rows'], result['loaded_rows']) for result in results),
+            [('man', 1, 1), ('visit', 1, 1), ('visit', 2, 2)],
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT keyid, doctorid FROM {DUMP_SCHEMA}.visit ORDER BY keyid")
+            self.assertEqual(cursor.fetchall(), [(1, 101), (2, 101), (3, 102)])
+
+    def test_parts_with_different_columns(self):
+        self.write('visit_1.csv', 'keyid,dat\n1,2025-01-10 09:00\n')
+        self.write('visit_2.csv', 'keyid,doctorid\n2,101\n')
+
+        with self.assertRaises(ValueError):
+            plan_dump_tables(discover_dump_files(self.directory.name))
+
+    def test_schema_lock(self):
+        # Второе соединение - как у параллельного запуска команды
+        other = connections.create_connection('default')
+        self.addCleanup(other.close)
+
+        def other_acquires():
+            with other.cursor() as cursor:
+                cursor.execute(DUMP_LOCK_SQL, [DUMP_SCHEMA])
+                acquired = cursor.fetchone()[0]
+                if acquired:
+                    cursor.execute(DUMP_UNLOCK_SQL, [DUMP_SCHEMA])
+            return acquired
+
+        with dump_schema_lock():
+            self.assertFalse(other_acquires())
+        self.assertTrue(other_acquires())
+
+        with other.cursor() as cursor:
+            cursor.execute(DUMP_LOCK_SQL, [DUMP_SCHEMA])
+        with self.assertRaises(DumpSchemaBusy):
+            with dump_schema_lock():
+                pass
@@ -0,0 +1,45 @@
+#apps/integration/throttle.py
+
+"""
+Адаптивное ограничение нагрузки на рабочую БД МИС.
+По времени ответа на каждый пакет подбираются пауза между
+пакетами и размер следующего пакета.
+"""
+
+import time
+
+
+class AdaptiveThrottle:
+    """Регулятор темпа выгрузки по задержке ответа МИС"""
+
+    def __init__(self, target_latency=0.5, batch_size=2000,
+                 min_batch_size=200, max_batch_size=10000, max_pause=10.0):
+        """
+        :param target_latency: целевое время ответа МИС на пакет, секунд
+        :param batch_size: начальный размер пакета
+        :param max_pause: максимальная пауза между пакетами, секунд
+        """
+        self.target_latency = target_latency
+        self.batch_size = batch_size
+        self.min_batch_size = min_batch_size
+        self.max_batch_size = max_batch_size
+        self.max_pause = max_pause
+        self.pause = 0.0
+        self.total_pause = 0.0
+
+    def observe(self, latency):
+        """Учитывает время ответа на очередной пакет"""
+        if latency > self.target_latency:
+            # МИС отвечает медленнее цели - уменьшаем пакет и увеличиваем паузу
+            self.batch_size = max(self.min_batch_size, self.batch_size // 2)
+            self.pause = min(self.max_pause, max(self.pause * 2, latency))
+        else:
+            # Запас есть - постепенно возвращаем темп
+            self.batch_size = min(self.max_batch_size, int(self.batch_size * 1.25))
+            self.pause = self.pause / 2 if self.pause > 0.05 else 0.0
+
+    def wait(self):
+        """Пауза перед следующим пакетом"""
+        if self.pause:
+            time.sleep(self.pause)
+            self.total_pause += self.pause
@@ -1,7 +1,7 @@
 #apps\kpi_calc\admin.py
 
 from django.contrib import admin
-from .models import KpiResult
+from .models import KpiResult, KpiCumulative, KpiQualityResult
 
 @admin.register(KpiResult)
 class KpiResultAdmin(admin.ModelAdmin):
@@ -22,4 +22,50 @@ class KpiResultAdmin(admin.ModelAdmin):
                     'doctor__docnamemis',
                     'specialization__text',
                     'plan_type__text', 
-    ]
\ No newline at end of file
+    ]
+
+@admin.register(KpiQualityResult)
+class KpiQualityResultAdmin(admin.ModelAdmin):
+    list_display = ['calculation_date',
+                    'doctor',
+                    'specialization',
+                    'validation_percentage',
+                    'disease_percentage',
+                    'period']
+    list_filter = ['calculation_date',
+                   'source_id',
+                   'specialization',
+                   'period']
+    search_fields = [
+                    'doctor__docnamemis',
+                    'specialization__text',
+    ]
+
+@admin.register(KpiCumulative)
+class KpiCumulativeAdmin(admin.ModelAdmin):
+    """Нарастающий итог ведет расчет KPI - в админке только просмотр"""
+    list_display = ['year',
+                    'month',
+                    'doctor',
+                    'specialization',
+                    'plan_type',
+                    'plan_cumulative',
+                    'fact_cumulative',
+                    'percentage_cumulative',
+                    'calculated_at']
+    list_filter = ['year',
+                   'month',
+                   'source_id',
+                   'specialization',
+                   'plan_type']
+    search_fields = [
+                    'doctor__docnamemis',
+                    'specialization__text',
+                    'plan_type__text',
+    ]
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
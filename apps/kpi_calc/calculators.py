@@ -1,22 +1,46 @@
 #apps\kpi_calc\calculators.py
 
-from django.db import transaction
-from django.db.models import Count, Q, F
+from django.db import connections, transaction
+from django.db.models import Count, Q, F, Max
+from django.db.models.functions import Substr, Upper
 from django.utils import timezone
 from datetime import datetime
+from decimal import Decimal
 import re
+import time
+import numpy as np
 
+from integration.dirty_pairs import doctors_condition, pending_pairs, clear_pairs
 from integration.models import MisImportedVisit, VisitAggregate, MisImportedPurpose, MisImportedDoctor, MisImportedSpecialization, MisImportedPurpose
 from references.models import Specialization, PlanType
 from plans.models import KpiPlan
-from .models import KpiResult
+from .models import KpiResult, KpiQualityResult
+from .matrix import KpiMatrix
+from .cumulative import update_cumulative
+from .icd10 import chapter_index, block_index
 
 class KPICalculator:
     """Основной класс для расчета всех KPI показателей."""
     
-    def __init__(self, period=None):
+    # Поля, перезаписываемые при повторном расчете (bulk_create с update_conflicts)
+    AGGREGATE_UPDATE_FIELDS = [
+        'doctor_name', 'specialization', 'department_id', 'department_name',
+        'total_visits', 'visits_by_purpose', 'visits_by_chapter', 'visits_by_block', 'validated_docs_count',
+        'total_docs_count', 'visits_with_z_diagnosis', 'calculated_at',
+    ]
+    RESULT_UPDATE_FIELDS = ['calculation_date', 'actual_value', 'plan_value', 'percentage']
+    QUALITY_UPDATE_FIELDS = [
+        'calculation_date', 'doctor', 'specialization', 'validated_docs_count',
+        'total_docs_count', 'validation_percentage', 'total_visits',
+        'visits_with_z_diagnosis', 'disease_percentage',
+    ]
+    
+    def __init__(self, period=None, batch_size=1000, doctors=None, cumulative=True):
         """
         :param period: Период в формате 'YYYY-MM'. Если None, берется предыдущий месяц.
+        :param batch_size: Сколько строк VisitAggregate / KpiResult записывать одним запросом.
+        :param doctors: Пересчитать только этих врачей - множество пар (source_id, doctor_id).
+        :param cumulative: Обновить нарастающий итог года (KpiCumulative) после записи.
         """
         if period is None:
             now = timezone.now()
@@ -24,7 +48,16 @@ class KPICalculator:
         else:
             self.period = period
         
-        self.year = int(self.period.split('-')[0])
+        self.year, self.month = map(int, self.period.split('-'))
+        self.batch_size = batch_size
+        self.doctors_filter = doctors
+        self.cumulative = cumulative
+        
+        # Справочники в памяти (см. load_references)
+        self.doctors = None
+        self.specializations = None
+        self.purposes = None
+        self.plans = None
     
     def calculate_percentage(self, actual, plan):
         """P = Fakt/Plan * 100%"""
@@ -49,74 +82,151 @@ class KPICalculator:
         return diag_code.upper().startswith('Z')
     
     def aggregate_visits_data(self):
-        """Агрегирует сырые данные из MisImportedVisit за период."""
+        """
+        Агрегирует сырые данные из MisImportedVisit за период.
+        Считается на стороне БД одним запросом с группировкой
+        по врачу, цели визита (vistype) и рубрике диагноза и условными агрегатами.
+        Рубрики раскладываются по классам и блокам МКБ-10 разом для всех строк (см. icd10).
+        """
         print(f"Агрегация данных за период: {self.period}")
         
         # Фильтруем визиты за нужный период
         year, month = map(int, self.period.split('-'))
-        visits = MisImportedVisit.objects.filter(
-            dat__year=year,
-            dat__month=month
-        )
+        # Критерий валидации: визит завершен (casetypeid = 3746) и есть диагноз
+        validated = Q(casetypeid=3746) & Q(diag_code__isnull=False) & ~Q(diag_code='')
+        # Z-диагнозы (Z00-Z99 по МКБ-10) - та же проверка префикса, что и в is_z_diagnosis
+        z_diagnosis = Q(diag_code__istartswith='Z')
         
-        print(f"Найдено {visits.count()} визитов для агрегации.")
+        visits = MisImportedVisit.objects.filter(dat__year=year, dat__month=month)
+        if self.doctors_filter is not None:
+            visits = visits.filter(doctors_condition(self.doctors_filter, 'doctorid'))
         
-        # Группируем по врачам и агрегируем данные
+        rows = (
+            visits
+            .values('source_id', 'doctorid', 'vistype', category=Upper(Substr('diag_code', 1, 3)))
+            .annotate(
+                visits=Count('keyid'),
+                validated=Count('keyid', filter=validated),
+                z_visits=Count('keyid', filter=z_diagnosis),
+                doctor_name=Max('doctorname'),
+                department_id=Max('depid'),
+                department_name=Max('depname'),
+            )
+            .order_by()
+        )
+        
+        # Группируем по врачам: ID врача уникален только в пределах своей МИС
         doctors_data = {}
+        total_visits = 0
+        # Строки (врач, рубрика, визиты) для классификации по МКБ-10
+        doctor_rows, categories, category_visits = [], [], []
+        doctor_numbers = {}
         
-        for visit in visits:
-            doctor_key = visit.doctorid
+        for row in rows:
+            doctor_key = (row['source_id'], row['doctorid'])
             
             if doctor_key not in doctors_data:
                 doctors_data[doctor_key] = {
-                    'doctor_id': visit.doctorid,
-                    'doctor_name': visit.doctorname,
-                    'department_id': visit.depid,
-                    'department_name': visit.depname,
+                    'source_id': row['source_id'],
+                    'doctor_id': row['doctorid'],
+                    'doctor_name': row['doctor_name'],
+                    'department_id': row['department_id'],
+                    'department_name': row['department_name'],
                     'total_visits': 0,
                     'visits_by_purpose': {},
+                    'visits_by_chapter': {},
+                    'visits_by_block': {},
                     'validated_docs_count': 0,
                     'total_docs_count': 0,
                     'visits_with_z_diagnosis': 0,
                 }
             
             data = doctors_data[doctor_key]
-            data['total_visits'] += 1
-            
-            # Считаем визиты по цели (vistype)
-            purpose_code = visit.vistype
-            data['visits_by_purpose'][purpose_code] = data['visits_by_purpose'].get(purpose_code, 0) + 1
-            
-            # Считаем документы (упрощенно: считаем, что каждый визит = 1 документ)
-            data['total_docs_count'] += 1
-            # Критерий валидации: если визит завершен (casetypeid = 3746) и есть диагноз
-            if visit.casetypeid == 3746 and visit.diag_code:
-                data['validated_docs_count'] += 1
-            
-            # Считаем визиты с Z-диагнозами
-            if self.is_z_diagnosis(visit.diag_code):
-                data['visits_with_z_diagnosis'] += 1
+            data['total_visits'] += row['visits']
+            # Визиты по цели (vistype) - сумма по рубрикам диагноза
+            purpose_visits = data['visits_by_purpose']
+            purpose_visits[row['vistype']] = purpose_visits.get(row['vistype'], 0) + row['visits']
+            doctor_rows.append(doctor_numbers.setdefault(doctor_key, len(doctor_numbers)))
+            categories.append(row['category'])
+            category_visits.append(row['visits'])
+            # Документы (упрощенно: каждый визит = 1 документ)
+            data['total_docs_count'] += row['visits']
+            data['validated_docs_count'] += row['validated']
+            data['visits_with_z_diagnosis'] += row['z_visits']
+            total_visits += row['visits']
+        
+        # Визиты по классам и блокам МКБ-10 - по одному векторному проходу по всем строкам
+        for field, index in (('visits_by_chapter', chapter_index()), ('visits_by_block', block_index())):
+            totals = index.count_by_group(doctor_rows, categories, category_visits, len(doctor_numbers))
+            for doctor_key, counts in zip(doctor_numbers, index.as_dicts(totals)):
+                doctors_data[doctor_key][field] = counts
+        
+        print(f"Найдено {total_visits} визитов для агрегации.")
 
         for doctor_key, data in list(doctors_data.items())[:3]:  # первые 3 врача
             print(f"📊 Врач {data['doctor_name']}:")
         
         return doctors_data
     
-    def get_specialization_for_doctor(self, doctor_id, department_id):
+    def load_references(self, doctors_data=None):
+        """
+        Загружает врачей, специальности, цели визитов и годовые планы
+        в словари один раз за расчет - число запросов не зависит от числа врачей.
+        doctors_data - результат aggregate_visits_data (ограничивает выборку врачей)
+        """
+        doctors = MisImportedDoctor.objects.all()
+        if doctors_data is not None:
+            doctors = doctors.filter(keyiddocdep__in={data['doctor_id'] for data in doctors_data.values()})
+        
+        # Если в справочнике несколько строк врача, как и раньше берется первая
+        self.doctors = {}
+        for doctor in doctors.order_by('keyid'):
+            self.doctors.setdefault((doctor.source_id, doctor.keyiddocdep), doctor)
+        
+        self.specializations = {}
+        self.specializations_by_text = {}
+        for specialization in MisImportedSpecialization.objects.order_by('keyid'):
+            self.specializations.setdefault(specialization.keyidmis, specialization)
+            self.specializations_by_text.setdefault(specialization.text.strip().lower(), specialization)
+        
+        self.purposes = list(MisImportedPurpose.objects.all())
+        
+        self.plans = {
+            (plan.specid, plan.plan_vistype): plan
+            for plan in KpiPlan.objects.filter(year=self.year)
+        }
+        
+        print(f"Загружено: врачей {len(self.doctors)}, специальностей {len(self.specializations)}, "
+              f"целей {len(self.purposes)}, планов {len(self.plans)}")
+    
+    def get_doctor(self, doctor_id, source_id='mis'):
+        """Врач из справочника по ID docdep в МИС источника"""
+        if self.doctors is None:
+            self.load_references()
+        return self.doctors.get((source_id, doctor_id))
+    
+    def get_specialization_for_doctor(self, doctor_id, department_id, source_id='mis'):
         """Определяет специальность врача на основе реальных данных МИС."""
 
         try:
             # Ищем врача в импортированных данных
-            doctor = MisImportedDoctor.objects.filter(keyiddocdep=doctor_id).first()
+            doctor = self.get_doctor(doctor_id, source_id)
             
             if doctor:
                 print(f"  Найден врач: {doctor.docnamemis}, специальность МИС: {doctor.specnamemis}")
                 
                 # Пытаемся найти соответствующую специальность в справочнике
                 # specidmis - это ID специальности из таблицы lu в МИС
-                mis_specialization = MisImportedSpecialization.objects.filter(
-                    keyidmis=doctor.specidmis
-                ).first()
+                mis_specialization = self.specializations.get(doctor.specidmis)
+                
+                # Справочник общий для всех МИС, а ID специальности свой в каждой:
+                # если название не совпало, ищем специальность по названию
+                if mis_specialization and mis_specialization.text.strip().lower() != doctor.specnamemis.strip().lower():
+                    by_text = self.specializations_by_text.get(doctor.specnamemis.strip().lower())
+                    print(f"  ⚠️ [{source_id}] Специальность ID {doctor.specidmis} '{doctor.specnamemis}' "
+                          f"в справочнике называется '{mis_specialization.text}'"
+                          + (f", взята по названию: ID {by_text.keyidmis}" if by_text else ""))
+                    mis_specialization = by_text or mis_specialization
                 
                 if mis_specialization:
                     print(f"  Найдена специальность: {mis_specialization.text}")
@@ -130,20 +240,100 @@ class KPICalculator:
             print(f"  ❌ Ошибка при определении специальности для врача {doctor_id}: {e}")
             return None
     
-    @transaction.atomic
-    def calculate_all_kpi(self):
-        """Основной метод: агрегирует данные и рассчитывает все KPI."""
-        print(f"Запуск расчета KPI за {self.period}...")
+    def _bulk_upsert(self, model, objects, unique_fields, update_fields):
+        """
+        Записывает объекты пакетами INSERT ... ON CONFLICT DO UPDATE.
+        Каждый пакет - своя короткая транзакция, блокировки не держатся весь расчет.
+        """
+        for start in range(0, len(objects), self.batch_size):
+            with transaction.atomic():
+                model.objects.bulk_create(
+                    objects[start:start + self.batch_size],
+                    update_conflicts=True,
+                    unique_fields=unique_fields,
+                    update_fields=update_fields,
+                )
+    
+    def save_results(self, aggregates, kpi_results, quality_results=()):
+        """Пакетная запись агрегатов визитов, результатов KPI и показателей качества"""
+        self._bulk_upsert(
+            VisitAggregate, aggregates,
+            unique_fields=['source_id', 'doctor_id', 'period'],
+            update_fields=self.AGGREGATE_UPDATE_FIELDS,
+        )
+        self._bulk_upsert(
+            KpiResult, kpi_results,
+            unique_fields=['doctor', 'specialization', 'plan_type', 'period'],
+            update_fields=self.RESULT_UPDATE_FIELDS,
+        )
+        self._bulk_upsert(
+            KpiQualityResult, list(quality_results),
+            unique_fields=['source_id', 'doctorid', 'period'],
+            update_fields=self.QUALITY_UPDATE_FIELDS,
+        )
+        print(f"Записано агрегатов: {len(aggregates)}, результатов KPI: {len(kpi_results)}, "
+              f"показателей качества: {len(quality_results)} (пакетами по {self.batch_size})")
+    
+    def delete_stale(self, aggregates, kpi_results, quality_results):
+        """
+        Удаляет строки периода, которых нет в новом расчете: у врача не осталось
+        визитов или специальности, у специальности пропал план.
+        Проверяются врачи doctors_filter, без него - весь период.
+        Возвращает количество удаленных строк
+        """
+        stored_aggregates = VisitAggregate.objects.filter(period=self.period)
+        stored_results = KpiResult.objects.filter(period=self.period)
+        stored_quality = KpiQualityResult.objects.filter(period=self.period)
+        if self.doctors_filter is not None:
+            stored_aggregates = stored_aggregates.filter(doctors_condition(self.doctors_filter))
+            stored_results = stored_results.filter(
+                doctors_condition(self.doctors_filter, 'doctor__keyiddocdep', 'doctor__source_id')
+            )
+            stored_quality = stored_quality.filter(doctors_condition(self.doctors_filter, 'doctorid'))
+        
+        computed = {(row.source_id, row.doctor_id) for row in aggregates}
+        stale_aggregates = [
+            pk for pk, source_id, doctor_id in stored_aggregates.values_list('pk', 'source_id', 'doctor_id')
+            if (source_id, doctor_id) not in computed
+        ]
+        computed = {(row.doctor_id, row.specialization_id, row.plan_type_id) for row in kpi_results}
+        stale_results = [
+            pk for pk, *key in stored_results.values_list('pk', 'doctor_id', 'specialization_id', 'plan_type_id')
+            if tuple(key) not in computed
+        ]
+        computed = {(row.source_id, row.doctorid) for row in quality_results}
+        stale_quality = [
+            pk for pk, source_id, doctor_id in stored_quality.values_list('pk', 'source_id', 'doctorid')
+            if (source_id, doctor_id) not in computed
+        ]
         
+        with transaction.atomic():
+            deleted = VisitAggregate.objects.filter(pk__in=stale_aggregates).delete()[0]
+            deleted += KpiResult.objects.filter(pk__in=stale_results).delete()[0]
+            deleted += KpiQualityResult.objects.filter(pk__in=stale_quality).delete()[0]
+        if deleted:
+            print(f"Удалено устаревших строк: агрегатов {len(stale_aggregates)}, "
+                  f"результатов KPI {len(stale_results)}, показателей качества {len(stale_quality)}")
+        return deleted
+    
+    def compute_kpi(self):
+        """
+        Агрегирует данные и рассчитывает KPI без записи в БД.
+        Возвращает (агрегаты VisitAggregate, результаты KpiResult, показатели KpiQualityResult)
+        """
         # 1. Агрегируем данные по визитам
         doctors_data = self.aggregate_visits_data()
         
         if not doctors_data:
-            print("Нет данных для расчета.")
-            return
+            return [], [], []
         
         kpi_results = []
-        doctors_without_plans = []
+        quality_results = []
+        aggregates = []
+        rows = []
+        calculation_date = timezone.now().date()
+        
+        self.load_references(doctors_data)
         
         for doctor_key, data in doctors_data.items():
             print(f"Обработка врача: {data['doctor_name']}")
@@ -151,7 +341,8 @@ class KPICalculator:
             # 2. Определяем специальность врача
             mis_specialization = self.get_specialization_for_doctor(
                 data['doctor_id'], 
-                data['department_id']
+                data['department_id'],
+                data['source_id'],
             )
             
             if not mis_specialization:
@@ -159,96 +350,223 @@ class KPICalculator:
                 continue
 
             #Находим объект врача для сохранения в KpiResult
-            doctor_obj = MisImportedDoctor.objects.filter(keyiddocdep=data['doctor_id']).first()
+            doctor_obj = self.get_doctor(data['doctor_id'], data['source_id'])
             
-            # 3. Сохраняем агрегированные данные
-            aggregate, created = VisitAggregate.objects.update_or_create(
+            # 3. Агрегированные данные (записываются пакетом после расчета)
+            aggregates.append(VisitAggregate(
+                source_id=data['source_id'],
                 doctor_id=data['doctor_id'],
                 period=self.period,
-                defaults={
-                    'doctor_name': data['doctor_name'],
-                    'specialization': mis_specialization,
-                    'department_id': data['department_id'],
-                    'department_name': data['department_name'],
-                    'total_visits': data['total_visits'],
-                    'visits_by_purpose': data['visits_by_purpose'],
-                    'validated_docs_count': data['validated_docs_count'],
-                    'total_docs_count': data['total_docs_count'],
-                    'visits_with_z_diagnosis': data['visits_with_z_diagnosis'],
-                }
-            )
+                doctor_name=data['doctor_name'],
+                specialization=mis_specialization,
+                department_id=data['department_id'],
+                department_name=data['department_name'],
+                total_visits=data['total_visits'],
+                visits_by_purpose=data['visits_by_purpose'],
+                visits_by_chapter=data['visits_by_chapter'],
+                visits_by_block=data['visits_by_block'],
+                validated_docs_count=data['validated_docs_count'],
+                total_docs_count=data['total_docs_count'],
+                visits_with_z_diagnosis=data['visits_with_z_diagnosis'],
+            ))
             
-            # 4. Рассчитываем KPI для каждого типа плана
-            purposes = MisImportedPurpose.objects.all()
-            doctor_has_plans = False
+            rows.append((data, mis_specialization, doctor_obj))
+        
+        # 4. Проценты выполнения всех планов - одним расчетом по матрицам врач × цель
+        matrix = KpiMatrix([(data, spec) for data, spec, _ in rows], self.purposes, self.plans)
+        percentages = matrix.percentages
+        validation_percentages = matrix.validation_percentages
+        disease_percentages = matrix.disease_percentages
+        
+        for row, (data, mis_specialization, doctor_obj) in enumerate(rows):
+            # 5. Показатели без плана - из тех же агрегатов, без повторного чтения визитов
+            quality_results.append(KpiQualityResult(
+                calculation_date=calculation_date,
+                source_id=data['source_id'],
+                doctorid=data['doctor_id'],
+                doctor=doctor_obj,
+                specialization=mis_specialization,
+                period=self.period,
+                validated_docs_count=data['validated_docs_count'],
+                total_docs_count=data['total_docs_count'],
+                validation_percentage=float(validation_percentages[row]),
+                total_visits=data['total_visits'],
+                visits_with_z_diagnosis=data['visits_with_z_diagnosis'],
+                disease_percentage=float(disease_percentages[row]),
+            ))
             
-            for purpose in purposes:
-                try:
-                    # Получаем годовой план для специальности и типа показателя
-                    annual_plan = KpiPlan.objects.get(
-                        year=self.year,
-                        specid=mis_specialization.keyidmis,
-                        plan_vistype=purpose.code
-                    )
-                    doctor_has_plans = True
-                    
-                    actual_value = data['visits_by_purpose'].get(purpose.code, 0)
-                    plan_value = annual_plan.monthly_plan()
-                    percentage = self.calculate_percentage(actual_value, plan_value)
-
-                     # Логирование для отладки
-                    #print(f" 🔍 РАСЧЕТ ДЛЯ '{purpose.text}':")
-                    #print(f"    - Код цели: {purpose.code}")
-                    #print(f"    - Визиты для этой цели: {actual_value}")
-                    #print(f"    - Годовой план: {annual_plan.plan_value}")
-                    #print(f"    - Месячный план: {plan_value}")
-                    #print(f"    - Процент выполнения: {percentage}%")
-                    
-                    #сохранение в базу
-                    #print(f" 🎯 СОХРАНЕНИЕ В БАЗУ:")
-                    #print(f"    - actual_value для сохранения: {actual_value}")
-                    #print(f"    - plan_value для сохранения: {plan_value}")
-                    #print(f"    - percentage для сохранения: {percentage}")
-
-                    # Создаем KPI результат
-                    kpi_result, created = KpiResult.objects.update_or_create(
-                        calculation_date=timezone.now().date(),
-                        doctor=doctor_obj,
-                        specialization=mis_specialization,
-                        plan_type=purpose,
-                        period=self.period,
-                        defaults={
-                            'actual_value': actual_value,
-                            'plan_value': plan_value,
-                            'percentage': percentage,
-                        }
-                    )
-                    
-                    #что сохранено
-                    #print(f" ✅ СОХРАНЕНО В БАЗУ:")
-                    #print(f"    - actual_value в базе: {kpi_result.actual_value}")
-                    #print(f"    - plan_value в базе: {kpi_result.plan_value}")
-                    #print(f"    - percentage в базе: {kpi_result.percentage}")
-
-                    kpi_results.append(kpi_result)
-                    
-                    print(f"  ✅ Рассчитан {purpose.text}: {percentage}%")
-                    
-                except KpiPlan.DoesNotExist:
-                    print(f" ⚠️ Не найден план для {mis_specialization.text} (код: {mis_specialization.code}) - цель {purpose.code} ({purpose.text})")
-                    continue
-                except Exception as e:
-                    print(f"  ❌ Ошибка расчета {purpose.code}: {e}")
-                    continue
-
-            if not doctor_has_plans:
+            planned = np.flatnonzero(matrix.has_plan[row])
+            if not planned.size:
                 print(f" ⚠️ Нет планов для врача {data['doctor_name']} ({mis_specialization.text})")
+                continue
+            
+            for column in planned:
+                purpose = self.purposes[column]
+                percentage = float(percentages[row, column])
+                
+                # Создаем KPI результат (записывается пакетом после расчета)
+                kpi_results.append(KpiResult(
+                    calculation_date=calculation_date,
+                    doctor=doctor_obj,
+                    specialization=mis_specialization,
+                    plan_type=purpose,
+                    period=self.period,
+                    actual_value=int(matrix.fact[row, column]),
+                    plan_value=int(matrix.plan[row, column]),
+                    percentage=percentage,
+                ))
+                
+                print(f"  ✅ Рассчитан {purpose.text}: {percentage}%")
+
+        return aggregates, kpi_results, quality_results
+    
+    def calculate_all_kpi(self):
+        """
+        Основной метод: агрегирует данные, рассчитывает все KPI и записывает их.
+        Строки врачей, выпавших из расчета, удаляются (см. delete_stale).
+        """
+        print(f"Запуск расчета KPI за {self.period}...")
+        
+        # Полный расчет периода покрывает и отмеченные импортом пары этого периода.
+        # Отметки читаются до расчета: поставленные во время него останутся
+        marks = pending_pairs(self.period).get(self.period, {}) if self.doctors_filter is None else {}
+        
+        aggregates, kpi_results, quality_results = self.compute_kpi()
+        if aggregates:
+            # Пакетная запись
+            self.save_results(aggregates, kpi_results, quality_results)
+        else:
+            print("Нет данных для расчета.")
+        self.delete_stale(aggregates, kpi_results, quality_results)
+        
+        if self.cumulative:
+            update_cumulative(self.year, self.month, doctors=self.doctors_filter, batch_size=self.batch_size)
+        clear_pairs(marks)
 
         print(f"✅ Расчет KPI завершен. Обработано результатов: {len(kpi_results)}")
         return kpi_results
 
 # Утилитная функция для ручного запуска
-def run_kpi_calculation(period=None):
+def run_kpi_calculation(period=None, batch_size=1000, cumulative=True):
     """Запускает расчет KPI для указанного периода."""
+    calculator = KPICalculator(period, batch_size=batch_size, cumulative=cumulative)
+    return calculator.calculate_all_kpi()
+
+def run_incremental_calculation(batch_size=1000):
+    """
+    Пересчитывает только пары врач/период, отмеченные импортом как измененные.
+    Агрегаты и результаты обновляются на месте теми же upsert, что и при полном расчете.
+    Возвращает {период: количество результатов}
+    """
+    periods = pending_pairs()
+    if not periods:
+        print("Нет измененных пар врач/период")
+        return {}
+
+    print(f"Измененных пар: {sum(len(doctors) for doctors in periods.values())} "
+          f"в {len(periods)} периодах")
+
+    summary = {}
+    for period in sorted(periods):
+        marks = periods[period]
+        print(f"Период {period}: врачей {len(marks)}")
+        calculator = KPICalculator(period, batch_size=batch_size, doctors=set(marks))
+        summary[period] = len(calculator.calculate_all_kpi() or [])
+        # Снимаются только прочитанные отметки: поставленные импортом во время расчета остаются
+        clear_pairs(marks)
+    return summary
+
+def verify_period(period):
+    """
+    Сверяет записанные VisitAggregate, KpiResult и KpiQualityResult периода с полным расчетом в памяти
+    в обе стороны: расхождения значений, недостающие строки и лишние строки в БД.
+    Возвращает список расхождений (пустой - результаты совпадают с полным расчетом)
+    """
     calculator = KPICalculator(period)
-    return calculator.calculate_all_kpi()
\ No newline at end of file
+    aggregates, kpi_results, quality_results = calculator.compute_kpi()
+    fields = ['specialization_id'] + [
+        name for name in KPICalculator.AGGREGATE_UPDATE_FIELDS
+        if name not in ('specialization', 'calculated_at')
+    ]
+
+    mismatches = []
+    stored = {
+        (row.source_id, row.doctor_id): row
+        for row in VisitAggregate.objects.filter(period=period)
+    }
+    for aggregate in aggregates:
+        row = stored.get((aggregate.source_id, aggregate.doctor_id))
+        expected = [getattr(aggregate, name) for name in fields]
+        # JSON хранит ключи visits_by_purpose строками - сравниваем в том же виде
+        expected[fields.index('visits_by_purpose')] = {
+            str(key): value for key, value in aggregate.visits_by_purpose.items()
+        }
+        actual = [getattr(row, name) for name in fields] if row else None
+        if actual != expected:
+            mismatches.append(f"VisitAggregate {aggregate.source_id}/{aggregate.doctor_id}: "
+                              f"в БД {actual}, полный расчет {expected}")
+    computed = {(aggregate.source_id, aggregate.doctor_id) for aggregate in aggregates}
+    for source_id, doctor_id in sorted(set(stored) - computed):
+        mismatches.append(f"VisitAggregate {source_id}/{doctor_id}: лишняя строка в БД")
+
+    stored = {
+        (row.doctor_id, row.specialization_id, row.plan_type_id): row
+        for row in KpiResult.objects.filter(period=period)
+    }
+    for result in kpi_results:
+        row = stored.get((result.doctor_id, result.specialization_id, result.plan_type_id))
+        expected = (result.actual_value, result.plan_value, round(Decimal(str(result.percentage)), 2))
+        actual = (row.actual_value, row.plan_value, row.percentage) if row else None
+        if actual != expected:
+            mismatches.append(f"KpiResult врач {result.doctor_id}, цель {result.plan_type_id}: "
+                              f"в БД {actual}, полный расчет {expected}")
+    computed = {(result.doctor_id, result.specialization_id, result.plan_type_id) for result in kpi_results}
+    for doctor_id, _, plan_type_id in set(stored) - computed:
+        mismatches.append(f"KpiResult врач {doctor_id}, цель {plan_type_id}: лишняя строка в БД")
+
+    stored = {
+        (row.source_id, row.doctorid): row
+        for row in KpiQualityResult.objects.filter(period=period)
+    }
+    for result in quality_results:
+        row = stored.get((result.source_id, result.doctorid))
+        expected = (result.specialization_id,
+                    round(Decimal(str(result.validation_percentage)), 2),
+                    round(Decimal(str(result.disease_percentage)), 2))
+        actual = (row.specialization_id, row.validation_percentage, row.disease_percentage) if row else None
+        if actual != expected:
+            mismatches.append(f"KpiQualityResult {result.source_id}/{result.doctorid}: "
+                              f"в БД {actual}, полный расчет {expected}")
+    computed = {(result.source_id, result.doctorid) for result in quality_results}
+    for source_id, doctor_id in sorted(set(stored) - computed):
+        mismatches.append(f"KpiQualityResult {source_id}/{doctor_id}: лишняя строка в БД")
+    return mismatches
+
+def build_periods(period_from, period_to):
+    """Список периодов 'YYYY-MM' от period_from до period_to включительно"""
+    year, month = map(int, period_from.split('-'))
+    end = tuple(map(int, period_to.split('-')))
+
+    periods = []
+    while (year, month) <= end:
+        periods.append(f"{year:04d}-{month:02d}")
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return periods
+
+def calculate_period(period, batch_size=1000):
+    """
+    Расчет одного периода в процессе пула (см. integration.backfill.init_worker).
+    Нарастающий итог периоды пула не трогают - его пересчитывает вызывающий
+    после всех периодов (см. update_cumulative), иначе месяцы гонялись бы за базу.
+    Возвращает итог периода; ошибка не прерывает остальные периоды.
+    """
+    started = time.monotonic()
+    try:
+        results = run_kpi_calculation(period, batch_size=batch_size, cumulative=False)
+        return {'period': period, 'results': len(results or []), 'error': '',
+                'seconds': time.monotonic() - started}
+    except Exception as e:
+        return {'period': period, 'results': 0, 'error': str(e),
+                'seconds': time.monotonic() - started}
+    finally:
+        connections.close_all()
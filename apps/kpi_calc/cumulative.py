@@ -0,0 +1,129 @@
+#apps\kpi_calc\cumulative.py
+
+"""
+Нарастающий итог план-факт с начала года (KpiCumulative).
+Пересчет месяца M обновляет строки месяцев M..последний рассчитанный:
+факт нарастающим итогом берется из строки месяца M-1 (поиск по индексу)
+плюс месячные факты из VisitAggregate, год целиком не перебирается.
+"""
+
+from django.db import transaction
+from django.db.models import Min
+from integration.dirty_pairs import doctors_condition
+from integration.models import VisitAggregate, MisImportedDoctor, MisImportedPurpose
+from plans.models import KpiPlan
+from .matrix import percentage
+from .models import KpiCumulative
+
+
+def update_cumulative(year, from_month=1, doctors=None, batch_size=1000):
+    """
+    Пересчитывает нарастающий итог года начиная с from_month.
+    doctors - пересчитать только этих врачей: множество пар (source_id, doctor_id).
+    База - строки месяца from_month - 1; если их нет, а агрегаты за более ранние
+    месяцы есть, итог пересобирается с первого месяца с агрегатами.
+    Возвращает количество записанных строк
+    """
+    year_aggregates = VisitAggregate.objects.filter(
+        period__gte=f"{year:04d}-01",
+        period__lte=f"{year:04d}-12",
+        specialization__isnull=False,
+    )
+    existing = KpiCumulative.objects.filter(year=year)
+    if doctors is not None:
+        year_aggregates = year_aggregates.filter(doctors_condition(doctors))
+        existing = existing.filter(doctors_condition(doctors, 'doctorid'))
+
+    if from_month > 1 and not existing.filter(month=from_month - 1).exists():
+        first_period = year_aggregates.filter(
+            period__lt=f"{year:04d}-{from_month:02d}"
+        ).aggregate(first=Min('period'))['first']
+        if first_period is not None:
+            print(f"Нет нарастающего итога {year} за месяц {from_month - 1}: пересчет с {first_period}")
+            return update_cumulative(year, int(first_period[5:7]), doctors, batch_size)
+
+    aggregates = year_aggregates.filter(
+        period__gte=f"{year:04d}-{from_month:02d}"
+    ).select_related('specialization')
+
+    by_month = {}
+    for aggregate in aggregates:
+        month = int(aggregate.period[5:7])
+        by_month.setdefault(month, {})[(aggregate.source_id, aggregate.doctor_id)] = aggregate
+
+    # Последний рассчитанный месяц года: до него итог продолжается и без визитов
+    periods = VisitAggregate.objects.filter(period__startswith=f"{year:04d}-").values_list('period', flat=True)
+    last_month = max([int(period[5:7]) for period in periods.distinct()] + [from_month])
+
+    plans = {(plan.specid, plan.plan_vistype): plan for plan in KpiPlan.objects.filter(year=year)}
+    purposes = list(MisImportedPurpose.objects.all())
+
+    # База: нарастающий итог месяца from_month - 1 по ключу (источник, врач, специальность, цель)
+    state = {}
+    if from_month > 1:
+        for row in existing.filter(month=from_month - 1).select_related('specialization', 'plan_type'):
+            key = (row.source_id, row.doctorid, row.specialization.keyidmis, row.plan_type.code)
+            state[key] = (row.fact_cumulative, row.specialization, row.plan_type)
+
+    # Если в справочнике несколько строк врача, как и в расчете KPI берется первая
+    doctor_ids = {doctor_id for month_aggregates in by_month.values() for _, doctor_id in month_aggregates}
+    doctor_ids |= {doctor_id for _, doctor_id, _, _ in state}
+    doctor_objects = {}
+    for doctor in MisImportedDoctor.objects.filter(keyiddocdep__in=doctor_ids).order_by('keyid'):
+        doctor_objects.setdefault((doctor.source_id, doctor.keyiddocdep), doctor)
+
+    rows = []
+    for month in range(from_month, last_month + 1):
+        month_aggregates = by_month.get(month, {})
+        for (source_id, doctor_id), aggregate in month_aggregates.items():
+            specialization = aggregate.specialization
+            for purpose in purposes:
+                key = (source_id, doctor_id, specialization.keyidmis, purpose.code)
+                if (specialization.keyidmis, purpose.code) in plans:
+                    state.setdefault(key, (0, specialization, purpose))
+
+        for key, (fact_before, specialization, purpose) in state.items():
+            source_id, doctor_id, specid, code = key
+            annual_plan = plans.get((specid, code))
+            if annual_plan is None:
+                continue
+
+            aggregate = month_aggregates.get((source_id, doctor_id))
+            fact_month = 0
+            if aggregate is not None and aggregate.specialization_id == specialization.pk:
+                # JSON хранит ключи visits_by_purpose строками
+                fact_month = aggregate.visits_by_purpose.get(str(code), 0)
+
+            plan_month = annual_plan.monthly_plan()
+            state[key] = (fact_before + fact_month, specialization, purpose)
+            rows.append(KpiCumulative(
+                source_id=source_id,
+                doctorid=doctor_id,
+                doctor=doctor_objects.get((source_id, doctor_id)),
+                specialization=specialization,
+                plan_type=purpose,
+                year=year,
+                month=month,
+                plan_year=annual_plan.plan_value,
+                plan_month=plan_month,
+                fact_month=fact_month,
+                plan_cumulative=plan_month * month,
+                fact_cumulative=fact_before + fact_month,
+            ))
+
+    # Проценты - одним расчетом по массивам с семантикой calculate_percentage
+    month_percentages = percentage([row.fact_month for row in rows], [row.plan_month for row in rows])
+    cumulative_percentages = percentage(
+        [row.fact_cumulative for row in rows], [row.plan_cumulative for row in rows]
+    )
+    for row, month_value, cumulative_value in zip(rows, month_percentages, cumulative_percentages):
+        row.percentage_month = float(month_value)
+        row.percentage_cumulative = float(cumulative_value)
+
+    # Строки месяцев from_month.. заменяются целиком: пропадают ключи, которых больше нет
+    with transaction.atomic():
+        existing.filter(month__gte=from_month).delete()
+        KpiCumulative.objects.bulk_create(rows, batch_size=batch_size)
+
+    print(f"Нарастающий итог {year} с месяца {from_month}: записано строк {len(rows)}")
+    return len(rows)
@@ -0,0 +1,410 @@
+#apps\kpi_calc\icd10.py
+
+"""
+Классы и блоки МКБ-10 по трехзначным рубрикам.
+Рубрика 'A00'..'Z99' кодируется числом (номер буквы * 100 + номер рубрики),
+класс или блок находится бинарным поиском (np.searchsorted) сразу по массиву
+рубрик - без проверки строк в цикле по визитам. Индексы строятся один раз на процесс.
+Хранятся только количества визитов; доли считаются из них (Icd10Index.shares).
+"""
+
+from functools import lru_cache
+import numpy as np
+
+from .matrix import percentage
+
+# Классы МКБ-10: (первая рубрика, последняя рубрика, класс)
+ICD10_CHAPTERS = (
+    ('A00', 'B99', 'I'),       # Некоторые инфекционные и паразитарные болезни
+    ('C00', 'D48', 'II'),      # Новообразования
+    ('D50', 'D89', 'III'),     # Болезни крови и иммунные нарушения
+    ('E00', 'E90', 'IV'),      # Болезни эндокринной системы, обмена веществ
+    ('F00', 'F99', 'V'),       # Психические расстройства
+    ('G00', 'G99', 'VI'),      # Болезни нервной системы
+    ('H00', 'H59', 'VII'),     # Болезни глаза
+    ('H60', 'H95', 'VIII'),    # Болезни уха
+    ('I00', 'I99', 'IX'),      # Болезни системы кровообращения
+    ('J00', 'J99', 'X'),       # Болезни органов дыхания
+    ('K00', 'K93', 'XI'),      # Болезни органов пищеварения
+    ('L00', 'L99', 'XII'),     # Болезни кожи
+    ('M00', 'M99', 'XIII'),    # Болезни костно-мышечной системы
+    ('N00', 'N99', 'XIV'),     # Болезни мочеполовой системы
+    ('O00', 'O99', 'XV'),      # Беременность, роды и послеродовой период
+    ('P00', 'P96', 'XVI'),     # Перинатальные состояния
+    ('Q00', 'Q99', 'XVII'),    # Врожденные аномалии
+    ('R00', 'R99', 'XVIII'),   # Симптомы и отклонения от нормы
+    ('S00', 'T98', 'XIX'),     # Травмы и отравления
+    ('U00', 'U85', 'XXII'),    # Коды для особых целей
+    ('V01', 'Y98', 'XX'),      # Внешние причины
+    ('Z00', 'Z99', 'XXI'),     # Факторы, влияющие на здоровье (Z-диагнозы)
+)
+
+# Блоки МКБ-10 (ВОЗ): (первая рубрика, последняя рубрика, блок)
+ICD10_BLOCKS = (
+    # I. Некоторые инфекционные и паразитарные болезни
+    ('A00', 'A09', 'A00-A09'),  # Кишечные инфекции
+    ('A15', 'A19', 'A15-A19'),  # Туберкулез
+    ('A20', 'A28', 'A20-A28'),  # Некоторые бактериальные зоонозы
+    ('A30', 'A49', 'A30-A49'),  # Другие бактериальные болезни
+    ('A50', 'A64', 'A50-A64'),  # Инфекции, передающиеся половым путем
+    ('A65', 'A69', 'A65-A69'),  # Другие болезни, вызываемые спирохетами
+    ('A70', 'A74', 'A70-A74'),  # Другие болезни, вызываемые хламидиями
+    ('A75', 'A79', 'A75-A79'),  # Риккетсиозы
+    ('A80', 'A89', 'A80-A89'),  # Вирусные инфекции центральной нервной системы
+    ('A90', 'A99', 'A90-A99'),  # Вирусные лихорадки, передаваемые членистоногими, и геморрагические лихорадки
+    ('B00', 'B09', 'B00-B09'),  # Вирусные инфекции с поражением кожи и слизистых оболочек
+    ('B15', 'B19', 'B15-B19'),  # Вирусный гепатит
+    ('B20', 'B24', 'B20-B24'),  # Болезнь, вызванная ВИЧ
+    ('B25', 'B34', 'B25-B34'),  # Другие вирусные болезни
+    ('B35', 'B49', 'B35-B49'),  # Микозы
+    ('B50', 'B64', 'B50-B64'),  # Протозойные болезни
+    ('B65', 'B83', 'B65-B83'),  # Гельминтозы
+    ('B85', 'B89', 'B85-B89'),  # Педикулез, акариаз и другие инфестации
+    ('B90', 'B94', 'B90-B94'),  # Последствия инфекционных и паразитарных болезней
+    ('B95', 'B98', 'B95-B98'),  # Бактериальные, вирусные и другие инфекционные агенты
+    ('B99', 'B99', 'B99'),  # Другие инфекционные болезни
+    # II. Новообразования
+    ('C00', 'C14', 'C00-C14'),  # Губы, полости рта и глотки
+    ('C15', 'C26', 'C15-C26'),  # Органов пищеварения
+    ('C30', 'C39', 'C30-C39'),  # Органов дыхания и грудной клетки
+    ('C40', 'C41', 'C40-C41'),  # Костей и суставных хрящей
+    ('C43', 'C44', 'C43-C44'),  # Кожи
+    ('C45', 'C49', 'C45-C49'),  # Мезотелиальной и мягких тканей
+    ('C50', 'C50', 'C50'),  # Молочной железы
+    ('C51', 'C58', 'C51-C58'),  # Женских половых органов
+    ('C60', 'C63', 'C60-C63'),  # Мужских половых органов
+    ('C64', 'C68', 'C64-C68'),  # Мочевых путей
+    ('C69', 'C72', 'C69-C72'),  # Глаза, головного мозга и других отделов ЦНС
+    ('C73', 'C75', 'C73-C75'),  # Щитовидной и других эндокринных желез
+    ('C76', 'C80', 'C76-C80'),  # Неточно обозначенных, вторичных и неуточненных локализаций
+    ('C81', 'C96', 'C81-C96'),  # Лимфоидной, кроветворной и родственных тканей
+    ('C97', 'C97', 'C97'),  # Самостоятельных множественных локализаций
+    ('D00', 'D09', 'D00-D09'),  # Новообразования in situ
+    ('D10', 'D36', 'D10-D36'),  # Доброкачественные новообразования
+    ('D37', 'D48', 'D37-D48'),  # Новообразования неопределенного или неизвестного характера
+    # III. Болезни крови и иммунные нарушения
+    ('D50', 'D53', 'D50-D53'),  # Анемии, связанные с питанием
+    ('D55', 'D59', 'D55-D59'),  # Гемолитические анемии
+    ('D60', 'D64', 'D60-D64'),  # Апластические и другие анемии
+    ('D65', 'D69', 'D65-D69'),  # Нарушения свертываемости крови, пурпура
+    ('D70', 'D77', 'D70-D77'),  # Другие болезни крови и кроветворных органов
+    ('D80', 'D89', 'D80-D89'),  # Отдельные нарушения с вовлечением иммунного механизма
+    # IV. Болезни эндокринной системы, обмена веществ
+    ('E00', 'E07', 'E00-E07'),  # Болезни щитовидной железы
+    ('E10', 'E14', 'E10-E14'),  # Сахарный диабет
+    ('E15', 'E16', 'E15-E16'),  # Другие нарушения регуляции глюкозы
+    ('E20', 'E35', 'E20-E35'),  # Нарушения других эндокринных желез
+    ('E40', 'E46', 'E40-E46'),  # Недостаточность питания
+    ('E50', 'E64', 'E50-E64'),  # Другие виды недостаточности питания
+    ('E65', 'E68', 'E65-E68'),  # Ожирение и другие виды избыточности питания
+    ('E70', 'E90', 'E70-E90'),  # Нарушения обмена веществ
+    # V. Психические расстройства
+    ('F00', 'F09', 'F00-F09'),  # Органические психические расстройства
+    ('F10', 'F19', 'F10-F19'),  # Расстройства, связанные с употреблением психоактивных веществ
+    ('F20', 'F29', 'F20-F29'),  # Шизофрения, шизотипические и бредовые расстройства
+    ('F30', 'F39', 'F30-F39'),  # Расстройства настроения
+    ('F40', 'F48', 'F40-F48'),  # Невротические, связанные со стрессом и соматоформные расстройства
+    ('F50', 'F59', 'F50-F59'),  # Поведенческие синдромы, связанные с физиологическими нарушениями
+    ('F60', 'F69', 'F60-F69'),  # Расстройства личности и поведения
+    ('F70', 'F79', 'F70-F79'),  # Умственная отсталость
+    ('F80', 'F89', 'F80-F89'),  # Нарушения психологического развития
+    ('F90', 'F98', 'F90-F98'),  # Расстройства, начинающиеся в детском и подростковом возрасте
+    ('F99', 'F99', 'F99'),  # Неуточненные психические расстройства
+    # VI. Болезни нервной системы
+    ('G00', 'G09', 'G00-G09'),  # Воспалительные болезни ЦНС
+    ('G10', 'G14', 'G10-G14'),  # Системные атрофии
+    ('G20', 'G26', 'G20-G26'),  # Экстрапирамидные и другие двигательные нарушения
+    ('G30', 'G32', 'G30-G32'),  # Другие дегенеративные болезни нервной системы
+    ('G35', 'G37', 'G35-G37'),  # Демиелинизирующие болезни ЦНС
+    ('G40', 'G47', 'G40-G47'),  # Эпизодические и пароксизмальные расстройства
+    ('G50', 'G59', 'G50-G59'),  # Поражения отдельных нервов, нервных корешков и сплетений
+    ('G60', 'G64', 'G60-G64'),  # Полиневропатии
+    ('G70', 'G73', 'G70-G73'),  # Болезни нервно-мышечного синапса и мышц
+    ('G80', 'G83', 'G80-G83'),  # Церебральный паралич и другие паралитические синдромы
+    ('G90', 'G99', 'G90-G99'),  # Другие нарушения нервной системы
+    # VII. Болезни глаза
+    ('H00', 'H06', 'H00-H06'),  # Век, слезных путей и глазницы
+    ('H10', 'H13', 'H10-H13'),  # Конъюнктивы
+    ('H15', 'H22', 'H15-H22'),  # Склеры, роговицы, радужной оболочки и цилиарного тела
+    ('H25', 'H28', 'H25-H28'),  # Хрусталика
+    ('H30', 'H36', 'H30-H36'),  # Сосудистой оболочки и сетчатки
+    ('H40', 'H42', 'H40-H42'),  # Глаукома
+    ('H43', 'H45', 'H43-H45'),  # Стекловидного тела и глазного яблока
+    ('H46', 'H48', 'H46-H48'),  # Зрительного нерва и зрительных путей
+    ('H49', 'H52', 'H49-H52'),  # Мышц глаза, содружественного движения, аккомодации и рефракции
+    ('H53', 'H54', 'H53-H54'),  # Зрительные расстройства и слепота
+    ('H55', 'H59', 'H55-H59'),  # Другие болезни глаза
+    # VIII. Болезни уха
+    ('H60', 'H62', 'H60-H62'),  # Наружного уха
+    ('H65', 'H75', 'H65-H75'),  # Среднего уха и сосцевидного отростка
+    ('H80', 'H83', 'H80-H83'),  # Внутреннего уха
+    ('H90', 'H95', 'H90-H95'),  # Другие болезни уха
+    # IX. Болезни системы кровообращения
+    ('I00', 'I02', 'I00-I02'),  # Острая ревматическая лихорадка
+    ('I05', 'I09', 'I05-I09'),  # Хронические ревматические болезни сердца
+    ('I10', 'I15', 'I10-I15'),  # Болезни, характеризующиеся повышенным кровяным давлением
+    ('I20', 'I25', 'I20-I25'),  # Ишемическая болезнь сердца
+    ('I26', 'I28', 'I26-I28'),  # Легочное сердце и нарушения легочного кровообращения
+    ('I30', 'I52', 'I30-I52'),  # Другие болезни сердца
+    ('I60', 'I69', 'I60-I69'),  # Цереброваскулярные болезни
+    ('I70', 'I79', 'I70-I79'),  # Болезни артерий, артериол и капилляров
+    ('I80', 'I89', 'I80-I89'),  # Болезни вен, лимфатических сосудов и узлов
+    ('I95', 'I99', 'I95-I99'),  # Другие болезни системы кровообращения
+    # X. Болезни органов дыхания
+    ('J00', 'J06', 'J00-J06'),  # Острые респираторные инфекции верхних дыхательных путей
+    ('J09', 'J18', 'J09-J18'),  # Грипп и пневмония
+    ('J20', 'J22', 'J20-J22'),  # Другие острые респираторные инфекции нижних дыхательных путей
+    ('J30', 'J39', 'J30-J39'),  # Другие болезни верхних дыхательных путей
+    ('J40', 'J47', 'J40-J47'),  # Хронические болезни нижних дыхательных путей
+    ('J60', 'J70', 'J60-J70'),  # Болезни легкого, вызванные внешними агентами
+    ('J80', 'J84', 'J80-J84'),  # Другие болезни, поражающие интерстициальную ткань
+    ('J85', 'J86', 'J85-J86'),  # Гнойные и некротические состояния нижних дыхательных путей
+    ('J90', 'J94', 'J90-J94'),  # Другие болезни плевры
+    ('J95', 'J99', 'J95-J99'),  # Другие болезни органов дыхания
+    # XI. Болезни органов пищеварения
+    ('K00', 'K14', 'K00-K14'),  # Полости рта, слюнных желез и челюстей
+    ('K20', 'K31', 'K20-K31'),  # Пищевода, желудка и двенадцатиперстной кишки
+    ('K35', 'K38', 'K35-K38'),  # Аппендикса
+    ('K40', 'K46', 'K40-K46'),  # Грыжи
+    ('K50', 'K52', 'K50-K52'),  # Неинфекционный энтерит и колит
+    ('K55', 'K64', 'K55-K64'),  # Другие болезни кишечника
+    ('K65', 'K67', 'K65-K67'),  # Брюшины
+    ('K70', 'K77', 'K70-K77'),  # Печени
+    ('K80', 'K87', 'K80-K87'),  # Желчного пузыря, желчевыводящих путей и поджелудочной железы
+    ('K90', 'K93', 'K90-K93'),  # Другие болезни органов пищеварения
+    # XII. Болезни кожи
+    ('L00', 'L08', 'L00-L08'),  # Инфекции кожи и подкожной клетчатки
+    ('L10', 'L14', 'L10-L14'),  # Буллезные нарушения
+    ('L20', 'L30', 'L20-L30'),  # Дерматит и экзема
+    ('L40', 'L45', 'L40-L45'),  # Папулосквамозные нарушения
+    ('L50', 'L54', 'L50-L54'),  # Крапивница и эритема
+    ('L55', 'L59', 'L55-L59'),  # Болезни, связанные с воздействием излучения
+    ('L60', 'L75', 'L60-L75'),  # Болезни придатков кожи
+    ('L80', 'L99', 'L80-L99'),  # Другие болезни кожи
+    # XIII. Болезни костно-мышечной системы
+    ('M00', 'M03', 'M00-M03'),  # Инфекционные артропатии
+    ('M05', 'M14', 'M05-M14'),  # Воспалительные полиартропатии
+    ('M15', 'M19', 'M15-M19'),  # Артрозы
+    ('M20', 'M25', 'M20-M25'),  # Другие поражения суставов
+    ('M30', 'M36', 'M30-M36'),  # Системные поражения соединительной ткани
+    ('M40', 'M43', 'M40-M43'),  # Деформирующие дорсопатии
+    ('M45', 'M49', 'M45-M49'),  # Спондилопатии
+    ('M50', 'M54', 'M50-M54'),  # Другие дорсопатии
+    ('M60', 'M63', 'M60-M63'),  # Поражения мышц
+    ('M65', 'M68', 'M65-M68'),  # Поражения синовиальных оболочек и сухожилий
+    ('M70', 'M79', 'M70-M79'),  # Другие поражения мягких тканей
+    ('M80', 'M85', 'M80-M85'),  # Нарушения плотности и структуры кости
+    ('M86', 'M90', 'M86-M90'),  # Другие остеопатии
+    ('M91', 'M94', 'M91-M94'),  # Хондропатии
+    ('M95', 'M99', 'M95-M99'),  # Другие нарушения костно-мышечной системы
+    # XIV. Болезни мочеполовой системы
+    ('N00', 'N08', 'N00-N08'),  # Гломерулярные болезни
+    ('N10', 'N16', 'N10-N16'),  # Тубулоинтерстициальные болезни почек
+    ('N17', 'N19', 'N17-N19'),  # Почечная недостаточность
+    ('N20', 'N23', 'N20-N23'),  # Мочекаменная болезнь
+    ('N25', 'N29', 'N25-N29'),  # Другие болезни почки и мочеточника
+    ('N30', 'N39', 'N30-N39'),  # Другие болезни мочевыделительной системы
+    ('N40', 'N51', 'N40-N51'),  # Мужских половых органов
+    ('N60', 'N64', 'N60-N64'),  # Молочной железы
+    ('N70', 'N77', 'N70-N77'),  # Воспалительные болезни женских тазовых органов
+    ('N80', 'N98', 'N80-N98'),  # Невоспалительные болезни женских половых органов
+    ('N99', 'N99', 'N99'),  # Другие нарушения мочеполовой системы
+    # XV. Беременность, роды и послеродовой период
+    ('O00', 'O08', 'O00-O08'),  # Беременность с абортивным исходом
+    ('O10', 'O16', 'O10-O16'),  # Отеки, протеинурия и гипертензивные расстройства
+    ('O20', 'O29', 'O20-O29'),  # Другие болезни матери, связанные с беременностью
+    ('O30', 'O48', 'O30-O48'),  # Медицинская помощь матери в связи с состоянием плода
+    ('O60', 'O75', 'O60-O75'),  # Осложнения родов и родоразрешения
+    ('O80', 'O84', 'O80-O84'),  # Роды
+    ('O85', 'O92', 'O85-O92'),  # Осложнения послеродового периода
+    ('O94', 'O99', 'O94-O99'),  # Другие акушерские состояния
+    # XVI. Перинатальные состояния
+    ('P00', 'P04', 'P00-P04'),  # Поражения плода, обусловленные состоянием матери
+    ('P05', 'P08', 'P05-P08'),  # Продолжительность беременности и рост плода
+    ('P10', 'P15', 'P10-P15'),  # Родовая травма
+    ('P20', 'P29', 'P20-P29'),  # Дыхательные и сердечно-сосудистые нарушения
+    ('P35', 'P39', 'P35-P39'),  # Инфекции перинатального периода
+    ('P50', 'P61', 'P50-P61'),  # Геморрагические и гематологические нарушения
+    ('P70', 'P74', 'P70-P74'),  # Преходящие эндокринные нарушения и нарушения обмена
+    ('P75', 'P78', 'P75-P78'),  # Расстройства системы пищеварения
+    ('P80', 'P83', 'P80-P83'),  # Состояния кожных покровов и терморегуляции
+    ('P90', 'P96', 'P90-P96'),  # Другие нарушения перинатального периода
+    # XVII. Врожденные аномалии
+    ('Q00', 'Q07', 'Q00-Q07'),  # Нервной системы
+    ('Q10', 'Q18', 'Q10-Q18'),  # Глаза, уха, лица и шеи
+    ('Q20', 'Q28', 'Q20-Q28'),  # Системы кровообращения
+    ('Q30', 'Q34', 'Q30-Q34'),  # Органов дыхания
+    ('Q35', 'Q37', 'Q35-Q37'),  # Расщелина губы и неба
+    ('Q38', 'Q45', 'Q38-Q45'),  # Органов пищеварения
+    ('Q50', 'Q56', 'Q50-Q56'),  # Половых органов
+    ('Q60', 'Q64', 'Q60-Q64'),  # Мочевой системы
+    ('Q65', 'Q79', 'Q65-Q79'),  # Костно-мышечной системы
+    ('Q80', 'Q89', 'Q80-Q89'),  # Другие врожденные аномалии
+    ('Q90', 'Q99', 'Q90-Q99'),  # Хромосомные нарушения
+    # XVIII. Симптомы и отклонения от нормы
+    ('R00', 'R09', 'R00-R09'),  # Системы кровообращения и органов дыхания
+    ('R10', 'R19', 'R10-R19'),  # Системы пищеварения и брюшной полости
+    ('R20', 'R23', 'R20-R23'),  # Кожи и подкожной клетчатки
+    ('R25', 'R29', 'R25-R29'),  # Нервной и костно-мышечной систем
+    ('R30', 'R39', 'R30-R39'),  # Мочевыделительной системы
+    ('R40', 'R46', 'R40-R46'),  # Познавательной способности, восприятия, эмоций и поведения
+    ('R47', 'R49', 'R47-R49'),  # Речи и голоса
+    ('R50', 'R69', 'R50-R69'),  # Общие симптомы и признаки
+    ('R70', 'R79', 'R70-R79'),  # Отклонения при исследовании крови
+    ('R80', 'R82', 'R80-R82'),  # Отклонения при исследовании мочи
+    ('R83', 'R89', 'R83-R89'),  # Отклонения при исследовании других жидкостей и тканей
+    ('R90', 'R94', 'R90-R94'),  # Отклонения при визуализации и функциональных исследованиях
+    ('R95', 'R99', 'R95-R99'),  # Неточно обозначенные и неизвестные причины смерти
+    # XIX. Травмы и отравления
+    ('S00', 'S09', 'S00-S09'),  # Травмы головы
+    ('S10', 'S19', 'S10-S19'),  # Травмы шеи
+    ('S20', 'S29', 'S20-S29'),  # Травмы грудной клетки
+    ('S30', 'S39', 'S30-S39'),  # Травмы живота, нижней части спины, поясничного отдела и таза
+    ('S40', 'S49', 'S40-S49'),  # Травмы плечевого пояса и плеча
+    ('S50', 'S59', 'S50-S59'),  # Травмы локтя и предплечья
+    ('S60', 'S69', 'S60-S69'),  # Травмы запястья и кисти
+    ('S70', 'S79', 'S70-S79'),  # Травмы области тазобедренного сустава и бедра
+    ('S80', 'S89', 'S80-S89'),  # Травмы колена и голени
+    ('S90', 'S99', 'S90-S99'),  # Травмы области голеностопного сустава и стопы
+    ('T00', 'T07', 'T00-T07'),  # Травмы нескольких областей тела
+    ('T08', 'T14', 'T08-T14'),  # Травмы неуточненной части туловища, конечности или области тела
+    ('T15', 'T19', 'T15-T19'),  # Последствия проникновения инородного тела через естественные отверстия
+    ('T20', 'T25', 'T20-T25'),  # Термические и химические ожоги наружных поверхностей тела
+    ('T26', 'T28', 'T26-T28'),  # Термические и химические ожоги глаза и внутренних органов
+    ('T29', 'T32', 'T29-T32'),  # Термические и химические ожоги множественной и неуточненной локализации
+    ('T33', 'T35', 'T33-T35'),  # Отморожение
+    ('T36', 'T50', 'T36-T50'),  # Отравления лекарственными средствами
+    ('T51', 'T65', 'T51-T65'),  # Токсическое действие веществ немедицинского назначения
+    ('T66', 'T78', 'T66-T78'),  # Другие и неуточненные эффекты воздействия внешних причин
+    ('T79', 'T79', 'T79'),  # Некоторые ранние осложнения травмы
+    ('T80', 'T88', 'T80-T88'),  # Осложнения хирургических и терапевтических вмешательств
+    ('T90', 'T98', 'T90-T98'),  # Последствия травм, отравлений и других воздействий
+    # XXII. Коды для особых целей
+    ('U00', 'U49', 'U00-U49'),  # Предварительные коды новых болезней
+    ('U82', 'U85', 'U82-U85'),  # Устойчивость к противомикробным препаратам
+    # XX. Внешние причины
+    ('V01', 'V09', 'V01-V09'),  # Пешеход, пострадавший в транспортном несчастном случае
+    ('V10', 'V19', 'V10-V19'),  # Велосипедист
+    ('V20', 'V29', 'V20-V29'),  # Мотоциклист
+    ('V30', 'V39', 'V30-V39'),  # Лицо в трехколесном транспортном средстве
+    ('V40', 'V49', 'V40-V49'),  # Лицо в легковом автомобиле
+    ('V50', 'V59', 'V50-V59'),  # Лицо в грузовом автомобиле или фургоне
+    ('V60', 'V69', 'V60-V69'),  # Лицо в тяжелом грузовом автомобиле
+    ('V70', 'V79', 'V70-V79'),  # Лицо в автобусе
+    ('V80', 'V89', 'V80-V89'),  # Другие несчастные случаи на наземном транспорте
+    ('V90', 'V94', 'V90-V94'),  # Несчастные случаи на водном транспорте
+    ('V95', 'V97', 'V95-V97'),  # Несчастные случаи на воздушном транспорте
+    ('V98', 'V99', 'V98-V99'),  # Другие и неуточненные транспортные несчастные случаи
+    ('W00', 'W19', 'W00-W19'),  # Падения
+    ('W20', 'W49', 'W20-W49'),  # Воздействие неживых механических сил
+    ('W50', 'W64', 'W50-W64'),  # Воздействие живых механических сил
+    ('W65', 'W74', 'W65-W74'),  # Случайное утопление и погружение в воду
+    ('W75', 'W84', 'W75-W84'),  # Другие случаи нарушения дыхания
+    ('W85', 'W99', 'W85-W99'),  # Электрический ток, излучение, крайние температура и давление
+    ('X00', 'X09', 'X00-X09'),  # Воздействие дыма, огня и пламени
+    ('X10', 'X19', 'X10-X19'),  # Контакт с источником высокой температуры
+    ('X20', 'X29', 'X20-X29'),  # Контакт с ядовитыми животными и растениями
+    ('X30', 'X39', 'X30-X39'),  # Воздействие сил природы
+    ('X40', 'X49', 'X40-X49'),  # Случайное отравление
+    ('X50', 'X57', 'X50-X57'),  # Перенапряжение, путешествия и лишения
+    ('X58', 'X59', 'X58-X59'),  # Случайное воздействие других и неуточненных факторов
+    ('X60', 'X84', 'X60-X84'),  # Преднамеренное самоповреждение
+    ('X85', 'Y09', 'X85-Y09'),  # Нападение
+    ('Y10', 'Y34', 'Y10-Y34'),  # Повреждение с неопределенными намерениями
+    ('Y35', 'Y36', 'Y35-Y36'),  # Действия законных властей и военные операции
+    ('Y40', 'Y59', 'Y40-Y59'),  # Лекарственные средства, вызывающие неблагоприятные реакции
+    ('Y60', 'Y69', 'Y60-Y69'),  # Случайное нанесение вреда при медицинской помощи
+    ('Y70', 'Y82', 'Y70-Y82'),  # Медицинские устройства, связанные с несчастными случаями
+    ('Y83', 'Y84', 'Y83-Y84'),  # Вмешательства как причина аномальной реакции
+    ('Y85', 'Y89', 'Y85-Y89'),  # Последствия воздействия внешних причин
+    ('Y90', 'Y98', 'Y90-Y98'),  # Дополнительные факторы
+    # XXI. Факторы, влияющие на здоровье (Z-диагнозы)
+    ('Z00', 'Z13', 'Z00-Z13'),  # Обследования
+    ('Z20', 'Z29', 'Z20-Z29'),  # Потенциальная опасность, связанная с инфекционными болезнями
+    ('Z30', 'Z39', 'Z30-Z39'),  # Обращения в связи с репродуктивной функцией
+    ('Z40', 'Z54', 'Z40-Z54'),  # Обращения в связи с процедурами и медицинской помощью
+    ('Z55', 'Z65', 'Z55-Z65'),  # Социально-экономические и психосоциальные обстоятельства
+    ('Z70', 'Z76', 'Z70-Z76'),  # Обращения по другим обстоятельствам
+    ('Z80', 'Z99', 'Z80-Z99'),  # Личный и семейный анамнез, состояния, влияющие на здоровье
+)
+
+# Пустой или нестандартный код, рубрика вне диапазонов классов (блоков)
+UNCLASSIFIED = 'unclassified'
+
+
+def encode_categories(categories):
+    """
+    Кодирует трехзначные рубрики числами без учета регистра; нестандартные коды - -1.
+    Строки массива разбираются по кодовым точкам без цикла по элементам.
+    """
+    values = np.char.upper(np.array([category or '' for category in categories], dtype='<U3'))
+    points = values.view(np.uint32).reshape(len(values), 3).astype(np.int64)
+
+    letter = points[:, 0] - ord('A')
+    tens = points[:, 1] - ord('0')
+    units = points[:, 2] - ord('0')
+    valid = (letter >= 0) & (letter < 26) & (tens >= 0) & (tens <= 9) & (units >= 0) & (units <= 9)
+    return np.where(valid, letter * 100 + tens * 10 + units, -1)
+
+
+class Icd10Index:
+    """
+    Индекс непересекающихся диапазонов рубрик МКБ-10.
+    ranges - (первая рубрика, последняя рубрика, метка); годится и для блоков
+    """
+
+    def __init__(self, ranges=ICD10_CHAPTERS):
+        ranges = sorted(ranges, key=lambda item: item[0])
+        self.labels = [label for _, _, label in ranges]
+        self.starts = encode_categories([start for start, _, _ in ranges])
+        self.ends = encode_categories([end for _, end, _ in ranges])
+        # Поиск по началам диапазонов верен только для непересекающихся диапазонов
+        if (self.starts < 0).any() or (self.ends < self.starts).any() or (self.starts[1:] <= self.ends[:-1]).any():
+            raise ValueError('Диапазоны МКБ-10 некорректны или пересекаются')
+
+    def classify(self, categories):
+        """Номера меток для массива рубрик; -1 - вне диапазонов"""
+        codes = encode_categories(categories)
+        positions = np.searchsorted(self.starts, codes, side='right') - 1
+        clipped = np.clip(positions, 0, None)
+        inside = (codes >= 0) & (positions >= 0) & (codes <= self.ends[clipped])
+        return np.where(inside, positions, -1)
+
+    def count_by_group(self, groups, categories, counts, group_count):
+        """
+        Суммы counts по группам (строки) и меткам (столбцы).
+        Последний столбец - визиты с неклассифицированным кодом
+        """
+        labels = self.classify(categories)
+        labels = np.where(labels < 0, len(self.labels), labels)
+        totals = np.zeros((group_count, len(self.labels) + 1), dtype=np.int64)
+        np.add.at(totals, (np.asarray(groups, dtype=np.intp), labels), np.asarray(counts, dtype=np.int64))
+        return totals
+
+    def shares(self, totals):
+        """
+        Доли меток в процентах от всех визитов группы (строки count_by_group,
+        включая неклассифицированные) с семантикой matrix.percentage
+        """
+        totals = np.asarray(totals, dtype=np.int64)
+        return percentage(totals, totals.sum(axis=1, keepdims=True))
+
+    def as_dicts(self, totals):
+        """Строки матрицы count_by_group (или shares) как словари {метка: значение} без нулей"""
+        labels = self.labels + [UNCLASSIFIED]
+        return [
+            {labels[column]: row[column].item() for column in np.flatnonzero(row)}
+            for row in totals
+        ]
+
+
+@lru_cache(maxsize=None)
+def chapter_index():
+    """Индекс классов МКБ-10 (строится один раз на процесс)"""
+    return Icd10Index(ICD10_CHAPTERS)
+
+
+@lru_cache(maxsize=None)
+def block_index():
+    """Индекс блоков МКБ-10 (строится один раз на процесс)"""
+    return Icd10Index(ICD10_BLOCKS)
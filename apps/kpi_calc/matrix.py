@@ -0,0 +1,111 @@
+#apps\kpi_calc\matrix.py
+
+"""
+Векторный расчет KPI за период.
+Факт и план хранятся плотными матрицами врач × цель визита, проценты
+считаются операциями над массивами. Семантика совпадает со скалярными
+формулами KPICalculator.calculate_percentage / KPIFormulas, которые
+остаются эталоном: при нулевом плане 0.0, иначе round(факт / план * 100, 2).
+"""
+
+import numpy as np
+
+
+def round_half_even(values, digits=2):
+    """
+    Округление массива так же, как встроенный round(x, digits).
+    np.round умножает значение на 10**digits и округляет произведение -
+    рядом с границей ...5 оно может разойтись с round, поэтому такие
+    значения (их единицы) уточняются поштучно.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    # np.round от 0-мерного массива возвращает скаляр - уточнять нужно массив
+    rounded = np.asarray(np.round(values, digits))
+
+    scaled = np.abs(values) * 10 ** digits
+    near_half = np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6
+    for index in np.flatnonzero(near_half):
+        rounded.flat[index] = round(float(values.flat[index]), digits)
+    return rounded
+
+
+def percentage(actual, plan):
+    """P = Fakt/Plan * 100% по массивам; при нулевом плане 0.0"""
+    actual = np.asarray(actual, dtype=np.float64)
+    plan = np.asarray(plan, dtype=np.float64)
+
+    ratio = np.zeros(np.broadcast_shapes(actual.shape, plan.shape))
+    np.divide(actual, plan, out=ratio, where=plan != 0)
+    return np.where(plan != 0, round_half_even(ratio * 100), 0.0)
+
+
+def validation_percentage(validated, total):
+    """V = N_val/N_total * 100% по массивам"""
+    return percentage(validated, total)
+
+
+def disease_percentage(total_visits, z_diagnosis_visits):
+    """D = (N_total - N_z)/N_total * 100% по массивам"""
+    total_visits = np.asarray(total_visits, dtype=np.int64)
+    return percentage(total_visits - np.asarray(z_diagnosis_visits, dtype=np.int64), total_visits)
+
+
+class KpiMatrix:
+    """
+    Матрицы факт/план врач × цель визита за один период.
+    rows - список пар (данные врача из aggregate_visits_data, специальность МИС),
+    purposes - цели визитов (порядок задает столбцы),
+    plans - годовые планы {(specid, код цели): KpiPlan}
+    """
+
+    def __init__(self, rows, purposes, plans):
+        self.purposes = list(purposes)
+        columns = {purpose.code: column for column, purpose in enumerate(self.purposes)}
+
+        # Факт: визиты врача по целям (отсутствующая цель - 0)
+        self.fact = np.zeros((len(rows), len(self.purposes)), dtype=np.int64)
+        for row, (data, _) in enumerate(rows):
+            for code, count in data['visits_by_purpose'].items():
+                column = columns.get(code)
+                if column is not None:
+                    self.fact[row, column] = count
+
+        # План строится один раз на специальность и раздается врачам по индексу
+        spec_index = {}
+        for _, specialization in rows:
+            spec_index.setdefault(specialization.keyidmis, len(spec_index))
+
+        spec_plan = np.zeros((len(spec_index), len(self.purposes)), dtype=np.int64)
+        spec_has_plan = np.zeros(spec_plan.shape, dtype=bool)
+        for specid, spec_row in spec_index.items():
+            for column, purpose in enumerate(self.purposes):
+                annual_plan = plans.get((specid, purpose.code))
+                if annual_plan is not None:
+                    spec_plan[spec_row, column] = annual_plan.monthly_plan()
+                    spec_has_plan[spec_row, column] = True
+
+        doctor_specs = np.array(
+            [spec_index[specialization.keyidmis] for _, specialization in rows], dtype=np.intp
+        )
+        self.plan = spec_plan[doctor_specs]
+        self.has_plan = spec_has_plan[doctor_specs]
+
+        self.total_visits = np.array([data['total_visits'] for data, _ in rows], dtype=np.int64)
+        self.validated_docs = np.array([data['validated_docs_count'] for data, _ in rows], dtype=np.int64)
+        self.total_docs = np.array([data['total_docs_count'] for data, _ in rows], dtype=np.int64)
+        self.z_diagnosis = np.array([data['visits_with_z_diagnosis'] for data, _ in rows], dtype=np.int64)
+
+    @property
+    def percentages(self):
+        """Процент выполнения месячного плана, врач × цель"""
+        return percentage(self.fact, self.plan)
+
+    @property
+    def validation_percentages(self):
+        """Процент валидированных документов по врачам"""
+        return validation_percentage(self.validated_docs, self.total_docs)
+
+    @property
+    def disease_percentages(self):
+        """Процент визитов по заболеванию (без Z-диагнозов) по врачам"""
+        return disease_percentage(self.total_visits, self.z_diagnosis)
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:35
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('integration', '0010_kpidirtypair'),
+        ('kpi_calc', '0004_alter_kpiresult_unique_together_kpiresult_doctor_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='KpiCumulative',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source_id', models.CharField(default='mis', max_length=64)),
+                ('doctorid', models.BigIntegerField()),
+                ('year', models.IntegerField()),
+                ('month', models.IntegerField()),
+                ('plan_year', models.IntegerField()),
+                ('plan_month', models.IntegerField()),
+                ('fact_month', models.IntegerField()),
+                ('plan_cumulative', models.IntegerField()),
+                ('fact_cumulative', models.IntegerField()),
+                ('percentage_month', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('percentage_cumulative', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('calculated_at', models.DateTimeField(auto_now=True)),
+                ('doctor', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='integration.misimporteddoctor')),
+                ('plan_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='integration.misimportedpurpose')),
+                ('specialization', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='integration.misimportedspecialization')),
+            ],
+            options={
+                'verbose_name': 'Нарастающий итог план-факт',
+                'verbose_name_plural': 'Нарастающий итог план-факт',
+                'indexes': [models.Index(fields=['year', 'month', 'doctor'], name='kpi_cumulative_month_idx')],
+                'unique_together': {('source_id', 'doctorid', 'specialization', 'plan_type', 'year', 'month')},
+            },
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:36
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('integration', '0010_kpidirtypair'),
+        ('kpi_calc', '0005_kpicumulative'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='KpiQualityResult',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('calculation_date', models.DateField()),
+                ('source_id', models.CharField(default='mis', max_length=64)),
+                ('doctorid', models.BigIntegerField()),
+                ('period', models.CharField(max_length=7)),
+                ('validated_docs_count', models.IntegerField()),
+                ('total_docs_count', models.IntegerField()),
+                ('validation_percentage', models.DecimalField(decimal_places=2, max_digits=5)),
+                ('total_visits', models.IntegerField()),
+                ('visits_with_z_diagnosis', models.IntegerField()),
+                ('disease_percentage', models.DecimalField(decimal_places=2, max_digits=5)),
+                ('doctor', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='integration.misimporteddoctor')),
+                ('specialization', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='integration.misimportedspecialization')),
+            ],
+            options={
+                'verbose_name': 'Показатели качества',
+                'verbose_name_plural': 'Показатели качества',
+                'unique_together': {('source_id', 'doctorid', 'period')},
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:07
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kpi_calc', '0006_kpiqualityresult'),
+    ]
+
+    operations = [
+        # Расчеты разных дней оставили по строке на каждую дату - оставляем последнюю
+        migrations.RunSQL(
+            sql="""
+                DELETE FROM kpi_calc_kpiresult r
+                USING kpi_calc_kpiresult newer
+                WHERE newer.doctor_id = r.doctor_id
+                  AND newer.specialization_id = r.specialization_id
+                  AND newer.plan_type_id = r.plan_type_id
+                  AND newer.period = r.period
+                  AND (newer.calculation_date, newer.id) > (r.calculation_date, r.id)
+            """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+        migrations.AlterUniqueTogether(
+            name='kpiresult',
+            unique_together={('doctor', 'specialization', 'plan_type', 'period')},
+        ),
+    ]
@@ -18,7 +18,8 @@ class KpiResult(models.Model):
     
     class Meta:
         app_label = 'kpi_calc'
-        unique_together = ['calculation_date', 'doctor' ,'specialization', 'plan_type', 'period']
+        # Одна строка на показатель периода: повторный расчет обновляет ее и дату расчета
+        unique_together = ['doctor', 'specialization', 'plan_type', 'period']
 
     def __str__(self):
         if self.doctor:
@@ -26,3 +27,72 @@ class KpiResult(models.Model):
         else:
             return f"{self.specialization} - {self.plan_type.text} - {self.period}"
         
+
+class KpiQualityResult(models.Model):
+    """
+    Показатели врача за период, не зависящие от плана: доля валидированных
+    документов и доля визитов по заболеванию (без Z-диагнозов).
+    Считаются тем же проходом расчета, что и KpiResult.
+    """
+    calculation_date = models.DateField()                      # Дата расчета
+    source_id = models.CharField(max_length=64, default='mis')  # Источник (алиас БД МИС)
+    doctorid = models.BigIntegerField()                         # ID врача (docdep) из МИС
+    doctor = models.ForeignKey('integration.MisImportedDoctor'
+                    , on_delete=models.CASCADE, null=True, blank=True)
+    specialization = models.ForeignKey(
+        'integration.MisImportedSpecialization'
+                    , on_delete=models.CASCADE)
+    period = models.CharField(max_length=7)                    # Год-месяц '2024-05'
+    validated_docs_count = models.IntegerField()               # Валидированные документы
+    total_docs_count = models.IntegerField()                   # Всего документов
+    validation_percentage = models.DecimalField(max_digits=5, decimal_places=2)
+    total_visits = models.IntegerField()                       # Всего визитов
+    visits_with_z_diagnosis = models.IntegerField()            # Визиты с Z-диагнозом
+    disease_percentage = models.DecimalField(max_digits=5, decimal_places=2)
+    
+    class Meta:
+        app_label = 'kpi_calc'
+        unique_together = ['source_id', 'doctorid', 'period']
+        verbose_name = 'Показатели качества'
+        verbose_name_plural = 'Показатели качества'
+
+    def __str__(self):
+        return f"{self.doctorid} - {self.period}"
+
+class KpiCumulative(models.Model):
+    """
+    Нарастающий итог план-факт с начала года по врачу, специальности и цели визита.
+    Ведется расчетом KPI (см. kpi_calc.cumulative): пересчет месяца обновляет
+    строки этого и следующих месяцев года, страницы план-факт читают готовые значения.
+    """
+    source_id = models.CharField(max_length=64, default='mis')  # Источник (алиас БД МИС)
+    doctorid = models.BigIntegerField()                         # ID врача (docdep) из МИС
+    doctor = models.ForeignKey('integration.MisImportedDoctor'
+                    , on_delete=models.CASCADE, null=True, blank=True)
+    specialization = models.ForeignKey(
+        'integration.MisImportedSpecialization'
+                    , on_delete=models.CASCADE)
+    plan_type = models.ForeignKey('integration.MisImportedPurpose'
+                    , on_delete=models.CASCADE)
+    year = models.IntegerField()
+    month = models.IntegerField()
+    plan_year = models.IntegerField()                          # План на год
+    plan_month = models.IntegerField()                         # План за месяц
+    fact_month = models.IntegerField()                         # Факт за месяц
+    plan_cumulative = models.IntegerField()                    # План нарастающим итогом
+    fact_cumulative = models.IntegerField()                    # Факт нарастающим итогом
+    percentage_month = models.DecimalField(max_digits=10, decimal_places=2)
+    percentage_cumulative = models.DecimalField(max_digits=10, decimal_places=2)
+    calculated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        app_label = 'kpi_calc'
+        unique_together = ['source_id', 'doctorid', 'specialization', 'plan_type', 'year', 'month']
+        indexes = [
+            models.Index(fields=['year', 'month', 'doctor'], name='kpi_cumulative_month_idx'),
+        ]
+        verbose_name = 'Нарастающий итог план-факт'
+        verbose_name_plural = 'Нарастающий итог план-факт'
+
+    def __str__(self):
+        return f"{self.doctorid} - {self.plan_type_id} - {self.year}-{self.month:02d}"
@@ -0,0 +1,639 @@
+#apps\kpi_calc\tests.py
+
+"""
+Сверка векторного расчета (matrix.KpiMatrix) со скалярными формулами
+KPICalculator.calculate_percentage / KPIFormulas на фиксированных данных
+и проверка индексов классов и блоков МКБ-10 - без БД: справочники и планы -
+несохраненные объекты моделей.
+Расчет и выборки по сохраненным результатам проверяются на тестовой БД (TestCase).
+"""
+
+from datetime import date, datetime, timezone as dt_timezone
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from integration.dirty_pairs import clear_pairs, mark_dirty, pending_pairs
+from integration.models import (MisImportedDoctor, MisImportedPurpose, MisImportedSpecialization,
+                                MisImportedVisit, VisitAggregate)
+from plans.models import KpiPlan
+from .calculators import (KPICalculator, build_periods, calculate_period, run_incremental_calculation,
+                          run_kpi_calculation, verify_period)
+from .cumulative import update_cumulative
+from .formulas import KPIFormulas
+from .icd10 import ICD10_BLOCKS, UNCLASSIFIED, Icd10Index, block_index, chapter_index
+from .matrix import KpiMatrix, percentage
+from .models import KpiCumulative, KpiQualityResult, KpiResult
+from .views import PLAN_FACT_COLUMNS, compare_plan_fact, get_plan_fact_rows, get_quality_results
+
+# (факт, план): обычные значения, нулевой план и границы округления ...5
+CASES = [
+    (10, 20),
+    (1, 3),
+    (2, 3),
+    (0, 7),
+    (5, 0),
+    (0, 0),
+    (107, 4000),    # 2.675: в float чуть меньше 2.675, round дает 2.67
+    (201, 20000),   # 1.005
+    (1, 32),        # 3.125 - точная половина, округление к четному
+    (1001, 8000),   # 12.5125
+]
+
+
+def visits(by_purpose, validated=0, z_diagnosis=0):
+    """Данные врача в формате aggregate_visits_data"""
+    total = sum(by_purpose.values())
+    return {
+        'visits_by_purpose': by_purpose,
+        'total_visits': total,
+        'validated_docs_count': validated,
+        'total_docs_count': total,
+        'visits_with_z_diagnosis': z_diagnosis,
+    }
+
+
+class PercentageTests(SimpleTestCase):
+    def setUp(self):
+        self.calculator = KPICalculator('2025-01')
+
+    def test_matches_calculator(self):
+        actual = [fact for fact, _ in CASES]
+        plan = [plan for _, plan in CASES]
+        for (fact, plan_value), value in zip(CASES, percentage(actual, plan)):
+            with self.subTest(fact=fact, plan=plan_value):
+                self.assertEqual(float(value), self.calculator.calculate_percentage(fact, plan_value))
+
+    def test_matches_formulas(self):
+        for fact, plan_value in CASES:
+            with self.subTest(fact=fact, plan=plan_value):
+                expected = round(KPIFormulas.calculate_percentage(fact, plan_value), 2)
+                self.assertEqual(float(percentage(fact, plan_value)), expected)
+
+    def test_zero_plan(self):
+        self.assertEqual(float(percentage(5, 0)), 0.0)
+        self.assertEqual(self.calculator.calculate_percentage(5, 0), 0.0)
+        self.assertEqual(KPIFormulas.calculate_percentage(5, 0), 0)
+
+
+class KpiMatrixTests(SimpleTestCase):
+    def setUp(self):
+        self.calculator = KPICalculator('2025-01')
+        self.therapist = MisImportedSpecialization(keyidmis=1, tag=0, code=1, text='Терапевт')
+        self.surgeon = MisImportedSpecialization(keyidmis=2, tag=0, code=2, text='Хирург')
+        self.purposes = [
+            MisImportedPurpose(keyidmis=10, tag=0, code=1, text='Заболевание'),
+            MisImportedPurpose(keyidmis=20, tag=0, code=2, text='Профилактика'),
+            MisImportedPurpose(keyidmis=30, tag=0, code=3, text='Диспансеризация'),
+        ]
+        # Месячный план - floor(годовой / 12); цели 3 плана нет ни у кого
+        self.plans = {
+            (1, 1): KpiPlan(specid=1, plan_vistype=1, plan_value=48000, year=2025),  # 4000 в месяц
+            (1, 2): KpiPlan(specid=1, plan_vistype=2, plan_value=11, year=2025),     # 0 в месяц
+            (2, 1): KpiPlan(specid=2, plan_vistype=1, plan_value=384, year=2025),    # 32 в месяц
+        }
+        self.rows = [
+            (visits({1: 107, 2: 5, 3: 9}, validated=107, z_diagnosis=4), self.therapist),
+            (visits({1: 1}, validated=0), self.surgeon),
+            (visits({}), self.therapist),
+        ]
+        self.matrix = KpiMatrix(self.rows, self.purposes, self.plans)
+
+    def test_percentages_match_calculator(self):
+        percentages = self.matrix.percentages
+        for row, (data, specialization) in enumerate(self.rows):
+            for column, purpose in enumerate(self.purposes):
+                annual_plan = self.plans.get((specialization.keyidmis, purpose.code))
+                if annual_plan is None:
+                    continue
+                fact = data['visits_by_purpose'].get(purpose.code, 0)
+                with self.subTest(row=row, purpose=purpose.code):
+                    self.assertEqual(
+                        float(percentages[row, column]),
+                        self.calculator.calculate_percentage(fact, annual_plan.monthly_plan()),
+                    )
+
+    def test_rounding_tie(self):
+        self.assertEqual(float(self.matrix.percentages[0, 0]), 2.67)
+        self.assertEqual(float(self.matrix.percentages[1, 0]), 3.12)
+
+    def test_zero_plan(self):
+        # План есть, но месячный план нулевой: результат пишется с 0%
+        self.assertTrue(self.matrix.has_plan[0, 1])
+        self.assertEqual(int(self.matrix.plan[0, 1]), 0)
+        self.assertEqual(float(self.matrix.percentages[0, 1]), 0.0)
+
+    def test_missing_plan(self):
+        # Плана нет: результат не пишется, факт при этом учтен
+        self.assertFalse(self.matrix.has_plan[0, 2])
+        self.assertFalse(self.matrix.has_plan[1, 1])
+        self.assertEqual(int(self.matrix.fact[0, 2]), 9)
+        self.assertEqual(float(self.matrix.percentages[0, 2]), 0.0)
+
+    def test_quality_percentages_match_calculator(self):
+        validation = self.matrix.validation_percentages
+        disease = self.matrix.disease_percentages
+        for row, (data, _) in enumerate(self.rows):
+            with self.subTest(row=row):
+                self.assertEqual(
+                    float(validation[row]),
+                    self.calculator.calculate_validation_percentage(
+                        data['validated_docs_count'], data['total_docs_count']
+                    ),
+                )
+                self.assertEqual(
+                    float(disease[row]),
+                    self.calculator.calculate_disease_percentage(
+                        data['total_visits'], data['visits_with_z_diagnosis']
+                    ),
+                )
+
+
+class Icd10IndexTests(SimpleTestCase):
+    def test_blocks_inside_chapters(self):
+        chapters = chapter_index()
+        for start, end, block in ICD10_BLOCKS:
+            with self.subTest(block=block):
+                first, last = chapters.classify([start, end])
+                self.assertGreaterEqual(first, 0)
+                self.assertEqual(first, last)
+
+    def test_classify(self):
+        index = block_index()
+        labels = index.classify(['J45', 'z00', 'Z14', 'T79', 'b99', '', None, '1AB'])
+        self.assertEqual(
+            [index.labels[label] if label >= 0 else UNCLASSIFIED for label in labels],
+            ['J40-J47', 'Z00-Z13', UNCLASSIFIED, 'T79', 'B99', UNCLASSIFIED, UNCLASSIFIED, UNCLASSIFIED],
+        )
+
+    def test_overlapping_ranges(self):
+        with self.assertRaises(ValueError):
+            Icd10Index([('A00', 'A09', 'a'), ('A05', 'A19', 'b')])
+
+    def test_shares_from_counts(self):
+        index = block_index()
+        totals = index.count_by_group([0, 0, 1, 1], ['J45', 'Z00', 'Z00', ''], [3, 1, 1, 2], 2)
+        self.assertEqual(
+            index.as_dicts(totals),
+            [{'J40-J47': 3, 'Z00-Z13': 1}, {'Z00-Z13': 1, UNCLASSIFIED: 2}],
+        )
+        self.assertEqual(
+            index.as_dicts(index.shares(totals)),
+            [{'J40-J47': 75.0, 'Z00-Z13': 25.0}, {'Z00-Z13': 33.33, UNCLASSIFIED: 66.67}],
+        )
+
+
+class KpiDataTestCase(TestCase):
+    """
+    Справочники в тестовой БД: специальность 9001 (терапевт), цели 1 и 2,
+    врачи docdep 101 (man 11) и 102 (man 12) источника mis
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.therapist = MisImportedSpecialization.objects.create(keyidmis=9001, tag=9, code=27, text='Терапевт')
+        cls.disease = MisImportedPurpose.objects.create(keyidmis=1001, tag=20, code=1, text='Заболевание')
+        cls.prevention = MisImportedPurpose.objects.create(keyidmis=1002, tag=20, code=2, text='Профилактика')
+        cls.doctor = cls.add_doctor('mis', 101, 11, 'Иванов И.И.')
+        cls.other_doctor = cls.add_doctor('mis', 102, 12, 'Петров П.П.')
+
+    @classmethod
+    def add_doctor(cls, source_id, keyiddocdep, manidmis, name):
+        return MisImportedDoctor.objects.create(
+            source_id=source_id, keyiddocdep=keyiddocdep, specidmis=9001, specnamemis='Терапевт',
+            docnamemis=name, depidmis=1, depnamemis='Терапия', manidmis=manidmis,
+        )
+
+    def add_cumulative(self, doctor, purpose, fact_month, year=2025, month=1):
+        return KpiCumulative.objects.create(
+            source_id=doctor.source_id, doctorid=doctor.keyiddocdep, doctor=doctor,
+            specialization=self.therapist, plan_type=purpose, year=year, month=month,
+            plan_year=120, plan_month=10, fact_month=fact_month,
+            plan_cumulative=10 * month, fact_cumulative=fact_month,
+            percentage_month=Decimal(fact_month * 10), percentage_cumulative=Decimal(fact_month * 10 / month),
+        )
+
+    def add_visit(self, keyidmis, doctor, vistype=1, diag_code='J45', day=10, month=1, casetypeid=3746):
+        return MisImportedVisit.objects.create(
+            source_id=doctor.source_id, keyidmis=keyidmis, num=keyidmis, casetypeid=casetypeid,
+            dat=datetime(2025, month, day, 10, tzinfo=dt_timezone.utc), vistype=vistype,
+            doctorid=doctor.keyiddocdep, doctorname=doctor.docnamemis, depid=1, depname='Терапия',
+            diag_code=diag_code, diag_text='Диагноз', manid=doctor.manidmis,
+        )
+
+    def add_quality(self, doctor, period='2025-01'):
+        return KpiQualityResult.objects.create(
+            calculation_date='2025-02-01', source_id=doctor.source_id, doctorid=doctor.keyiddocdep,
+            doctor=doctor, specialization=self.therapist, period=period,
+            validated_docs_count=1, total_docs_count=2, validation_percentage=Decimal('50'),
+            total_visits=2, visits_with_z_diagnosis=0, disease_percentage=Decimal('100'),
+        )
+
+
+class ManSourceTests(KpiDataTestCase):
+    """ID пользователя МИС уникален только в пределах источника"""
+
+    def setUp(self):
+        # В другой МИС те же docdep 101 и man 12, что у врачей mis, - другой врач
+        self.clinic_doctor = self.add_doctor('mis_clinic1', 101, 12, 'Сидоров С.С.')
+        for doctor in (self.doctor, self.other_doctor, self.clinic_doctor):
+            self.add_cumulative(doctor, self.disease, 5)
+            self.add_quality(doctor)
+
+    def test_rows_of_one_source(self):
+        self.clinic_doctor.manidmis = 13
+        self.clinic_doctor.save()
+
+        rows = get_plan_fact_rows(2025, 1, man_id=11)
+        self.assertEqual([row['Врач'] for row in rows], ['Иванов И.И.'])
+        self.assertEqual(
+            [(result.source_id, result.doctorid) for result in get_quality_results(2025, 1, man_id=13)],
+            [('mis_clinic1', 101)],
+        )
+
+    def test_ambiguous_man_id(self):
+        with self.assertRaises(ValueError):
+            get_plan_fact_rows(2025, 1, man_id=12)
+        self.assertEqual(get_quality_results(2025, 1, man_id=12), [])
+
+    def test_unknown_man_id(self):
+        self.assertEqual(get_plan_fact_rows(2025, 1, man_id=99), [])
+        self.assertEqual(len(get_plan_fact_rows(2025, 1)), 3)
+
+
+class AggregationTests(KpiDataTestCase):
+    """Агрегация визитов периода одним сгруппированным запросом"""
+
+    def setUp(self):
+        self.add_visit(1, self.doctor)
+        self.add_visit(2, self.doctor, diag_code='z00', casetypeid=None)
+        self.add_visit(3, self.doctor, vistype=2, diag_code='Z00.1')
+        self.add_visit(4, self.other_doctor, diag_code='')
+        self.add_visit(5, self.doctor, month=2)
+
+    def test_doctors_data(self):
+        data = KPICalculator('2025-01').aggregate_visits_data()
+        self.assertEqual(set(data), {('mis', 101), ('mis', 102)})
+
+        doctor = data[('mis', 101)]
+        self.assertEqual(doctor['total_visits'], 3)
+        self.assertEqual(doctor['visits_by_purpose'], {1: 2, 2: 1})
+        self.assertEqual(doctor['total_docs_count'], 3)
+        self.assertEqual(doctor['validated_docs_count'], 2)
+        self.assertEqual(doctor['visits_with_z_diagnosis'], 2)
+        self.assertEqual(doctor['visits_by_block'], {'J40-J47': 1, 'Z00-Z13': 2})
+        self.assertEqual(doctor['doctor_name'], 'Иванов И.И.')
+
+        # Визит без диагноза не валидирован и не классифицирован
+        other = data[('mis', 102)]
+        self.assertEqual((other['total_visits'], other['validated_docs_count']), (1, 0))
+        self.assertEqual(other['visits_by_block'], {UNCLASSIFIED: 1})
+
+    def test_doctors_filter(self):
+        data = KPICalculator('2025-01', doctors={('mis', 102)}).aggregate_visits_data()
+        self.assertEqual(list(data), [('mis', 102)])
+
+
+class ReferenceTests(KpiDataTestCase):
+    """Справочники загружаются один раз за расчет: число запросов не зависит от числа врачей"""
+
+    def setUp(self):
+        KpiPlan.objects.create(specid=9001, plan_vistype=1, plan_value=120, year=2025)
+        KpiPlan.objects.create(specid=9001, plan_vistype=2, plan_value=24, year=2025)
+        self.add_visit(1, self.doctor)
+        self.add_visit(2, self.other_doctor, vistype=2)
+
+    def count_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            KPICalculator('2025-01').compute_kpi()
+        return len(queries)
+
+    def test_query_count_independent_of_doctors(self):
+        queries = self.count_queries()
+        for number in range(3):
+            doctor = self.add_doctor('mis', 200 + number, 20 + number, f'Врач {number}')
+            self.add_visit(10 + number, doctor)
+            self.add_visit(20 + number, doctor, vistype=2)
+        self.assertEqual(self.count_queries(), queries)
+
+    def test_doctor_by_source(self):
+        clinic_doctor = self.add_doctor('mis_clinic1', 101, 11, 'Сидоров С.С.')
+
+        calculator = KPICalculator('2025-01')
+        self.assertEqual(calculator.get_doctor(101), self.doctor)
+        self.assertEqual(calculator.get_doctor(101, 'mis_clinic1'), clinic_doctor)
+        self.assertIsNone(calculator.get_doctor(101, 'mis_clinic2'))
+        self.assertEqual(calculator.get_specialization_for_doctor(102, 1), self.therapist)
+
+
+class BulkSaveTests(KpiDataTestCase):
+    """Пакетный upsert агрегатов и результатов: повторный расчет обновляет строки на месте"""
+
+    def setUp(self):
+        KpiPlan.objects.create(specid=9001, plan_vistype=1, plan_value=120, year=2025)
+        KpiPlan.objects.create(specid=9001, plan_vistype=2, plan_value=24, year=2025)
+        self.add_visit(1, self.doctor)
+        self.add_visit(2, self.doctor, vistype=2)
+        self.add_visit(3, self.other_doctor)
+
+    def stored(self):
+        return (
+            sorted(VisitAggregate.objects.values_list('pk', 'source_id', 'doctor_id', 'total_visits')),
+            sorted(KpiResult.objects.values_list('pk', 'doctor_id', 'plan_type_id', 'actual_value')),
+            sorted(KpiQualityResult.objects.values_list('pk', 'source_id', 'doctorid', 'total_visits')),
+        )
+
+    def test_repeated_run(self):
+        run_kpi_calculation('2025-01', batch_size=1, cumulative=False)
+        first = self.stored()
+        self.assertEqual([len(rows) for rows in first], [2, 4, 2])
+
+        run_kpi_calculation('2025-01', cumulative=False)
+        self.assertEqual(self.stored(), first)
+
+    def test_update_in_place(self):
+        run_kpi_calculation('2025-01', cumulative=False)
+        result = KpiResult.objects.get(doctor=self.other_doctor, plan_type=self.disease)
+
+        self.add_visit(4, self.other_doctor)
+        run_kpi_calculation('2025-01', batch_size=1, cumulative=False)
+        updated = KpiResult.objects.get(doctor=self.other_doctor, plan_type=self.disease)
+        self.assertEqual((updated.pk, updated.actual_value), (result.pk, 2))
+        self.assertEqual(VisitAggregate.objects.get(doctor_id=102).total_visits, 2)
+
+    def test_stale_rows_deleted(self):
+        run_kpi_calculation('2025-01', cumulative=False)
+        MisImportedVisit.objects.filter(doctorid=102).delete()
+
+        run_kpi_calculation('2025-01', cumulative=False)
+        self.assertFalse(VisitAggregate.objects.filter(doctor_id=102).exists())
+        self.assertFalse(KpiResult.objects.filter(doctor=self.other_doctor).exists())
+        self.assertFalse(KpiQualityResult.objects.filter(doctorid=102).exists())
+        self.assertEqual(KpiResult.objects.filter(doctor=self.doctor).count(), 2)
+
+
+class PeriodRangeTests(KpiDataTestCase):
+    """Расчет диапазона периодов: периоды пула считаются независимо, ошибка одного не прерывает остальные"""
+
+    def setUp(self):
+        KpiPlan.objects.create(specid=9001, plan_vistype=1, plan_value=120, year=2025)
+        self.add_visit(1, self.doctor)
+        self.add_visit(2, self.doctor, month=2)
+        self.add_visit(3, self.other_doctor, month=2)
+
+    def test_build_periods(self):
+        self.assertEqual(build_periods('2024-11', '2025-02'), ['2024-11', '2024-12', '2025-01', '2025-02'])
+        self.assertEqual(build_periods('2025-03', '2025-03'), ['2025-03'])
+        self.assertEqual(build_periods('2025-03', '2025-02'), [])
+
+    # Процесс пула закрывает свои соединения - в тесте соединение одно на все периоды
+    @mock.patch('kpi_calc.calculators.connections')
+    def test_calculate_periods(self, connections):
+        summary = [calculate_period(period) for period in build_periods('2025-01', '2025-03')]
+        self.assertEqual(
+            [(result['period'], result['results'], result['error']) for result in summary],
+            [('2025-01', 1, ''), ('2025-02', 2, ''), ('2025-03', 0, '')],
+        )
+        self.assertEqual(connections.close_all.call_count, 3)
+        self.assertEqual(
+            sorted(KpiResult.objects.values_list('period', 'doctor_id', 'actual_value')),
+            [('2025-01', self.doctor.pk, 1), ('2025-02', self.doctor.pk, 1), ('2025-02', self.other_doctor.pk, 1)],
+        )
+        # Нарастающий итог пересчитывает вызывающий после всех периодов
+        self.assertFalse(KpiCumulative.objects.exists())
+
+    @mock.patch('kpi_calc.calculators.connections')
+    @mock.patch('kpi_calc.calculators.run_kpi_calculation', side_effect=RuntimeError('нет связи с БД'))
+    def test_period_error(self, run_kpi_calculation, connections):
+        result = calculate_period('2025-01')
+        self.assertEqual((result['period'], result['results'], result['error']), ('2025-01', 0, 'нет связи с БД'))
+        connections.close_all.assert_called_once_with()
+
+    def test_invalid_range(self):
+        with self.assertRaises(CommandError):
+            call_command('calculate_kpi', '--from', '2025-03', '--to', '2025-01')
+        with self.assertRaises(CommandError):
+            call_command('calculate_kpi', '--from', '2025-13', '--to', '2025-12')
+
+
+class CumulativeTests(KpiDataTestCase):
+    """Нарастающий итог с начала года по агрегатам месяцев"""
+
+    def setUp(self):
+        KpiPlan.objects.create(specid=9001, plan_vistype=1, plan_value=120, year=2025)
+        self.add_visit(1, self.doctor)
+        self.add_visit(2, self.doctor, day=11)
+        self.add_visit(3, self.doctor, month=2)
+        self.add_visit(4, self.other_doctor, month=3)
+        for period in build_periods('2025-01', '2025-03'):
+            run_kpi_calculation(period, cumulative=False)
+
+    def cumulative(self):
+        return {
+            (row.doctorid, row.month): (row.fact_month, row.fact_cumulative, row.plan_cumulative)
+            for row in KpiCumulative.objects.filter(year=2025, plan_type=self.disease)
+        }
+
+    def test_rebuild_without_base_month(self):
+        # Строк января нет: итог с февраля пересобирается с первого месяца с агрегатами
+        self.assertEqual(update_cumulative(2025, 2), 4)
+        self.assertEqual(self.cumulative(), {
+            (101, 1): (2, 2, 10),
+            (101, 2): (1, 3, 20),
+            (101, 3): (0, 3, 30),
+            (102, 3): (1, 1, 30),
+        })
+        self.assertFalse(KpiCumulative.objects.filter(plan_type=self.prevention).exists())
+
+    def test_month_recalculation(self):
+        update_cumulative(2025)
+        self.add_visit(5, self.doctor, day=20, month=2)
+
+        run_kpi_calculation('2025-02')
+        self.assertEqual(self.cumulative(), {
+            (101, 1): (2, 2, 10),
+            (101, 2): (2, 4, 20),
+            (101, 3): (0, 4, 30),
+            (102, 3): (1, 1, 30),
+        })
+        row = KpiCumulative.objects.get(doctorid=101, month=3)
+        self.assertEqual((row.percentage_month, row.percentage_cumulative), (Decimal('0'), Decimal('13.33')))
+
+
+class QualityResultTests(KpiDataTestCase):
+    """Доля валидированных документов и доля визитов по заболеванию - в том же проходе, что и KPI"""
+
+    def setUp(self):
+        self.add_visit(1, self.doctor)
+        self.add_visit(2, self.doctor, diag_code='z00', casetypeid=None)
+        self.add_visit(3, self.doctor, vistype=2, diag_code='Z00')
+        self.add_visit(4, self.other_doctor)
+
+    def test_saved_without_plans(self):
+        with CaptureQueriesContext(connection) as queries:
+            run_kpi_calculation('2025-01', cumulative=False)
+        visit_scans = [query for query in queries if 'import_visit' in query['sql']]
+        self.assertEqual(len(visit_scans), 1)
+
+        # Планов нет: результатов KPI нет, показатели качества записаны
+        self.assertFalse(KpiResult.objects.exists())
+        quality = {
+            result.doctorid: result for result in get_quality_results(2025, 1)
+        }
+        self.assertEqual(set(quality), {101, 102})
+        result = quality[101]
+        self.assertEqual(result.doctor, self.doctor)
+        self.assertEqual(result.specialization, self.therapist)
+        self.assertEqual((result.validated_docs_count, result.total_docs_count), (2, 3))
+        self.assertEqual((result.total_visits, result.visits_with_z_diagnosis), (3, 2))
+        self.assertEqual(result.validation_percentage, Decimal('66.67'))
+        self.assertEqual(result.disease_percentage, Decimal('33.33'))
+        self.assertEqual(
+            (quality[102].validation_percentage, quality[102].disease_percentage),
+            (Decimal('100.00'), Decimal('100.00')),
+        )
+
+
+# Процедуры нет в репозитории: в тестовой БД - эталон по ее описанию,
+# считающий план-факт прямо по визитам, планам и справочникам
+PLAN_FACT_PROCEDURE_SQL = """
+CREATE FUNCTION kpi.get_monthly_plan_fact_comparison(
+    p_year integer, p_month integer, p_man_id bigint, p_specid bigint, p_vistype integer
+)
+RETURNS TABLE(
+    "Год" integer, "Месяц" integer, "Врач" text, "Специальность" text, "Тип_посещения" text,
+    "План_на_год" integer, "План_нарастающий_итог" integer, "Факт_нарастающий_итог" bigint,
+    "Процент_нарастающий_итог" numeric, "План_за_месяц" integer, "Факт_за_месяц" bigint,
+    "Процент_за_месяц" numeric
+) LANGUAGE sql AS $$
+    WITH visits AS (
+        SELECT source_id, doctorid, vistype, extract(month FROM dat)::integer AS month
+        FROM solution_med.import_visit
+        WHERE extract(year FROM dat) = p_year AND extract(month FROM dat) <= p_month
+    ), rows AS (
+        SELECT d.docnamemis, s.text AS spec, t.text AS purpose, p.plan_value,
+               p.plan_value / 12 AS plan_month,
+               count(*) FILTER (WHERE v.vistype = t.code) AS fact_cumulative,
+               count(*) FILTER (WHERE v.vistype = t.code AND v.month = p_month) AS fact_month
+        FROM visits v
+        JOIN solution_med.import_doctor d ON d.source_id = v.source_id AND d.keyiddocdep = v.doctorid
+        JOIN kpi.specialities s ON s.keyidmis = d.specidmis
+        JOIN kpi.plans p ON p.specid = s.keyidmis AND p.year = p_year
+        JOIN kpi.purposes t ON t.code = p.plan_vistype
+        WHERE (p_man_id IS NULL OR d.manidmis = p_man_id)
+          AND (p_specid IS NULL OR s.keyidmis = p_specid)
+          AND (p_vistype IS NULL OR t.code = p_vistype)
+        GROUP BY d.source_id, d.keyiddocdep, d.docnamemis, s.text, t.text, t.code, p.plan_value
+    )
+    SELECT p_year, p_month, docnamemis::text, spec::text, purpose::text, plan_value,
+           plan_month * p_month, fact_cumulative,
+           CASE WHEN plan_month = 0 THEN 0 ELSE round(fact_cumulative * 100.0 / (plan_month * p_month), 2) END,
+           plan_month, fact_month,
+           CASE WHEN plan_month = 0 THEN 0 ELSE round(fact_month * 100.0 / plan_month, 2) END
+    FROM rows
+$$
+"""
+
+
+class PlanFactComparisonTests(KpiDataTestCase):
+    """Строки план-факт из KpiCumulative совпадают с процедурой kpi.get_monthly_plan_fact_comparison"""
+
+    def setUp(self):
+        with connection.cursor() as cursor:
+            cursor.execute(PLAN_FACT_PROCEDURE_SQL)
+        KpiPlan.objects.create(specid=9001, plan_vistype=1, plan_value=120, year=2025)
+        KpiPlan.objects.create(specid=9001, plan_vistype=2, plan_value=36, year=2025)
+        self.add_visit(1, self.doctor)
+        self.add_visit(2, self.doctor, vistype=2)
+        self.add_visit(3, self.doctor, month=2)
+        self.add_visit(4, self.doctor, day=11, month=2)
+        self.add_visit(5, self.other_doctor, month=2)
+        run_kpi_calculation('2025-01')
+        run_kpi_calculation('2025-02')
+
+    def test_rows(self):
+        rows = get_plan_fact_rows(2025, 2, man_id=11, plan_vistype=1)
+        self.assertEqual(rows, [dict(zip(PLAN_FACT_COLUMNS, [
+            2025, 2, 'Иванов И.И.', 'Терапевт', 'Заболевание',
+            120, 20, 3, Decimal('15.00'), 10, 2, Decimal('20.00'),
+        ]))])
+
+    def test_matches_procedure(self):
+        for month in (1, 2):
+            with self.subTest(month=month):
+                self.assertEqual(compare_plan_fact(2025, month), [])
+        self.assertEqual(compare_plan_fact(2025, 2, man_id=12, plan_vistype=2), [])
+        call_command('compare_plan_fact', '--year', '2025', '--month', '2', stdout=StringIO())
+
+    def test_mismatch_reported(self):
+        KpiCumulative.objects.filter(doctorid=102, month=2, plan_type=self.disease).update(fact_cumulative=5)
+        self.assertEqual(len(compare_plan_fact(2025, 2)), 1)
+        with self.assertRaises(CommandError):
+            call_command('compare_plan_fact', '--year', '2025', '--month', '2', stdout=StringIO())
+
+
+class IncrementalRunTests(KpiDataTestCase):
+    """Инкрементальный расчет в другой день обновляет строки полного расчета, а не дописывает новые"""
+
+    def setUp(self):
+        KpiPlan.objects.create(specid=9001, plan_vistype=1, plan_value=120, year=2025)
+        KpiPlan.objects.create(specid=9001, plan_vistype=2, plan_value=24, year=2025)
+        self.add_visit(1, self.doctor)
+        self.add_visit(2, self.doctor, diag_code='Z00')
+        self.add_visit(3, self.doctor, vistype=2, diag_code='Z00')
+        self.add_visit(4, self.other_doctor)
+
+    def results(self):
+        return sorted(KpiResult.objects.values_list(
+            'doctor_id', 'plan_type_id', 'period', 'actual_value', 'plan_value', 'percentage'
+        ))
+
+    def test_incremental_matches_full(self):
+        run_kpi_calculation('2025-01', cumulative=False)
+        # Полный расчет был в прошлом месяце
+        KpiResult.objects.update(calculation_date=date(2025, 2, 1))
+
+        self.add_visit(5, self.doctor, day=20)
+        mark_dirty([('mis', 101, '2025-01')])
+        self.assertEqual(run_incremental_calculation(), {'2025-01': 2})
+
+        incremental = self.results()
+        self.assertEqual(len(incremental), 4)
+        self.assertEqual(verify_period('2025-01'), [])
+        self.assertEqual(
+            KpiResult.objects.get(doctor=self.doctor, plan_type=self.disease).calculation_date,
+            timezone.now().date(),
+        )
+
+        run_kpi_calculation('2025-01', cumulative=False)
+        self.assertEqual(self.results(), incremental)
+
+    def test_mark_during_calculation_kept(self):
+        mark_dirty([('mis', 101, '2025-01'), ('mis', 102, '2025-01')])
+        compute_kpi = KPICalculator.compute_kpi
+
+        def compute_and_import(calculator):
+            # Импорт изменил визит врача 101, пока идет расчет
+            mark_dirty([('mis', 101, '2025-01')])
+            return compute_kpi(calculator)
+
+        with mock.patch.object(KPICalculator, 'compute_kpi', compute_and_import):
+            run_incremental_calculation()
+        self.assertEqual(list(pending_pairs()['2025-01']), [('mis', 101)])
+
+        run_incremental_calculation()
+        self.assertEqual(pending_pairs(), {})
+
+    def test_clear_read_marks_only(self):
+        mark_dirty([('mis', 101, '2025-01'), ('mis', 102, '2025-01')])
+        marks = pending_pairs('2025-01')['2025-01']
+        mark_dirty([('mis', 101, '2025-01')])
+
+        self.assertEqual(clear_pairs(marks), 1)
+        self.assertEqual(list(pending_pairs()['2025-01']), [('mis', 101)])
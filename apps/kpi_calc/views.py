@@ -4,13 +4,141 @@ from django.shortcuts import render
 from django.contrib.auth.decorators import login_required
 from django.db import connection
 from datetime import datetime
+from decimal import Decimal
 from integration.models import MisImportedDoctor, MisImportedSpecialization, MisImportedPurpose, MisImportedMan
-from kpi_calc.models import KpiResult
+from kpi_calc.models import KpiResult, KpiQualityResult, KpiCumulative
 from apps.core.db_utils import get_months_from_db, get_month_name
 
+# Колонки сравнения план-факт (те же, что у процедуры kpi.get_monthly_plan_fact_comparison)
+PLAN_FACT_COLUMNS = [
+    'Год', 'Месяц', 'Врач', 'Специальность', 'Тип_посещения',
+    'План_на_год', 'План_нарастающий_итог', 'Факт_нарастающий_итог',
+    'Процент_нарастающий_итог', 'План_за_месяц', 'Факт_за_месяц', 'Процент_за_месяц'
+]
+# Сверяемые с процедурой значения: планы, факты и проценты
+PLAN_FACT_VALUES = PLAN_FACT_COLUMNS[5:]
+
+def resolve_man_source(man_id):
+    """
+    Источник (source_id) врача по ID пользователя МИС.
+    manidmis уникален только в пределах своей МИС: если ID есть у врачей
+    нескольких источников, чьи это строки - неизвестно, и показывать их нельзя.
+    Возвращает source_id или None, если врача с таким ID нет;
+    при нескольких источниках - ValueError
+    """
+    sources = sorted(set(
+        MisImportedDoctor.objects.filter(manidmis=man_id).values_list('source_id', flat=True)
+    ))
+    if len(sources) > 1:
+        raise ValueError(
+            f"ID пользователя МИС {man_id} есть у врачей нескольких источников "
+            f"({', '.join(sources)}) - данные не показаны"
+        )
+    return sources[0] if sources else None
+
+def filter_by_man(queryset, man_id):
+    """Строки врача (source_id, manidmis) - см. resolve_man_source"""
+    source_id = resolve_man_source(man_id)
+    if source_id is None:
+        return queryset.none()
+    return queryset.filter(source_id=source_id, doctor__manidmis=man_id)
+
+def get_plan_fact_rows(year, month, man_id=None, specid=None, plan_vistype=None):
+    """
+    Сравнение план-факт за месяц - готовые строки KpiCumulative (см. kpi_calc.cumulative)
+    вместо пересчета процедурой БД при каждом просмотре.
+    man_id - ID пользователя врача в МИС, specid - ID специальности в МИС, plan_vistype - код цели.
+    Возвращает список словарей с ключами PLAN_FACT_COLUMNS;
+    ValueError, если man_id неоднозначен (см. resolve_man_source)
+    """
+    rows = KpiCumulative.objects.filter(year=year, month=month).select_related(
+        'doctor', 'specialization', 'plan_type'
+    )
+    if man_id is not None:
+        rows = filter_by_man(rows, man_id)
+    if specid is not None:
+        rows = rows.filter(specialization__keyidmis=specid)
+    if plan_vistype is not None:
+        rows = rows.filter(plan_type__code=plan_vistype)
+
+    data = []
+    for row in rows.order_by('doctor__docnamemis', 'doctorid', 'specialization__text', 'plan_type__text'):
+        values = [
+            row.year, row.month,
+            row.doctor.docnamemis if row.doctor else f"Врач {row.doctorid}",
+            row.specialization.text, row.plan_type.text,
+            row.plan_year, row.plan_cumulative, row.fact_cumulative,
+            row.percentage_cumulative, row.plan_month, row.fact_month, row.percentage_month,
+        ]
+        data.append(dict(zip(PLAN_FACT_COLUMNS, values)))
+    return data
+
+def get_procedure_plan_fact_rows(year, month, man_id=None, specid=None, plan_vistype=None):
+    """Строки процедуры kpi.get_monthly_plan_fact_comparison - для сверки с get_plan_fact_rows"""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT * FROM kpi.get_monthly_plan_fact_comparison(%s, %s, %s, %s, %s)",
+            [year, month, man_id, specid, plan_vistype],
+        )
+        columns = [col[0] for col in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+def compare_plan_fact(year, month, man_id=None, specid=None, plan_vistype=None):
+    """
+    Сверяет строки get_plan_fact_rows (KpiCumulative) с процедурой
+    kpi.get_monthly_plan_fact_comparison по планам, фактам и процентам.
+    Строки сопоставляются по (врач, специальность, цель).
+    Возвращает список расхождений (пустой - данные совпадают)
+    """
+    def by_key(rows):
+        grouped = {}
+        for row in rows:
+            key = (row['Врач'], row['Специальность'], row['Тип_посещения'])
+            # Целые и numeric процедуры сравниваются с Decimal KpiCumulative в одном виде
+            values = tuple(
+                None if row[column] is None else Decimal(str(row[column])).quantize(Decimal('0.01'))
+                for column in PLAN_FACT_VALUES
+            )
+            grouped.setdefault(key, []).append(values)
+        return {key: sorted(values) for key, values in grouped.items()}
+
+    expected = by_key(get_procedure_plan_fact_rows(year, month, man_id, specid, plan_vistype))
+    actual = by_key(get_plan_fact_rows(year, month, man_id, specid, plan_vistype))
+
+    mismatches = []
+    for key in sorted(set(expected) | set(actual), key=str):
+        name = ' / '.join(str(part) for part in key)
+        if key not in actual:
+            mismatches.append(f"{name}: нет в KpiCumulative")
+        elif key not in expected:
+            mismatches.append(f"{name}: нет в процедуре")
+        elif actual[key] != expected[key]:
+            mismatches.append(f"{name}: процедура {expected[key]}, KpiCumulative {actual[key]}")
+    return mismatches
+
+def get_quality_results(year, month, man_id=None, specid=None):
+    """
+    Доля валидированных документов и визитов по заболеванию за месяц -
+    готовые строки KpiQualityResult, без повторного чтения визитов.
+    man_id - ID пользователя врача в МИС, specid - ID специальности в МИС.
+    При неоднозначном man_id (см. resolve_man_source) строк нет
+    """
+    try:
+        results = KpiQualityResult.objects.filter(
+            period=f"{year:04d}-{month:02d}"
+        ).select_related('doctor', 'specialization')
+        if man_id is not None:
+            results = filter_by_man(results, man_id)
+        if specid is not None:
+            results = results.filter(specialization__keyidmis=specid)
+        return list(results.order_by('doctor__docnamemis', 'doctorid'))
+    except Exception as e:
+        print(f"Ошибка при получении показателей качества: {e}")
+        return []
+
 @login_required
 def dynamic_plan_fact_view(request):
-    """View с ДИНАМИЧЕСКИМИ колонками из структуры процедуры БД"""
+    """View сравнения план-факт по нарастающему итогу (KpiCumulative)"""
     
     # Параметры из GET-запроса
     year = request.GET.get('year')
@@ -40,58 +168,15 @@ def dynamic_plan_fact_view(request):
     specid = int(specid) if specid and specid.strip() else None
     plan_vistype = int(plan_vistype) if plan_vistype and plan_vistype.strip() else None
     
-    columns = []
+    columns = PLAN_FACT_COLUMNS
     data = []
     error_message = None
     
     try:
-        with connection.cursor() as cursor:
-            # Получаем структуру через LIMIT 0
-            test_sql = """
-            SELECT * FROM kpi.get_monthly_plan_fact_comparison(%s, %s, %s, %s, %s) LIMIT 0
-            """
-            test_params = [year, month, man_id, specid, plan_vistype]
-            cursor.execute(test_sql, test_params)
-            
-            # Получаем колонки из description курсора
-            if cursor.description:
-                columns = [col[0] for col in cursor.description]
-                print(f"✅ Получены колонки из процедуры: {columns}")
-            else:
-                # Резервный - статический список
-                columns = [
-                    'Год', 'Месяц', 'Врач', 'Специальность', 'Тип_посещения',
-                    'План_на_год', 'План_нарастающий_итог', 'Факт_нарастающий_итог',
-                    'Процент_нарастающий_итог', 'План_за_месяц', 'Факт_за_месяц', 'Процент_за_месяц'
-                ]
-                print(f"⚠️ Используем статический список колонок: {columns}")
-            
-            # Получаем реальные данные
-            data_sql = """
-            SELECT * FROM kpi.get_monthly_plan_fact_comparison(%s, %s, %s, %s, %s)
-            """
-            cursor.execute(data_sql, test_params)
-            results = cursor.fetchall()
-            
-            # Преобразуем в список словарей
-            for row in results:
-                row_dict = {}
-                for i, value in enumerate(row):
-                    col_name = columns[i] if i < len(columns) else f'col_{i}'
-                    row_dict[col_name] = value
-                data.append(row_dict)
-            
-            print(f"✅ Получено записей: {len(data)}")
-            
+        data = get_plan_fact_rows(year, month, man_id, specid, plan_vistype)
     except Exception as e:
         error_message = str(e)
         print(f"❌ Ошибка: {error_message}")
-        # В случае ошибки используем статический список
-        columns = [
-            'Год', 'Месяц', 'Врач', 'Специальность', 'Тип_посещения',
-            'План_на_год', 'План_нарастающий_итог', 'Факт_нарастающий_итог',
-            'Процент_нарастающий_итог', 'План_за_месяц', 'Факт_за_месяц', 'Процент_за_месяц'
-        ]
 
     # ПОЛУЧАЕМ ДАННЫЕ ДЛЯ ВЫПАДАЮЩИХ СПИСКОВ
     doctors_data = []
@@ -148,6 +233,7 @@ def dynamic_plan_fact_view(request):
         'data': data,
         'total': len(data),
         'error_message': error_message,
+        'quality_results': get_quality_results(year, month, man_id, specid),
         'form_filters': {
             'man_id': form_man_id,
             'specid': form_specid,
@@ -1,6 +1,7 @@
 # kpi_core/config.py
 
 import os
+from importlib.util import find_spec
 from pathlib import Path
 from django.core.exceptions import ImproperlyConfigured
 
@@ -46,17 +47,82 @@ class ConfigManager:
                 }
             }
         }
+        ConfigManager._apply_connection_settings(databases['default'], config, 'DB_')
         
         # БД МИС (опционально)
         mis_host = config.get('MIS_DB_HOST')
         if mis_host:
-            databases['mis'] = {
-                'ENGINE': 'django.db.backends.postgresql',
-                'NAME': config.get('MIS_DB_NAME', ''),
-                'USER': config.get('MIS_DB_USER', ''),
-                'PASSWORD': config.get('MIS_DB_PASSWORD', ''),
-                'HOST': mis_host,
-                'PORT': config.get('MIS_DB_PORT', '5432'),
-            }
+            databases['mis'] = ConfigManager._mis_database(config, 'MIS_DB_')
+        
+        # Дополнительные МИС клиник: MIS_SOURCES=clinic1,clinic2 и ключи
+        # MIS_CLINIC1_DB_HOST, MIS_CLINIC1_DB_NAME, ... - алиасы mis_clinic1, mis_clinic2
+        for source_id in ConfigManager.parse_mis_sources(config.get('MIS_SOURCES', '')):
+            prefix = f'MIS_{source_id.upper()}_DB_'
+            if config.get(f'{prefix}HOST'):
+                databases[f'mis_{source_id}'] = ConfigManager._mis_database(config, prefix)
+        
+        return databases
+    
+    @staticmethod
+    def parse_mis_sources(value):
+        """Список ID источников МИС из строки 'clinic1, clinic2'"""
+        return [source_id.strip().lower() for source_id in value.split(',') if source_id.strip()]
+    
+    @staticmethod
+    def _mis_database(config, prefix):
+        """Настройки подключения к одной БД МИС по префиксу ключей .env"""
+        database = {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': config.get(f'{prefix}NAME', ''),
+            'USER': config.get(f'{prefix}USER', ''),
+            'PASSWORD': config.get(f'{prefix}PASSWORD', ''),
+            'HOST': config.get(f'{prefix}HOST'),
+            'PORT': config.get(f'{prefix}PORT', '5432'),
+            'OPTIONS': {},
+        }
+        ConfigManager._apply_connection_settings(database, config, prefix)
+        return database
+    
+    @staticmethod
+    def _apply_connection_settings(database, config, prefix):
+        """
+        Переиспользование соединений по ключам .env с префиксом БД (DB_, MIS_DB_, ...):
+            CONN_MAX_AGE       - сколько секунд держать соединение открытым (0 - закрывать
+                                 после запроса, пусто - бессрочно), по умолчанию 0,
+                                 как в Django
+            CONN_HEALTH_CHECKS - проверять соединение перед повторным использованием (true)
+            STATEMENT_TIMEOUT  - ограничение времени запроса, мс (0 - без ограничения)
+            POOL_SIZE          - размер пула соединений (0 - без пула); пул работает
+                                 только с драйвером psycopg 3 и пакетом psycopg_pool.
+                                 Установленный psycopg 3 Django выбирает вместо psycopg2,
+                                 поэтому COPY идет через bulk_loader.copy_from,
+                                 поддерживающий оба драйвера. Без этих пакетов
+                                 POOL_SIZE - ошибка конфигурации
+            POOL_TIMEOUT       - сколько секунд ждать свободное соединение пула (30)
+        """
+        options = database.setdefault('OPTIONS', {})
+        # Имя приложения видно в pg_stat_activity - по нему считается статистика соединений
+        options['application_name'] = config.get(f'{prefix}APPLICATION_NAME', 'kpi')
         
-        return databases
\ No newline at end of file
+        statement_timeout = int(config.get(f'{prefix}STATEMENT_TIMEOUT', '0') or 0)
+        if statement_timeout:
+            options['options'] = f'-c statement_timeout={statement_timeout}'
+        
+        max_age = config.get(f'{prefix}CONN_MAX_AGE', '0')
+        database['CONN_MAX_AGE'] = int(max_age) if max_age else None
+        database['CONN_HEALTH_CHECKS'] = config.get(f'{prefix}CONN_HEALTH_CHECKS', 'true').lower() == 'true'
+        
+        pool_size = int(config.get(f'{prefix}POOL_SIZE', '0') or 0)
+        if pool_size:
+            if not (find_spec('psycopg') and find_spec('psycopg_pool')):
+                raise ImproperlyConfigured(
+                    f"{prefix}POOL_SIZE задан, но пул недоступен: "
+                    "установите пакеты psycopg и psycopg_pool (pip install 'psycopg[pool]')"
+                )
+            # Пул несовместим с постоянными соединениями Django
+            options['pool'] = {
+                'min_size': 1,
+                'max_size': pool_size,
+                'timeout': int(config.get(f'{prefix}POOL_TIMEOUT', '30') or 30),
+            }
+            database['CONN_MAX_AGE'] = 0
\ No newline at end of file
@@ -8,6 +8,7 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 sys.path.insert(0, os.path.join(BASE_DIR, 'apps'))
 
 # Используем ConfigManager
+from django.core.exceptions import ImproperlyConfigured
 from .config import ConfigManager
 
 IS_CONFIGURED = ConfigManager.is_configured()
@@ -20,6 +21,10 @@ if IS_CONFIGURED:
     # Пытаемся загрузить БД
     try:
         DATABASES = ConfigManager.get_django_databases()
+    except ImproperlyConfigured:
+        # Ошибка в настройках .env (например, POOL_SIZE без psycopg_pool) -
+        # не уходим молча в мастер настройки
+        raise
     except Exception as e:
         IS_CONFIGURED = False  # Принудительно сбрасываем
 
@@ -71,6 +76,9 @@ if IS_CONFIGURED:
     
     ROOT_URLCONF = 'kpi_core.urls'
     
+    # Тестовая БД: неуправляемые таблицы создаются до миграций
+    TEST_RUNNER = 'kpi_core.test_runner.KpiTestRunner'
+    
 else:
     # ==========================================
     # РЕЖИМ МАСТЕРА НАСТРОЙКИ (первый запуск)
@@ -0,0 +1,53 @@
+# kpi_core/test_runner.py
+
+"""
+Запуск тестов с тестовой БД.
+
+Таблицы solution_med.import_* и kpi.* не управляются Django (managed = False),
+но миграции меняют их (RunSQL) и ссылаются на них внешними ключами. В рабочей
+БД их создает PostgreSQL, в тестовой - этот раннер до первой миграции.
+"""
+
+from django.apps import apps
+from django.db import connections
+from django.db.models.signals import pre_migrate
+from django.test.runner import DiscoverRunner
+
+# Схемы и неуправляемые таблицы в порядке зависимостей (roles до users)
+UNMANAGED_SCHEMAS = ['solution_med', 'kpi']
+UNMANAGED_MODELS = [
+    'users.Role',
+    'users.User',
+    'integration.MisImportedSpecialization',
+    'integration.MisImportedPurpose',
+    'integration.MisImportedDoctor',
+    'integration.MisImportedMan',
+    'integration.MisImportedVisit',
+    'plans.KpiPlan',
+]
+
+
+class KpiTestRunner(DiscoverRunner):
+    """DiscoverRunner, создающий неуправляемые таблицы в тестовой БД"""
+
+    def setup_databases(self, **kwargs):
+        prepared = set()
+
+        def create_unmanaged_tables(sender, using, **signal_kwargs):
+            # pre_migrate приходит по разу на каждое приложение - таблицы нужны один раз
+            if using in prepared:
+                return
+            prepared.add(using)
+            connection = connections[using]
+            with connection.cursor() as cursor:
+                for schema in UNMANAGED_SCHEMAS:
+                    cursor.execute(f'CREATE SCHEMA IF NOT EXISTS {schema}')
+            with connection.schema_editor() as editor:
+                for label in UNMANAGED_MODELS:
+                    editor.create_model(apps.get_model(label))
+
+        pre_migrate.connect(create_unmanaged_tables, dispatch_uid='kpi_unmanaged_tables')
+        try:
+            return super().setup_databases(**kwargs)
+        finally:
+            pre_migrate.disconnect(dispatch_uid='kpi_unmanaged_tables')